@@ -14,20 +14,74 @@ import logging
 import voluptuous as vol
 
 from homeassistant.const import SERVICE_RELOAD
-from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.core import (
+    HomeAssistant,
+    ServiceCall,
+    ServiceResponse,
+    SupportsResponse,
+)
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.reload import async_reload_integration_platforms
 from homeassistant.helpers.typing import ConfigType
 
-from .const import DOMAIN, PLATFORMS, STARTUP_MESSAGE
+from .const import (
+    CONF_EXECUTOR_THRESHOLD,
+    CONF_LIMIT,
+    CONF_MAX_CONCURRENT_QUERIES,
+    CONF_STARTUP_JITTER,
+    DATA_EXECUTOR_THRESHOLD,
+    DATA_HISTORY_CACHE,
+    DATA_SENSORS,
+    DATA_STARTUP_SCHEDULER,
+    DEFAULT_EXECUTOR_THRESHOLD,
+    DEFAULT_MAX_CONCURRENT_QUERIES,
+    DEFAULT_PERFORMANCE_LIMIT,
+    DEFAULT_STARTUP_JITTER,
+    DOMAIN,
+    PLATFORMS,
+    SERVICE_GET_PERFORMANCE,
+    STARTUP_MESSAGE,
+)
+from .history_cache import HistoryCache
+from .scheduler import StartupScheduler
 
 _LOGGER = logging.getLogger(__name__)
 
+CONFIG_SCHEMA = vol.Schema(
+    {
+        vol.Optional(DOMAIN): vol.Schema(
+            {
+                vol.Optional(
+                    CONF_MAX_CONCURRENT_QUERIES, default=DEFAULT_MAX_CONCURRENT_QUERIES
+                ): vol.All(vol.Coerce(int), vol.Range(min=1)),
+                vol.Optional(
+                    CONF_STARTUP_JITTER, default=DEFAULT_STARTUP_JITTER
+                ): cv.positive_time_period,
+                vol.Optional(
+                    CONF_EXECUTOR_THRESHOLD, default=DEFAULT_EXECUTOR_THRESHOLD
+                ): cv.positive_int,
+            }
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
 
 async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
     """Set up the platforms."""
     # Print startup message
     _LOGGER.info(STARTUP_MESSAGE)
 
+    conf = config.get(DOMAIN, {})
+    max_queries = conf.get(CONF_MAX_CONCURRENT_QUERIES, DEFAULT_MAX_CONCURRENT_QUERIES)
+    hass.data[DATA_HISTORY_CACHE] = HistoryCache(hass, max_queries=max_queries)
+    hass.data[DATA_STARTUP_SCHEDULER] = StartupScheduler(
+        hass, max_queries, conf.get(CONF_STARTUP_JITTER, DEFAULT_STARTUP_JITTER)
+    )
+    hass.data[DATA_EXECUTOR_THRESHOLD] = conf.get(
+        CONF_EXECUTOR_THRESHOLD, DEFAULT_EXECUTOR_THRESHOLD
+    )
+
     async def reload_service_handler(service: ServiceCall) -> None:
         """Reload all average sensors from config."""
         await async_reload_integration_platforms(hass, DOMAIN, PLATFORMS)
@@ -36,4 +90,38 @@ async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
         DOMAIN, SERVICE_RELOAD, reload_service_handler, schema=vol.Schema({})
     )
 
+    async def get_performance_service_handler(service: ServiceCall) -> ServiceResponse:
+        """Return performance counters of the slowest average sensors."""
+        sensors = sorted(
+            hass.data.get(DATA_SENSORS, ()),
+            key=lambda sensor: sensor.update_stats.mean_duration,
+            reverse=True,
+        )
+        cache = hass.data.get(DATA_HISTORY_CACHE)
+        return {
+            "history_cache_rows": cache.rows if cache is not None else 0,
+            "sensors": [
+                {
+                    "entity_id": sensor.entity_id,
+                    "name": sensor.name,
+                    **sensor.update_stats.as_dict(),
+                }
+                for sensor in sensors[: service.data[CONF_LIMIT]]
+            ],
+        }
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_PERFORMANCE,
+        get_performance_service_handler,
+        schema=vol.Schema(
+            {
+                vol.Optional(CONF_LIMIT, default=DEFAULT_PERFORMANCE_LIMIT): vol.All(
+                    vol.Coerce(int), vol.Range(min=1)
+                ),
+            }
+        ),
+        supports_response=SupportsResponse.ONLY,
+    )
+
     return True
@@ -0,0 +1,395 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+
+Past states of the sensor are computed from the recorder database without
+running Home Assistant:
+
+    python -m custom_components.average.backfill home-assistant_v2.db \
+        sensor.outside_temperature --duration 24:00:00 --step 1:00:00 \
+        --start 2025-10-01 --end 2026-10-01 --output average.csv
+"""
+from __future__ import annotations
+
+import argparse
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from functools import partial
+import json
+import logging
+import math
+import os
+from typing import Any, Final, NamedTuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from homeassistant.const import ATTR_UNIT_OF_MEASUREMENT, UnitOfTemperature
+from homeassistant.core import split_entity_id
+import homeassistant.util.dt as dt_util
+
+from .const import DEFAULT_PRECISION
+from .database import get_last_attributes, iter_states
+from .engine import SourceWindow
+from .extractor import TEMPERATURE_ATTRIBUTES, ValueExtractor, is_temperature_entity
+from .history_cache import HistoryRows
+from .long_term import HOUR
+
+FORMAT_CSV: Final = "csv"
+FORMAT_PARQUET: Final = "parquet"
+FORMAT_STATISTICS: Final = "statistics"
+FORMATS: Final = (FORMAT_CSV, FORMAT_PARQUET, FORMAT_STATISTICS)
+
+COLUMNS: Final = ("timestamp", "state", "available_sources", "count", "min", "max")
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Point(NamedTuple):
+    """State of the sensor at the end of one period."""
+
+    timestamp: float
+    state: float | None
+    available_sources: int
+    count: int
+    min_value: float | None
+    max_value: float | None
+
+
+def backfill_source(
+    chunks: Iterable[HistoryRows],
+    extractor: ValueExtractor,
+    timestamps: Sequence[float],
+    duration: float,
+) -> list[tuple[float | None, int, float | None, float | None]]:
+    """Return average, count, minimum and maximum of source values at points.
+
+    Every point of time is the end of a period of given duration. States are
+    read in chunks into a sliding window, and every point is computed as soon
+    as all states up to it are read.
+    """
+    window = SourceWindow()
+    results = []
+
+    def compute_until(until_ts: float) -> None:
+        while len(results) < len(timestamps) and timestamps[len(results)] < until_ts:
+            end_ts = timestamps[len(results)]
+            start_ts = end_ts - duration
+            window.evict(start_ts)
+            results.append(
+                (window.average(start_ts, end_ts), *window.extremes(start_ts, end_ts))
+            )
+
+    for rows in chunks:
+        # States with timestamps equal to the last one may be in the next chunk
+        compute_until(rows.timestamps[0])
+        values = []
+        measured = []
+        for state in rows.states:
+            value, is_measured = extractor.parse(state, {})
+            values.append(value)
+            measured.append(is_measured)
+        window.extend(rows.timestamps, values, measured)
+    compute_until(math.inf)
+    return results
+
+
+def combine(
+    timestamps: Sequence[float],
+    sources: Sequence[Sequence[tuple[float | None, int, float | None, float | None]]],
+    precision: int = DEFAULT_PRECISION,
+) -> list[Point]:
+    """Return states of the sensor combined from results of its sources."""
+    points = []
+    for index, timestamp in enumerate(timestamps):
+        values = []
+        count = 0
+        min_value = max_value = None
+        for results in sources:
+            value, source_count, source_min, source_max = results[index]
+            if value is not None:
+                values.append(value)
+            if source_min is None:
+                continue
+            count += source_count
+            source_min = round(source_min, precision)
+            source_max = round(source_max, precision)
+            if min_value is None:
+                min_value, max_value = source_min, source_max
+            else:
+                min_value = min(min_value, source_min)
+                max_value = max(max_value, source_max)
+
+        state = None
+        if values:
+            state = round(sum(values) / len(values), precision)
+            if precision < 1:
+                state = int(state)
+        points.append(Point(timestamp, state, len(values), count, min_value, max_value))
+    return points
+
+
+def database_url(database: str) -> str:
+    """Return URL of the database; SQLite files are opened read-only."""
+    if "://" in database:
+        return database
+    return f"sqlite:///file:{os.path.abspath(database)}?mode=ro&uri=true"
+
+
+def _backfill_entity(
+    url: str,
+    entity_id: str,
+    attributes: dict[str, Any],
+    timestamps: Sequence[float],
+    duration: float,
+    temperature: bool,
+    ha_unit: str,
+    undef: float | None,
+) -> list[tuple[float | None, int, float | None, float | None]]:
+    """Return results of one source reading its states from the database.
+
+    It runs in a worker process, so the database is opened there.
+    """
+    extractor = ValueExtractor(entity_id, attributes, temperature, ha_unit, undef)
+    engine = create_engine(url)
+    try:
+        with Session(engine) as session:
+            chunks = iter_states(
+                session, entity_id, timestamps[0] - duration, timestamps[-1]
+            )
+            results = backfill_source(chunks, extractor, timestamps, duration)
+    finally:
+        engine.dispose()
+    _LOGGER.info('Entity "%s" is processed', entity_id)
+    return results
+
+
+def write_csv(path: str, points: Iterable[Point]) -> None:
+    """Write states of the sensor to CSV file."""
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(COLUMNS)
+        for point in points:
+            writer.writerow(
+                (dt_util.utc_from_timestamp(point.timestamp).isoformat(), *point[1:])
+            )
+
+
+def write_parquet(path: str, points: Sequence[Point]) -> None:
+    """Write states of the sensor to Parquet file.
+
+    It needs `pyarrow` package.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import pyarrow as pa
+
+    # pylint: disable-next=import-outside-toplevel
+    from pyarrow import parquet
+
+    columns = list(zip(*points))
+    table = pa.table(
+        {
+            COLUMNS[0]: pa.array(
+                [dt_util.utc_from_timestamp(ts) for ts in columns[0]],
+                pa.timestamp("us", tz="UTC"),
+            ),
+            **{
+                name: pa.array(column, pa.int64() if name == "count" else None)
+                for name, column in zip(COLUMNS[1:], columns[1:])
+            },
+        }
+    )
+    parquet.write_table(table, path)
+
+
+def write_statistics(
+    path: str,
+    points: Iterable[Point],
+    statistic_id: str,
+    name: str | None,
+    unit: str | None,
+) -> None:
+    """Write hourly statistics of the sensor to JSON file to be imported.
+
+    Every hour gets the sensor state at its end. The file is the message of
+    `recorder/import_statistics` websocket command without id and type.
+    """
+    stats = [
+        {
+            "start": dt_util.utc_from_timestamp(point.timestamp - HOUR).isoformat(),
+            "mean": point.state,
+            "min": point.state,
+            "max": point.state,
+        }
+        for point in points
+        if point.state is not None
+    ]
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "metadata": {
+                    "has_mean": True,
+                    "has_sum": False,
+                    "name": name,
+                    "source": "recorder",
+                    "statistic_id": statistic_id,
+                    "unit_of_measurement": unit,
+                },
+                "stats": stats,
+            },
+            file,
+            indent=2,
+        )
+
+
+def _parse_datetime(value: str) -> float:
+    """Return timestamp of datetime; naive ones are in UTC."""
+    parsed = dt_util.parse_datetime(value)
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"invalid datetime: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_util.UTC)
+    return parsed.timestamp()
+
+
+def _parse_duration(value: str) -> float:
+    """Return positive duration in seconds."""
+    parsed = dt_util.parse_duration(value)
+    if parsed is None or parsed.total_seconds() <= 0:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value}")
+    return parsed.total_seconds()
+
+
+def _get_parser() -> argparse.ArgumentParser:
+    """Return parser of command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Compute past states of an average sensor from the recorder"
+        " database without running Home Assistant.",
+    )
+    parser.add_argument(
+        "database", help="path to SQLite file of the recorder or database URL"
+    )
+    parser.add_argument("entities", nargs="+", help="source entity IDs")
+    parser.add_argument(
+        "--duration", type=_parse_duration, required=True, help="averaging period"
+    )
+    parser.add_argument(
+        "--step",
+        type=_parse_duration,
+        default=float(HOUR),
+        help="interval between computed states (default: 1:00:00)",
+    )
+    parser.add_argument(
+        "--start", type=_parse_datetime, required=True, help="first computed state"
+    )
+    parser.add_argument(
+        "--end", type=_parse_datetime, required=True, help="last computed state"
+    )
+    parser.add_argument("--output", required=True, help="output file")
+    parser.add_argument("--format", choices=FORMATS, default=FORMAT_CSV)
+    parser.add_argument("--precision", type=int, default=DEFAULT_PRECISION)
+    parser.add_argument("--process-undef-as", type=float, dest="undef")
+    parser.add_argument(
+        "--temperature-unit",
+        choices=[unit.value for unit in UnitOfTemperature],
+        default=UnitOfTemperature.CELSIUS.value,
+        help="unit of temperature of Home Assistant",
+    )
+    parser.add_argument(
+        "--statistic-id", help="statistic ID of the sensor for the statistics format"
+    )
+    parser.add_argument("--name", help="name of the sensor for the statistics format")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes"
+    )
+    return parser
+
+
+def main(argv: Sequence[str] | None = None) -> None:
+    """Compute states of the sensor and write them to the output file."""
+    parser = _get_parser()
+    args = parser.parse_args(argv)
+    if args.end < args.start:
+        parser.error("--end must not be before --start")
+    if args.format == FORMAT_STATISTICS:
+        if args.statistic_id is None:
+            parser.error("--statistic-id is required for the statistics format")
+        if args.step != HOUR or args.start % HOUR:
+            parser.error("statistics are hourly: --step and --start must be hours")
+    unsupported = [
+        entity_id
+        for entity_id in args.entities
+        if split_entity_id(entity_id)[0] in TEMPERATURE_ATTRIBUTES
+    ]
+    if unsupported:
+        parser.error(
+            "temperature in attributes is not supported: " + ", ".join(unsupported)
+        )
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    url = database_url(args.database)
+    engine = create_engine(url)
+    try:
+        with Session(engine) as session:
+            attributes = {
+                entity_id: get_last_attributes(session, entity_id)
+                for entity_id in args.entities
+            }
+    finally:
+        engine.dispose()
+
+    # Mode of the sensor is set by the first source with states
+    first = next(
+        (entity_id for entity_id in args.entities if attributes[entity_id]),
+        args.entities[0],
+    )
+    temperature = is_temperature_entity(first, attributes[first])
+    unit = (
+        args.temperature_unit
+        if temperature
+        else attributes[first].get(ATTR_UNIT_OF_MEASUREMENT)
+    )
+
+    count = math.floor((args.end - args.start) / args.step) + 1
+    timestamps = [args.start + index * args.step for index in range(count)]
+    _LOGGER.info(
+        "Compute %s states from %s sources", len(timestamps), len(args.entities)
+    )
+    worker = partial(
+        _backfill_entity,
+        url,
+        timestamps=timestamps,
+        duration=args.duration,
+        temperature=temperature,
+        ha_unit=args.temperature_unit,
+        undef=args.undef,
+    )
+    entities = [(entity_id, attributes[entity_id]) for entity_id in args.entities]
+    workers = max(1, min(args.workers or 1, len(entities)))
+    if workers == 1:
+        sources = [worker(*entity) for entity in entities]
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            sources = list(executor.map(worker, *zip(*entities)))
+    points = combine(timestamps, sources, args.precision)
+
+    if args.format == FORMAT_CSV:
+        write_csv(args.output, points)
+    elif args.format == FORMAT_PARQUET:
+        try:
+            write_parquet(args.output, points)
+        except ImportError:
+            parser.error("the parquet format needs pyarrow package")
+    else:
+        write_statistics(args.output, points, args.statistic_id, args.name, unit)
+    _LOGGER.info("States are written to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from array import array
+import base64
+from bisect import bisect_left
+from collections.abc import Callable, Mapping, Sequence
+import math
+import sys
+from typing import Any
+
+from .engine import SourceWindow
+
+# Columns of aggregates of every bucket
+_COLUMNS = (
+    ("d", "starts"),  # Start timestamp
+    ("d", "integral"),  # Time-weighted integral of values
+    ("d", "elapsed"),  # Time covered by defined values
+    ("q", "count"),  # Count of measured values of samples in the bucket
+    ("d", "min"),  # Minimum of measured values in effect; NaN if none
+    ("d", "max"),  # Maximum of measured values in effect; NaN if none
+)
+
+
+class BucketWindow:
+    """Time-weighted sliding window of one source samples folded into buckets.
+
+    Samples of completed buckets of fixed size are folded into aggregates:
+    integral, covered time, count, minimum and maximum values. Only raw
+    samples of the current bucket are kept, so memory and cost of updates
+    depend on length of the window divided by size of buckets, not on how
+    often the source changes.
+
+    The window start is generally inside a bucket; raw samples of that
+    bucket (the head) have to be set with `set_head` to compute the part of
+    the bucket that is in the window exactly.
+    """
+
+    def __init__(
+        self,
+        size: float,
+        channels: Mapping[str, Callable[[float], float]] | None = None,
+    ) -> None:
+        """Initialize the window."""
+        self.size = size
+        self._channels = dict(channels or {})
+        self._raw = SourceWindow(self._channels)
+        self._columns = {key: array(typecode) for typecode, key in _COLUMNS}
+        # Integrals of channels of every bucket
+        self._channel_integrals = {name: array("d") for name in self._channels}
+        # End of folded buckets; raw samples are kept from it
+        self._end_ts: float | None = None
+        # Raw samples of the bucket that ends at `_head_end_ts`
+        self._head: SourceWindow | None = None
+        self._head_end_ts: float | None = None
+
+    def __len__(self) -> int:
+        """Return count of raw samples and buckets in the window."""
+        return len(self._raw) + len(self._columns["starts"])
+
+    def clear(self) -> None:
+        """Drop all samples."""
+        # pylint: disable-next=unnecessary-dunder-call
+        self.__init__(self.size, self._channels)
+
+    def copy(self) -> BucketWindow:
+        """Return a copy of the window."""
+        window = BucketWindow(self.size, self._channels)
+        window._raw = self._raw.copy()
+        window._columns = {key: column[:] for key, column in self._columns.items()}
+        window._channel_integrals = {
+            name: column[:] for name, column in self._channel_integrals.items()
+        }
+        window._end_ts = self._end_ts
+        # Head is never changed, only replaced
+        window._head = self._head
+        window._head_end_ts = self._head_end_ts
+        return window
+
+    @property
+    def end_ts(self) -> float | None:
+        """Return end of folded buckets."""
+        return self._end_ts
+
+    @property
+    def last_ts(self) -> float | None:
+        """Return timestamp of the last sample."""
+        return self._raw.last_ts
+
+    @property
+    def last_value(self) -> float | None:
+        """Return value of the last sample."""
+        return self._raw.last_value
+
+    def floor(self, ts: float) -> float:
+        """Return start of the bucket that contains given time."""
+        return math.floor(ts / self.size) * self.size
+
+    def ceil(self, ts: float) -> float:
+        """Return start of the next bucket if not at it already."""
+        return math.ceil(ts / self.size) * self.size
+
+    def next_ts(self, ts: float) -> float | None:
+        """Return time after given one when the window content changes."""
+        if self._end_ts is None or ts >= self._end_ts:
+            return self._raw.next_ts(ts)
+        if self._head is not None and ts < self._head_end_ts:
+            sample_ts = self._head.next_ts(ts)
+            if sample_ts is not None and sample_ts < self._head_end_ts:
+                return sample_ts
+        return self.floor(ts) + self.size
+
+    def append(self, ts: float, value: float | None, measured: bool) -> None:
+        """Add a new sample to the end of the window."""
+        self._raw.append(ts, value, measured)
+
+    def extend(
+        self,
+        timestamps: Sequence[float],
+        values: Sequence[float | None],
+        measured: Sequence[bool],
+    ) -> None:
+        """Add a batch of new samples to the end of the window."""
+        self._raw.extend(timestamps, values, measured)
+
+    def fold(self, until_ts: float) -> None:
+        """Fold raw samples of buckets completed before given time."""
+        until_ts = self.floor(until_ts)
+        raw = self._raw
+        if not len(raw):
+            return
+        start_ts = self._end_ts
+        if start_ts is None:
+            start_ts = self.ceil(raw.first_ts)
+        if until_ts <= start_ts:
+            return
+        if self._end_ts is None and raw.first_ts < start_ts:
+            # Raw samples before the first bucket are the head
+            self.set_head(start_ts, raw.slice(raw.first_ts, start_ts))
+
+        columns = self._columns
+        bucket_ts = start_ts
+        while bucket_ts < until_ts:
+            end_ts = bucket_ts + self.size
+            integral, elapsed = raw.integrate(bucket_ts, end_ts)
+            count = raw.count(bucket_ts, end_ts)
+            if elapsed or count:
+                _, min_value, max_value = raw.extremes(bucket_ts, end_ts)
+                columns["starts"].append(bucket_ts)
+                columns["integral"].append(integral)
+                columns["elapsed"].append(elapsed)
+                columns["count"].append(count)
+                columns["min"].append(math.nan if min_value is None else min_value)
+                columns["max"].append(math.nan if max_value is None else max_value)
+                for name, column in self._channel_integrals.items():
+                    column.append(raw.integrate_channel(name, bucket_ts, end_ts))
+            bucket_ts = end_ts
+
+        self._end_ts = until_ts
+        raw.evict(until_ts)
+
+    def head_needed(self, start_ts: float) -> float | None:
+        """Return end of the head bucket if its raw samples are needed."""
+        head_end_ts = self.ceil(start_ts)
+        if (
+            self._end_ts is None
+            or start_ts >= self._end_ts
+            or head_end_ts == start_ts
+            or head_end_ts == self._head_end_ts
+        ):
+            return None
+        return head_end_ts
+
+    def set_head(self, end_ts: float, window: SourceWindow) -> None:
+        """Set raw samples of the bucket that ends at given time."""
+        self._head = window
+        self._head_end_ts = end_ts
+
+    def evict(self, start_ts: float) -> None:
+        """Drop buckets and samples that have slid out of the window."""
+        index = bisect_left(self._columns["starts"], start_ts)
+        if index:
+            for column in (*self._columns.values(), *self._channel_integrals.values()):
+                del column[:index]
+        if self._head_end_ts is not None and self._head_end_ts < start_ts:
+            self._head = self._head_end_ts = None
+        self._raw.evict(start_ts)
+
+    def _parts(
+        self, start_ts: float, end_ts: float
+    ) -> tuple[tuple[SourceWindow, float, float] | None, int, int, float, float]:
+        """Return parts of the period: raw head, range of buckets and raw tail.
+
+        Head is None if the period has no part before the first whole bucket.
+        The period must not end before the end of folded buckets.
+        """
+        if self._end_ts is None or start_ts >= self._end_ts:
+            return None, 0, 0, start_ts, end_ts
+
+        buckets_start_ts = self.ceil(start_ts)
+        buckets_end_ts = min(self._end_ts, self.floor(end_ts))
+        head = None
+        if buckets_start_ts > start_ts:
+            if self._head is None or self._head_end_ts != buckets_start_ts:
+                raise ValueError("Raw samples of the head bucket are not set")
+            head = (self._head, start_ts, min(buckets_start_ts, end_ts))
+        starts = self._columns["starts"]
+        first = bisect_left(starts, buckets_start_ts)
+        last = bisect_left(starts, buckets_end_ts)
+        return head, first, last, min(self._end_ts, end_ts), end_ts
+
+    def integrate(self, start_ts: float, end_ts: float) -> tuple[float, float]:
+        """Return time-weighted integral and covered time over the period."""
+        head, first, last, tail_start_ts, tail_end_ts = self._parts(start_ts, end_ts)
+        integral = math.fsum(memoryview(self._columns["integral"])[first:last])
+        elapsed = math.fsum(memoryview(self._columns["elapsed"])[first:last])
+        parts = [self._raw.integrate(tail_start_ts, tail_end_ts)]
+        if head is not None:
+            parts.append(head[0].integrate(head[1], head[2]))
+        for part in parts:
+            integral += part[0]
+            elapsed += part[1]
+        return integral, elapsed
+
+    def integrate_channel(self, name: str, start_ts: float, end_ts: float) -> float:
+        """Return time-weighted integral of channel over the period."""
+        head, first, last, tail_start_ts, tail_end_ts = self._parts(start_ts, end_ts)
+        integral = math.fsum(memoryview(self._channel_integrals[name])[first:last])
+        integral += self._raw.integrate_channel(name, tail_start_ts, tail_end_ts)
+        if head is not None:
+            integral += head[0].integrate_channel(name, head[1], head[2])
+        return integral
+
+    def average(self, start_ts: float, end_ts: float) -> float | None:
+        """Return time-weighted average value over the period."""
+        integral, elapsed = self.integrate(start_ts, end_ts)
+        if elapsed:
+            return integral / elapsed
+        if self._end_ts is not None:
+            start_ts = max(start_ts, min(self._end_ts, end_ts))
+        return self._raw.average(start_ts, end_ts)
+
+    def extremes(
+        self, start_ts: float, end_ts: float
+    ) -> tuple[int, float | None, float | None]:
+        """Return count, minimum and maximum of measured values over the period."""
+        head, first, last, tail_start_ts, tail_end_ts = self._parts(start_ts, end_ts)
+        count = sum(memoryview(self._columns["count"])[first:last])
+        values = [
+            value
+            for value in (
+                *memoryview(self._columns["min"])[first:last],
+                *memoryview(self._columns["max"])[first:last],
+            )
+            if not math.isnan(value)
+        ]
+
+        if head is None and tail_start_ts == start_ts:
+            # The sample in effect at the period start is counted
+            tail = self._raw.extremes(tail_start_ts, tail_end_ts)
+        else:
+            tail = (
+                self._raw.count(tail_start_ts, tail_end_ts),
+                *self._raw.extremes(tail_start_ts, tail_end_ts)[1:],
+            )
+        parts = [tail]
+        if head is not None:
+            parts.append(head[0].extremes(head[1], head[2]))
+        for part_count, min_value, max_value in parts:
+            count += part_count
+            if min_value is not None:
+                values.extend((min_value, max_value))
+
+        if not values:
+            return count, None, None
+        return count, min(values), max(values)
+
+    def sketch(self, start_ts: float, end_ts: float) -> None:
+        """Return None as buckets have no quantile sketches."""
+        return None
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return buckets and raw samples of the window packed to be stored."""
+        columns = {
+            key: base64.b64encode(column.tobytes()).decode()
+            for key, column in self._columns.items()
+        }
+        return {
+            "byteorder": sys.byteorder,
+            "size": self.size,
+            "end_ts": self._end_ts,
+            "columns": columns,
+            "channels": {
+                name: base64.b64encode(column.tobytes()).decode()
+                for name, column in self._channel_integrals.items()
+            },
+            "raw": self._raw.as_dict(),
+        }
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Mapping[str, Any],
+        size: float,
+        channels: Mapping[str, Callable[[float], float]] | None = None,
+    ) -> BucketWindow:
+        """Return window with buckets and raw samples unpacked from dict."""
+        if data["size"] != size:
+            raise ValueError("Stored buckets have different size")
+
+        def unpack(typecode: str, packed: str) -> array:
+            column = array(typecode, base64.b64decode(packed))
+            if data["byteorder"] != sys.byteorder:
+                column.byteswap()
+            return column
+
+        window = cls(size, channels)
+        window._columns = {
+            key: unpack(typecode, data["columns"][key]) for typecode, key in _COLUMNS
+        }
+        window._channel_integrals = {
+            name: unpack("d", data["channels"][name]) for name in window._channels
+        }
+        lengths = {
+            len(column)
+            for column in (
+                *window._columns.values(),
+                *window._channel_integrals.values(),
+            )
+        }
+        if len(lengths) != 1:
+            raise ValueError("Columns of stored buckets have different lengths")
+
+        window._end_ts = data["end_ts"]
+        window._raw = SourceWindow.from_dict(data["raw"], channels)
+        return window
@@ -36,10 +36,37 @@ CONF_DURATION: Final = "duration"
 CONF_PRECISION: Final = "precision"
 CONF_PERIOD_KEYS: Final = [CONF_START, CONF_END, CONF_DURATION]
 CONF_PROCESS_UNDEF_AS: Final = "process_undef_as"
+CONF_PUSH_UPDATES: Final = "push_updates"
+CONF_USE_STATISTICS: Final = "use_statistics"
+CONF_STATISTICS: Final = "statistics"
+CONF_THRESHOLD: Final = "threshold"
+CONF_PERCENTILES: Final = "percentiles"
+CONF_BUCKET_SIZE: Final = "bucket_size"
+CONF_DEBOUNCE: Final = "debounce"
+CONF_BACKEND: Final = "backend"
+CONF_HALF_LIFE: Final = "half_life"
+CONF_DURATIONS: Final = "durations"
+CONF_MAX_CONCURRENT_QUERIES: Final = "max_concurrent_queries"
+CONF_STARTUP_JITTER: Final = "startup_jitter"
+CONF_EXECUTOR_THRESHOLD: Final = "executor_threshold"
+CONF_LIMIT: Final = "limit"
 
 # Defaults
 DEFAULT_NAME: Final = "Average"
 DEFAULT_PRECISION: Final = 2
+DEFAULT_MAX_CONCURRENT_QUERIES: Final = 4
+DEFAULT_STARTUP_JITTER: Final = timedelta(milliseconds=200)
+DEFAULT_PERFORMANCE_LIMIT: Final = 10
+DEFAULT_EXECUTOR_THRESHOLD: Final = 5000
+DEFAULT_DEBOUNCE: Final = timedelta(milliseconds=500)
+
+# Backends of computation of averages over periods
+BACKEND_PYTHON: Final = "python"
+BACKEND_DATABASE: Final = "database"
+BACKENDS: Final = [BACKEND_PYTHON, BACKEND_DATABASE]
+
+# Services
+SERVICE_GET_PERFORMANCE: Final = "get_performance"
 
 # Attributes
 ATTR_START: Final = "start"
@@ -51,6 +78,13 @@ ATTR_COUNT: Final = "count"
 ATTR_MIN_VALUE: Final = "min_value"
 ATTR_MAX_VALUE: Final = "max_value"
 ATTR_TRENDING_TOWARDS: Final = "trending_towards"
+ATTR_APPROXIMATE: Final = "approximate"
+ATTR_VARIANCE: Final = "variance"
+ATTR_STANDARD_DEVIATION: Final = "standard_deviation"
+ATTR_INTEGRAL: Final = "integral"
+ATTR_TIME_ABOVE: Final = "time_above"
+ATTR_TIME_BELOW: Final = "time_below"
+ATTR_PERCENTILES: Final = "percentiles"
 #
 ATTR_TO_PROPERTY: Final = [
     ATTR_START,
@@ -62,7 +96,48 @@ ATTR_TO_PROPERTY: Final = [
     ATTR_MAX_VALUE,
     ATTR_MIN_VALUE,
     ATTR_TRENDING_TOWARDS,
+    ATTR_APPROXIMATE,
+    ATTR_VARIANCE,
+    ATTR_STANDARD_DEVIATION,
+    ATTR_INTEGRAL,
+    ATTR_TIME_ABOVE,
+    ATTR_TIME_BELOW,
+    ATTR_PERCENTILES,
+]
+# Additional statistics which can be enabled
+STATISTICS: Final = [
+    ATTR_VARIANCE,
+    ATTR_STANDARD_DEVIATION,
+    ATTR_INTEGRAL,
+    ATTR_TIME_ABOVE,
+    ATTR_TIME_BELOW,
 ]
 
 
 UPDATE_MIN_TIME: Final = timedelta(seconds=20)
+# Maximal time between updates of push-updated sensors
+PUSH_MAX_INTERVAL: Final = timedelta(minutes=5)
+
+# Storage of collected samples
+STORAGE_VERSION: Final = 1
+STORAGE_SAVE_DELAY: Final = timedelta(minutes=1)
+STORAGE_MAX_SAMPLES: Final = 200000
+
+# Registry of all average sensors
+DATA_SENSORS: Final = f"{DOMAIN}_sensors"
+
+# Minimal count of historical states of a source to process them in executor
+DATA_EXECUTOR_THRESHOLD: Final = f"{DOMAIN}_executor_threshold"
+
+# Startup scheduler
+DATA_STARTUP_SCHEDULER: Final = f"{DOMAIN}_startup_scheduler"
+
+# History cache
+DATA_HISTORY_CACHE: Final = f"{DOMAIN}_history_cache"
+HISTORY_CACHE_MAX_ROWS: Final = 500000
+HISTORY_CACHE_TTL: Final = timedelta(seconds=2)
+HISTORY_CACHE_TRIM_INTERVAL: Final = timedelta(minutes=10)
+
+# Streamed reads of long histories bypassing the cache
+STREAM_MIN_PERIOD: Final = timedelta(days=2)
+STREAM_CHUNK_SIZE: Final = 10000
@@ -0,0 +1,405 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from array import array
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+import json
+import logging
+from typing import Any
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.util import session_scope
+from homeassistant.core import HomeAssistant
+
+from .const import STREAM_CHUNK_SIZE
+from .extractor import UNDEFINED_STATES
+from .history_cache import HistoryRows
+
+# Plain decimal numbers; other states have no value in the database
+NUMBER_PATTERN = r"^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$"
+
+# Dialect specific expressions of the numeric test and of the value of state
+_NUMERIC = {
+    "postgresql": "state ~ :number_pattern",
+    "mysql": "state REGEXP :number_pattern",
+    # SQLite has no regular expressions by default; text is equal to its
+    # number only if the whole text is a numeric literal
+    "sqlite": "(state NOT GLOB '*[^0-9.eE+-]*' AND CAST(state AS REAL) = state)",
+}
+_VALUE = {
+    "postgresql": "CAST(state AS DOUBLE PRECISION)",
+    "mysql": "(state + 0e0)",
+    "sqlite": "CAST(state AS REAL)",
+}
+
+# The last state of entity before the period start
+_START_STATE_QUERY = text(
+    "SELECT last_updated_ts, state FROM states"
+    " WHERE metadata_id = :metadata_id AND last_updated_ts < :start_ts"
+    " ORDER BY last_updated_ts DESC, state_id DESC LIMIT 1"
+)
+# Next chunk of states of entity after the given (timestamp, state id) key
+_STATES_CHUNK_QUERY = text(
+    "SELECT state_id, last_updated_ts, state FROM states"
+    " WHERE metadata_id = :metadata_id"
+    " AND (last_updated_ts > :after_ts"
+    " OR (last_updated_ts = :after_ts AND state_id > :after_id))"
+    " AND last_updated_ts <= :end_ts"
+    " AND (last_changed_ts IS NULL OR last_changed_ts = last_updated_ts)"
+    " ORDER BY last_updated_ts, state_id"
+    " LIMIT :limit"
+)
+# Attributes of the last state of entity
+_LAST_ATTRIBUTES_QUERY = text(
+    "SELECT shared_attrs FROM states"
+    " LEFT JOIN state_attributes"
+    " ON state_attributes.attributes_id = states.attributes_id"
+    " WHERE metadata_id = :metadata_id"
+    " ORDER BY last_updated_ts DESC, state_id DESC LIMIT 1"
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AggregateWindow:
+    """Time-weighted aggregates of values of one source over a period.
+
+    Aggregates are computed by the database, so only they leave it instead of
+    all states of the period. The class provides the part of the window
+    interface that is needed to compute the sensor state for that period.
+    """
+
+    __slots__ = (
+        "start_ts",
+        "end_ts",
+        "integral",
+        "elapsed",
+        "count",
+        "min_value",
+        "max_value",
+        "last_value",
+        "rows",
+    )
+
+    def __init__(
+        self,
+        start_ts: float,
+        end_ts: float,
+        integral: float = 0.0,
+        elapsed: float = 0.0,
+        count: int = 0,
+        min_value: float | None = None,
+        max_value: float | None = None,
+        last_value: float | None = None,
+        rows: int = 0,
+    ) -> None:
+        """Initialize the aggregates."""
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.integral = integral
+        self.elapsed = elapsed
+        self.count = count
+        self.min_value = min_value
+        self.max_value = max_value
+        self.last_value = last_value
+        self.rows = rows
+
+    def __len__(self) -> int:
+        """Return count of aggregated states."""
+        return self.rows
+
+    def _check_period(self, start_ts: float, end_ts: float) -> None:
+        """Ensure aggregates are requested for their own period."""
+        if (start_ts, end_ts) != (self.start_ts, self.end_ts):
+            raise ValueError("Aggregates are computed for another period")
+
+    def evict(self, start_ts: float) -> None:
+        """Do nothing as aggregates have no samples."""
+
+    def integrate(self, start_ts: float, end_ts: float) -> tuple[float, float]:
+        """Return time-weighted integral and covered time over the period."""
+        self._check_period(start_ts, end_ts)
+        return self.integral, self.elapsed
+
+    def average(self, start_ts: float, end_ts: float) -> float | None:
+        """Return time-weighted average value over the period."""
+        self._check_period(start_ts, end_ts)
+        if self.elapsed:
+            return self.integral / self.elapsed
+        return self.last_value
+
+    def extremes(
+        self, start_ts: float, end_ts: float
+    ) -> tuple[int, float | None, float | None]:
+        """Return count, minimum and maximum of measured values over the period."""
+        self._check_period(start_ts, end_ts)
+        return self.count, self.min_value, self.max_value
+
+    def converted(self, convert: Callable[[float], float]) -> AggregateWindow:
+        """Return aggregates of values converted by increasing linear function.
+
+        E.g. units of temperature are converted so.
+        """
+
+        def convert_value(value: float | None) -> float | None:
+            return None if value is None else convert(value)
+
+        integral = self.integral
+        if self.elapsed:
+            integral = convert(integral / self.elapsed) * self.elapsed
+        return AggregateWindow(
+            self.start_ts,
+            self.end_ts,
+            integral,
+            self.elapsed,
+            self.count,
+            convert_value(self.min_value),
+            convert_value(self.max_value),
+            convert_value(self.last_value),
+            self.rows,
+        )
+
+
+def _aggregates_query(dialect: str, sources: int, undef: float | None) -> Any:
+    """Return query of time-weighted aggregates of sources over the period.
+
+    Every state lasts until the next one (found by LEAD window function) or
+    until the period end. The state in effect at the period start is taken
+    into account from the start only. Like in the history of Home Assistant,
+    changes of attributes only are skipped.
+    """
+    numeric = _NUMERIC[dialect]
+    undefined = " OR ".join(
+        ["state IS NULL"]
+        + [f"state = :undefined_{i}" for i in range(len(UNDEFINED_STATES))]
+    )
+    # Index lookup of the last state before the period start of every source
+    start_states = " UNION ALL ".join(
+        "SELECT * FROM ("
+        "SELECT metadata_id, last_updated_ts AS ts, state FROM states"
+        f" WHERE metadata_id = :metadata_id_{i} AND last_updated_ts <= :start_ts"
+        " ORDER BY last_updated_ts DESC, state_id DESC LIMIT 1"
+        f") start_state_{i}"
+        for i in range(sources)
+    )
+    start_ts = "CASE WHEN ts < :start_ts THEN :start_ts ELSE ts END"
+    duration = f"(COALESCE(next_ts, :end_ts) - {start_ts})"
+    query = text(
+        f"""
+        WITH source_states AS (
+            SELECT metadata_id, last_updated_ts AS ts, state FROM states
+            WHERE metadata_id IN :metadata_ids
+            AND last_updated_ts > :start_ts AND last_updated_ts <= :end_ts
+            AND (last_changed_ts IS NULL OR last_changed_ts = last_updated_ts)
+            UNION ALL {start_states}
+        ),
+        source_values AS (
+            SELECT
+                metadata_id,
+                ts,
+                LEAD(ts) OVER (PARTITION BY metadata_id ORDER BY ts) AS next_ts,
+                CASE
+                    WHEN {undefined} THEN {"NULL" if undef is None else ":undef"}
+                    WHEN {numeric} THEN {_VALUE[dialect]}
+                END AS value,
+                CASE WHEN {numeric} THEN 1 ELSE 0 END AS measured
+            FROM source_states
+        )
+        SELECT
+            metadata_id,
+            SUM(CASE WHEN value IS NULL THEN 0 ELSE value * {duration} END),
+            SUM(CASE WHEN value IS NULL THEN 0 ELSE {duration} END),
+            SUM(measured),
+            MIN(CASE WHEN measured = 1 THEN value END),
+            MAX(CASE WHEN measured = 1 THEN value END),
+            MAX(CASE WHEN next_ts IS NULL THEN value END),
+            COUNT(*)
+        FROM source_values
+        GROUP BY metadata_id
+        """
+    ).bindparams(bindparam("metadata_ids", expanding=True))
+    params = {
+        f"undefined_{i}": state for i, state in enumerate(sorted(UNDEFINED_STATES))
+    }
+    if "number_pattern" in numeric:
+        params["number_pattern"] = NUMBER_PATTERN
+    if undef is not None:
+        params["undef"] = float(undef)
+    return query, params
+
+
+def get_aggregates(
+    session: Session,
+    entity_ids: Iterable[str],
+    start_ts: float,
+    end_ts: float,
+    undef: float | None = None,
+) -> dict[str, AggregateWindow]:
+    """Return time-weighted aggregates of source states over the period.
+
+    States are parsed the same way as by value extractors, but only plain
+    decimal numbers are recognized. Undefined states have `undef` value.
+    Sources without states have empty aggregates.
+    """
+    entity_ids = list(entity_ids)
+    metadata = session.execute(
+        text(
+            "SELECT metadata_id, entity_id FROM states_meta"
+            " WHERE entity_id IN :entity_ids"
+        ).bindparams(bindparam("entity_ids", expanding=True)),
+        {"entity_ids": entity_ids},
+    ).all()
+    result = {entity_id: AggregateWindow(start_ts, end_ts) for entity_id in entity_ids}
+    if not metadata:
+        return result
+
+    query, params = _aggregates_query(
+        session.get_bind().dialect.name, len(metadata), undef
+    )
+    params.update(
+        {f"metadata_id_{i}": metadata_id for i, (metadata_id, _) in enumerate(metadata)}
+    )
+    rows = session.execute(
+        query,
+        {
+            **params,
+            "metadata_ids": [metadata_id for metadata_id, _ in metadata],
+            "start_ts": start_ts,
+            "end_ts": end_ts,
+        },
+    ).all()
+
+    entities = dict(metadata)
+    for metadata_id, integral, elapsed, count, *values, rows_count in rows:
+        result[entities[metadata_id]] = AggregateWindow(
+            start_ts,
+            end_ts,
+            float(integral or 0.0),
+            float(elapsed or 0.0),
+            int(count or 0),
+            *(None if value is None else float(value) for value in values),
+            rows_count,
+        )
+    return result
+
+
+def _get_aggregates_in_session(
+    hass: HomeAssistant, *args: Any
+) -> dict[str, AggregateWindow]:
+    """Return aggregates of sources reading them in a new session."""
+    with session_scope(hass=hass, read_only=True) as session:
+        return get_aggregates(session, *args)
+
+
+async def async_get_aggregates(
+    hass: HomeAssistant,
+    entity_ids: Iterable[str],
+    start_ts: float,
+    end_ts: float,
+    undef: float | None = None,
+) -> dict[str, AggregateWindow]:
+    """Return time-weighted aggregates of sources computed by the recorder."""
+    _LOGGER.debug("Aggregate states of %s in the database", entity_ids)
+    return await get_instance(hass).async_add_executor_job(
+        partial(
+            _get_aggregates_in_session,
+            hass,
+            list(entity_ids),
+            start_ts,
+            end_ts,
+            undef,
+        )
+    )
+
+
+def _get_metadata_id(session: Session, entity_id: str) -> int | None:
+    """Return id of entity in the states metadata."""
+    return session.execute(
+        text("SELECT metadata_id FROM states_meta WHERE entity_id = :entity_id"),
+        {"entity_id": entity_id},
+    ).scalar()
+
+
+def get_last_attributes(session: Session, entity_id: str) -> dict[str, Any]:
+    """Return attributes of the last state of entity or empty dict if none."""
+    shared_attrs = session.execute(
+        _LAST_ATTRIBUTES_QUERY,
+        {"metadata_id": _get_metadata_id(session, entity_id)},
+    ).scalar()
+    return json.loads(shared_attrs) if shared_attrs else {}
+
+
+def iter_states(
+    session: Session,
+    entity_id: str,
+    start_ts: float,
+    end_ts: float,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[HistoryRows]:
+    """Yield states of entity over the period in chunks of fixed size.
+
+    The state in effect at the period start comes first. Chunks are read by
+    keyset pagination on the timestamp and the state id, so every read is an
+    index range scan, and only one chunk of states is in memory at once.
+    """
+    metadata_id = _get_metadata_id(session, entity_id)
+    if metadata_id is None:
+        return
+
+    # The state in effect at the start is the first row of the first chunk
+    rows = [
+        (None, *row)
+        for row in session.execute(
+            _START_STATE_QUERY, {"metadata_id": metadata_id, "start_ts": start_ts}
+        ).all()
+    ]
+    after_ts, after_id = start_ts, -1
+    while True:
+        rows += session.execute(
+            _STATES_CHUNK_QUERY,
+            {
+                "metadata_id": metadata_id,
+                "after_ts": after_ts,
+                "after_id": after_id,
+                "end_ts": end_ts,
+                "limit": chunk_size - len(rows),
+            },
+        ).all()
+        if not rows:
+            return
+
+        yield HistoryRows(
+            array("d", [row[1] for row in rows]), [row[2] for row in rows], None
+        )
+        if len(rows) < chunk_size:
+            return
+        if rows[-1][0] is not None:
+            after_id, after_ts, _ = rows[-1]
+        rows = []
+
+
+def iter_recorder_states(
+    hass: HomeAssistant,
+    entity_id: str,
+    start_ts: float,
+    end_ts: float,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[HistoryRows]:
+    """Yield states of entity over the period from the recorder in chunks.
+
+    It has to be consumed in the recorder executor.
+    """
+    with session_scope(hass=hass, read_only=True) as session:
+        yield from iter_states(session, entity_id, start_ts, end_ts, chunk_size)
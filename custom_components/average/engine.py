@@ -0,0 +1,638 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from array import array
+import base64
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Callable, Mapping, Sequence
+import heapq
+import math
+import sys
+
+from .kernel import extremes, prefix_sums
+from .sketch import QuantileSketch
+
+# Minimal number of evicted samples before window arrays are compacted
+COMPACT_MIN_SIZE = 256
+
+
+class SourceWindow:
+    """Time-weighted sliding window of one source samples.
+
+    Samples are kept in columnar arrays together with running (prefix) sums of
+    the time-weighted integral and of the covered time. So extending the window
+    costs O(new samples) and sliding it costs O(evicted samples).
+
+    Optional channels are functions of values; running sums of their
+    time-weighted integrals are kept the same way, e.g. to get variance.
+    Optional quantile sketch keeps durations of values of all samples but the
+    last one to get time-weighted quantiles.
+
+    Count and extremes of measured values of the whole window are kept up to
+    date with monotonic deques of sample indexes, so they cost amortized O(1)
+    per added or evicted sample instead of a scan of the window.
+    """
+
+    def __init__(
+        self,
+        channels: Mapping[str, Callable[[float], float]] | None = None,
+        quantiles: bool = False,
+    ) -> None:
+        """Initialize the window."""
+        self._ts = array("d")
+        self._values = array("d")  # NaN means undefined value
+        self._measured = array("b")
+        self._integral = array("d")  # Integral from the first sample to i-th
+        self._elapsed = array("d")  # Covered time from the first sample to i-th
+        self._channels = dict(channels or {})
+        self._channel_integrals = {name: array("d") for name in self._channels}
+        self._sketch = QuantileSketch() if quantiles else None
+        self._head = 0
+        # Count of measured values and indexes of samples with increasing
+        # minimal and decreasing maximal values from the head to the end
+        self._count = 0
+        self._min_indexes: deque[int] = deque()
+        self._max_indexes: deque[int] = deque()
+
+    def __len__(self) -> int:
+        """Return count of samples in the window."""
+        return len(self._ts) - self._head
+
+    def clear(self) -> None:
+        """Drop all samples."""
+        # pylint: disable-next=unnecessary-dunder-call
+        self.__init__(self._channels, self._sketch is not None)
+
+    def copy(self) -> SourceWindow:
+        """Return a copy of the window."""
+        window = SourceWindow(self._channels)
+        head = self._head
+        window._ts = self._ts[head:]
+        window._values = self._values[head:]
+        window._measured = self._measured[head:]
+        # Prefix sums are relative, so they need no rebasing
+        window._integral = self._integral[head:]
+        window._elapsed = self._elapsed[head:]
+        window._channel_integrals = {
+            name: column[head:] for name, column in self._channel_integrals.items()
+        }
+        if self._sketch is not None:
+            window._sketch = self._sketch.copy()
+        window._count = self._count
+        window._min_indexes = deque(index - head for index in self._min_indexes)
+        window._max_indexes = deque(index - head for index in self._max_indexes)
+        return window
+
+    def slice(self, start_ts: float, end_ts: float) -> SourceWindow:
+        """Return a new window with samples in effect over the period."""
+        window = SourceWindow(self._channels, self._sketch is not None)
+        first, last = self._bounds(start_ts, end_ts)
+        if last >= first:
+            window.extend(
+                self._ts[first : last + 1],
+                self._values[first : last + 1],
+                self._measured[first : last + 1],
+            )
+        return window
+
+    @property
+    def first_ts(self) -> float | None:
+        """Return timestamp of the first sample."""
+        return self._ts[self._head] if len(self) else None
+
+    @property
+    def last_ts(self) -> float | None:
+        """Return timestamp of the last sample."""
+        return self._ts[-1] if len(self) else None
+
+    @property
+    def last_value(self) -> float | None:
+        """Return value of the last sample."""
+        if not len(self) or math.isnan(self._values[-1]):
+            return None
+        return self._values[-1]
+
+    def next_ts(self, ts: float) -> float | None:
+        """Return timestamp of the first sample after given time."""
+        index = bisect_right(self._ts, ts, self._head)
+        return self._ts[index] if index < len(self._ts) else None
+
+    def append(self, ts: float, value: float | None, measured: bool) -> None:
+        """Add a new sample to the end of the window."""
+        value = math.nan if value is None else value
+        if len(self):
+            last_ts = self._ts[-1]
+            if ts < last_ts:
+                return  # Stale sample
+            if ts == last_ts:
+                # Prefix sums of a sample do not depend on its own value
+                self._values[-1] = value
+                self._measured[-1] = measured
+                # Deques may have lost samples dominated by the replaced value
+                self._rebuild_extremes()
+                return
+
+            last_value = self._values[-1]
+            if math.isnan(last_value):
+                self._integral.append(self._integral[-1])
+                self._elapsed.append(self._elapsed[-1])
+                for column in self._channel_integrals.values():
+                    column.append(column[-1])
+            else:
+                elapsed = ts - last_ts
+                if self._sketch is not None:
+                    self._sketch.add(last_value, elapsed)
+                self._integral.append(self._integral[-1] + last_value * elapsed)
+                self._elapsed.append(self._elapsed[-1] + elapsed)
+                for name, column in self._channel_integrals.items():
+                    column.append(
+                        column[-1] + self._channels[name](last_value) * elapsed
+                    )
+        else:
+            self._integral.append(0.0)
+            self._elapsed.append(0.0)
+            for column in self._channel_integrals.values():
+                column.append(0.0)
+
+        self._ts.append(ts)
+        self._values.append(value)
+        self._measured.append(measured)
+        self._push_extremes(len(self._ts) - 1, value, measured)
+
+    def extend(
+        self,
+        timestamps: Sequence[float],
+        values: Sequence[float | None],
+        measured: Sequence[bool],
+    ) -> None:
+        """Add a batch of new samples to the end of the window."""
+        # Skip stale samples; the first new one may replace the last known
+        first = 0
+        if len(self):
+            first = bisect_right(timestamps, self._ts[-1])
+            if first and timestamps[first - 1] == self._ts[-1]:
+                self.append(
+                    timestamps[first - 1], values[first - 1], measured[first - 1]
+                )
+        if first >= len(timestamps):
+            return
+
+        timestamps = timestamps[first:]
+        values = [math.nan if value is None else value for value in values[first:]]
+        measured = measured[first:]
+
+        if len(self):
+            # Prefix sums continue from the last known sample
+            timestamps_from = [self._ts[-1], *timestamps]
+            values_from = [self._values[-1], *values]
+            integrals, elapsed = prefix_sums(
+                timestamps_from,
+                values_from,
+                self._integral[-1],
+                self._elapsed[-1],
+            )
+            integrals, elapsed = integrals[1:], elapsed[1:]
+            for name, column in self._channel_integrals.items():
+                sums = self._channel_sums(
+                    name, timestamps_from, values_from, column[-1]
+                )
+                column.extend(sums[1:])
+            self._sketch_durations(timestamps_from, values_from)
+        else:
+            integrals, elapsed = prefix_sums(timestamps, values)
+            for name, column in self._channel_integrals.items():
+                column.extend(self._channel_sums(name, timestamps, values))
+            self._sketch_durations(timestamps, values)
+
+        first = len(self._ts)
+        self._ts.extend(timestamps)
+        self._values.extend(values)
+        self._measured.extend(measured)
+        self._integral.extend(integrals)
+        self._elapsed.extend(elapsed)
+        for index in range(first, len(self._ts)):
+            self._push_extremes(index, self._values[index], self._measured[index])
+
+    def _push_extremes(self, index: int, value: float, measured: bool) -> None:
+        """Add sample at the end of the window to count and extremes."""
+        if not measured or math.isnan(value):
+            return
+
+        self._count += 1
+        values = self._values
+        min_indexes = self._min_indexes
+        while min_indexes and values[min_indexes[-1]] >= value:
+            min_indexes.pop()
+        min_indexes.append(index)
+        max_indexes = self._max_indexes
+        while max_indexes and values[max_indexes[-1]] <= value:
+            max_indexes.pop()
+        max_indexes.append(index)
+
+    def _rebuild_extremes(self) -> None:
+        """Recompute count and extremes of the whole window."""
+        self._count = 0
+        self._min_indexes.clear()
+        self._max_indexes.clear()
+        for index in range(self._head, len(self._ts)):
+            self._push_extremes(index, self._values[index], self._measured[index])
+
+    def _sketch_durations(
+        self, timestamps: Sequence[float], values: Sequence[float], sign: int = 1
+    ) -> None:
+        """Add durations of values but the last one to the sketch.
+
+        Negative sign removes the durations.
+        """
+        if self._sketch is None:
+            return
+        for i in range(len(timestamps) - 1):
+            value = values[i]
+            if not math.isnan(value):
+                self._sketch.add(value, sign * (timestamps[i + 1] - timestamps[i]))
+
+    def _channel_sums(
+        self,
+        name: str,
+        timestamps: Sequence[float],
+        values: Sequence[float],
+        integral: float = 0.0,
+    ) -> array:
+        """Return running time-weighted integral of channel at each sample."""
+        func = self._channels[name]
+        return prefix_sums(
+            timestamps,
+            [value if math.isnan(value) else func(value) for value in values],
+            integral,
+        )[0]
+
+    def evict(self, start_ts: float) -> None:
+        """Drop samples that have slid out of the window.
+
+        The sample that is in effect at the start of the window is kept.
+        """
+        index = bisect_right(self._ts, start_ts, self._head) - 1
+        if index <= self._head:
+            return
+
+        self._sketch_durations(
+            self._ts[self._head : index + 1], self._values[self._head : index + 1], -1
+        )
+        for i in range(self._head, index):
+            if self._measured[i] and not math.isnan(self._values[i]):
+                self._count -= 1
+        while self._min_indexes and self._min_indexes[0] < index:
+            self._min_indexes.popleft()
+        while self._max_indexes and self._max_indexes[0] < index:
+            self._max_indexes.popleft()
+        self._head = index
+        if self._head >= COMPACT_MIN_SIZE and self._head * 2 >= len(self._ts):
+            self._compact()
+
+    def as_dict(self) -> dict[str, str]:
+        """Return samples of the window packed to be stored as JSON."""
+        head = self._head
+        return {
+            "byteorder": sys.byteorder,
+            "ts": base64.b64encode(self._ts[head:].tobytes()).decode(),
+            "values": base64.b64encode(self._values[head:].tobytes()).decode(),
+            "measured": base64.b64encode(self._measured[head:].tobytes()).decode(),
+        }
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Mapping[str, str],
+        channels: Mapping[str, Callable[[float], float]] | None = None,
+        quantiles: bool = False,
+    ) -> SourceWindow:
+        """Return window with samples unpacked from dict."""
+        columns = []
+        for typecode, key in (("d", "ts"), ("d", "values"), ("b", "measured")):
+            column = array(typecode, base64.b64decode(data[key]))
+            if data["byteorder"] != sys.byteorder:
+                column.byteswap()
+            columns.append(column)
+
+        if len({len(column) for column in columns}) != 1:
+            raise ValueError("Columns of stored window have different lengths")
+
+        window = cls(channels, quantiles)
+        window.extend(*columns)
+        return window
+
+    def _compact(self) -> None:
+        """Physically remove evicted samples and rebase prefix sums."""
+        head = self._head
+        for column in (
+            self._ts,
+            self._values,
+            self._measured,
+            self._integral,
+            self._elapsed,
+            *self._channel_integrals.values(),
+        ):
+            del column[:head]
+        self._head = 0
+        self._min_indexes = deque(index - head for index in self._min_indexes)
+        self._max_indexes = deque(index - head for index in self._max_indexes)
+
+        base_integral = self._integral[0]
+        base_elapsed = self._elapsed[0]
+        for i in range(len(self._ts)):
+            self._integral[i] -= base_integral
+            self._elapsed[i] -= base_elapsed
+        for column in self._channel_integrals.values():
+            base = column[0]
+            for i in range(len(column)):
+                column[i] -= base
+
+    def _bounds(self, start_ts: float, end_ts: float) -> tuple[int, int]:
+        """Return indexes of the first and the last samples in effect."""
+        first = max(bisect_right(self._ts, start_ts, self._head) - 1, self._head)
+        last = bisect_right(self._ts, end_ts, self._head) - 1
+        return first, last
+
+    def integrate(self, start_ts: float, end_ts: float) -> tuple[float, float]:
+        """Return time-weighted integral and covered time over the period."""
+        first, last = self._bounds(start_ts, end_ts)
+        if last < first:
+            return 0.0, 0.0
+
+        integral = self._integral[last] - self._integral[first]
+        elapsed = self._elapsed[last] - self._elapsed[first]
+
+        # The first sample is only taken into account from the period start
+        value = self._values[first]
+        lead = start_ts - self._ts[first]
+        if lead > 0 and not math.isnan(value):
+            integral -= value * lead
+            elapsed -= lead
+
+        # The last sample lasts until the period end
+        value = self._values[last]
+        tail = end_ts - self._ts[last]
+        if tail > 0 and not math.isnan(value):
+            integral += value * tail
+            elapsed += tail
+
+        return integral, elapsed
+
+    def integrate_channel(self, name: str, start_ts: float, end_ts: float) -> float:
+        """Return time-weighted integral of channel over the period."""
+        first, last = self._bounds(start_ts, end_ts)
+        if last < first:
+            return 0.0
+
+        column = self._channel_integrals[name]
+        func = self._channels[name]
+        integral = column[last] - column[first]
+
+        # The first sample is only taken into account from the period start
+        value = self._values[first]
+        lead = start_ts - self._ts[first]
+        if lead > 0 and not math.isnan(value):
+            integral -= func(value) * lead
+
+        # The last sample lasts until the period end
+        value = self._values[last]
+        tail = end_ts - self._ts[last]
+        if tail > 0 and not math.isnan(value):
+            integral += func(value) * tail
+
+        return integral
+
+    def sketch(self, start_ts: float, end_ts: float) -> QuantileSketch | None:
+        """Return quantile sketch of durations of values over the period."""
+        if self._sketch is None:
+            return None
+        first, last = self._bounds(start_ts, end_ts)
+        if last < first:
+            return None
+
+        sketch = self._sketch.copy()
+        # Drop durations of samples out of the period (usually there are none)
+        self._remove_durations(sketch, self._head, first)
+        self._remove_durations(sketch, last, len(self._ts) - 1)
+
+        if first == last:
+            value = self._values[first]
+            if not math.isnan(value):
+                sketch.add(value, end_ts - max(start_ts, self._ts[first]))
+            return sketch
+
+        # The first sample is only taken into account from the period start
+        value = self._values[first]
+        lead = start_ts - self._ts[first]
+        if lead > 0 and not math.isnan(value):
+            sketch.add(value, -lead)
+
+        # The last sample lasts until the period end
+        value = self._values[last]
+        tail = end_ts - self._ts[last]
+        if tail > 0 and not math.isnan(value):
+            sketch.add(value, tail)
+
+        return sketch
+
+    def _remove_durations(self, sketch: QuantileSketch, first: int, last: int) -> None:
+        """Remove durations of samples from first to last (exclusive) from sketch."""
+        for i in range(first, last):
+            value = self._values[i]
+            if not math.isnan(value):
+                sketch.add(value, self._ts[i] - self._ts[i + 1])
+
+    def average(self, start_ts: float, end_ts: float) -> float | None:
+        """Return time-weighted average value over the period."""
+        integral, elapsed = self.integrate(start_ts, end_ts)
+        if elapsed:
+            return integral / elapsed
+
+        first, last = self._bounds(start_ts, end_ts)
+        values = [v for v in self._values[first : last + 1] if not math.isnan(v)]
+        return values[-1] if values else None
+
+    def count(self, start_ts: float, end_ts: float) -> int:
+        """Return count of measured values of samples after start up to end."""
+        first = bisect_right(self._ts, start_ts, self._head)
+        last = bisect_right(self._ts, end_ts, self._head) - 1
+        if last < first:
+            return 0
+        return extremes(
+            memoryview(self._values)[first : last + 1],
+            memoryview(self._measured)[first : last + 1],
+        )[0]
+
+    def extremes(
+        self, start_ts: float, end_ts: float
+    ) -> tuple[int, float | None, float | None]:
+        """Return count, minimum and maximum of measured values over the period."""
+        first, last = self._bounds(start_ts, end_ts)
+        if last < first:
+            return 0, None, None
+        if first == self._head and last == len(self._ts) - 1:
+            # The whole window; its extremes are kept up to date
+            if not self._count:
+                return 0, None, None
+            return (
+                self._count,
+                self._values[self._min_indexes[0]],
+                self._values[self._max_indexes[0]],
+            )
+        return extremes(
+            memoryview(self._values)[first : last + 1],
+            memoryview(self._measured)[first : last + 1],
+        )
+
+
+class CurrentValues:
+    """Current values of sources with running sum, count and extremes.
+
+    Change of one source value costs O(1) for sum and count, and amortized
+    O(log n) for extremes.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the values."""
+        self._values: dict[str, float] = {}
+        self._measured: dict[str, float] = {}
+        self._sum = 0.0
+        # Heaps of (value, entity_id) with lazy deletion of outdated items
+        self._min_heap: list[tuple[float, str]] = []
+        self._max_heap: list[tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        """Return count of sources that have values."""
+        return len(self._values)
+
+    @property
+    def count(self) -> int:
+        """Return count of sources that have measured values."""
+        return len(self._measured)
+
+    @property
+    def average(self) -> float | None:
+        """Return average value of sources."""
+        return self._sum / len(self._values) if self._values else None
+
+    @property
+    def min_value(self) -> float | None:
+        """Return minimum of measured values."""
+        return self._top(self._min_heap, 1)
+
+    @property
+    def max_value(self) -> float | None:
+        """Return maximum of measured values."""
+        top = self._top(self._max_heap, -1)
+        return None if top is None else -top
+
+    def clear(self) -> None:
+        """Drop all values."""
+        self.__init__()  # pylint: disable=unnecessary-dunder-call
+
+    def update(self, entity_id: str, value: float | None, measured: bool) -> None:
+        """Set current value of source."""
+        old_value = self._values.pop(entity_id, None)
+        if old_value is not None:
+            self._sum -= old_value
+        self._measured.pop(entity_id, None)
+
+        if value is None:
+            if not self._values:
+                self._sum = 0.0  # Drop accumulated rounding errors
+            return
+
+        self._values[entity_id] = value
+        self._sum += value
+        if measured:
+            self._measured[entity_id] = value
+            heapq.heappush(self._min_heap, (value, entity_id))
+            heapq.heappush(self._max_heap, (-value, entity_id))
+
+        # Rebuild heaps if they grew too big with outdated items
+        if len(self._min_heap) > 2 * len(self._measured) + COMPACT_MIN_SIZE:
+            self._min_heap = [(v, e) for e, v in self._measured.items()]
+            self._max_heap = [(-v, e) for e, v in self._measured.items()]
+            heapq.heapify(self._min_heap)
+            heapq.heapify(self._max_heap)
+
+    def _top(self, heap: list[tuple[float, str]], sign: int) -> float | None:
+        """Return top value of heap dropping outdated items."""
+        while heap:
+            value, entity_id = heap[0]
+            if self._measured.get(entity_id) == sign * value:
+                return value
+            heapq.heappop(heap)
+        return None
+
+
+class DecayingAverage:
+    """Time-aware exponentially weighted moving average of one source.
+
+    Every value is weighted by how long ago it was in effect: the weight halves
+    every `half_life` seconds of real time. Values are constant between
+    samples, so the average is updated exactly in O(1) time and memory per
+    sample, whatever the intervals between samples are.
+    """
+
+    __slots__ = ("half_life", "average", "last_ts", "last_value", "measured")
+
+    def __init__(self, half_life: float) -> None:
+        """Initialize the average."""
+        self.half_life = half_life
+        self.average: float | None = None  # Average at the last sample time
+        self.last_ts: float | None = None
+        self.last_value: float | None = None
+        self.measured = False
+
+    def value(self, ts: float) -> float | None:
+        """Return the average at given time."""
+        value = self.last_value
+        if value is None or self.last_ts is None or ts <= self.last_ts:
+            return self.average
+        if self.average is None:
+            return value
+        decay = 0.5 ** ((ts - self.last_ts) / self.half_life)
+        return value + (self.average - value) * decay
+
+    def append(self, ts: float, value: float | None, measured: bool) -> None:
+        """Add a new sample; undefined values do not change the average."""
+        if self.last_ts is not None and ts < self.last_ts:
+            return  # Stale sample
+        if self.last_ts is not None:
+            self.average = self.value(ts)
+        elif value is not None:
+            self.average = value
+        self.last_ts = ts
+        self.last_value = value
+        self.measured = measured
+
+    def as_dict(self) -> dict[str, float | bool | None]:
+        """Return state of the average to be stored as JSON."""
+        return {
+            "average": self.average,
+            "last_ts": self.last_ts,
+            "last_value": self.last_value,
+            "measured": self.measured,
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: Mapping[str, float | bool | None], half_life: float
+    ) -> DecayingAverage:
+        """Return average with state unpacked from dict."""
+        decaying = cls(half_life)
+        decaying.average = data["average"]
+        decaying.last_ts = data["last_ts"]
+        decaying.last_value = data["last_value"]
+        decaying.measured = bool(data["measured"])
+        return decaying
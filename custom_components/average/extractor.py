@@ -0,0 +1,204 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from collections.abc import Callable, Mapping, Sequence
+from functools import partial
+import logging
+from typing import Any, Final
+
+from homeassistant.components.climate import DOMAIN as CLIMATE_DOMAIN
+from homeassistant.components.sensor import SensorDeviceClass
+from homeassistant.components.water_heater import DOMAIN as WATER_HEATER_DOMAIN
+from homeassistant.components.weather import DOMAIN as WEATHER_DOMAIN
+from homeassistant.const import (
+    ATTR_DEVICE_CLASS,
+    ATTR_UNIT_OF_MEASUREMENT,
+    STATE_UNAVAILABLE,
+    STATE_UNKNOWN,
+)
+from homeassistant.core import split_entity_id
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.util.unit_conversion import TemperatureConverter
+from homeassistant.util.unit_system import TEMPERATURE_UNITS
+
+UNDEFINED_STATES: Final = frozenset((STATE_UNKNOWN, STATE_UNAVAILABLE, "None", ""))
+
+# Attributes with temperature of entities of some domains
+TEMPERATURE_ATTRIBUTES: Final = {
+    WEATHER_DOMAIN: "temperature",
+    CLIMATE_DOMAIN: "current_temperature",
+    WATER_HEATER_DOMAIN: "current_temperature",
+}
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _is_undefined(value: Any) -> bool:
+    """Return True if value has no state."""
+    return value is None or (isinstance(value, str) and value in UNDEFINED_STATES)
+
+
+def is_temperature_entity(entity_id: str, attributes: Mapping[str, Any]) -> bool:
+    """Return True if values of the entity are temperatures."""
+    return (
+        attributes.get(ATTR_DEVICE_CLASS) == SensorDeviceClass.TEMPERATURE
+        or split_entity_id(entity_id)[0] in TEMPERATURE_ATTRIBUTES
+        or attributes.get(ATTR_UNIT_OF_MEASUREMENT) in TEMPERATURE_UNITS
+    )
+
+
+class ValueExtractor:
+    """Precompiled parser of values of one source entity.
+
+    Everything that does not depend on a particular state (where to read the
+    value from and how to convert its units) is resolved once, so parsing of
+    long histories costs as little as possible per state.
+    """
+
+    __slots__ = (
+        "entity_id",
+        "temperature",
+        "unit",
+        "ha_unit",
+        "_attribute",
+        "_convert",
+        "_undef",
+    )
+
+    def __init__(
+        self,
+        entity_id: str,
+        attributes: Mapping[str, Any],
+        temperature: bool,
+        ha_unit: str,
+        undef: Any = None,
+    ) -> None:
+        """Compile extractor for the entity with given attributes."""
+        self.entity_id = entity_id
+        self.temperature = temperature
+        self.unit = attributes.get(ATTR_UNIT_OF_MEASUREMENT)
+        self.ha_unit = ha_unit
+        self._undef = undef
+        self._attribute: str | None = None
+        self._convert: Callable[[float], float] | None = None
+        if not temperature:
+            return
+
+        self._attribute = TEMPERATURE_ATTRIBUTES.get(split_entity_id(entity_id)[0])
+        # Temperature in attributes is in units of Home Assistant
+        if self._attribute is None and self.unit != ha_unit:
+            try:
+                self._convert = TemperatureConverter.converter_factory(
+                    self.unit, ha_unit
+                )
+            except HomeAssistantError:
+                # Unknown units are reported on conversion of values
+                self._convert = partial(
+                    TemperatureConverter.convert, from_unit=self.unit, to_unit=ha_unit
+                )
+
+    def matches(
+        self, temperature: bool, attributes: Mapping[str, Any], ha_unit: str
+    ) -> bool:
+        """Return True if extractor is still valid for the entity attributes."""
+        if temperature != self.temperature:
+            return False
+        if not temperature or self._attribute is not None:
+            return True
+        return (
+            ha_unit == self.ha_unit
+            and attributes.get(ATTR_UNIT_OF_MEASUREMENT) == self.unit
+        )
+
+    def convert(self, value: float) -> float:
+        """Return value converted to units of Home Assistant."""
+        return value if self._convert is None else self._convert(value)
+
+    def get_temperature(
+        self, state: str, attributes: Mapping[str, Any]
+    ) -> float | None:
+        """Return temperature in units of Home Assistant of raw entity state."""
+        temperature = (
+            state if self._attribute is None else attributes.get(self._attribute)
+        )
+        if _is_undefined(temperature):
+            return None
+
+        try:
+            temperature = float(temperature)
+            if self._convert is not None:
+                temperature = self._convert(temperature)
+        except ValueError as exc:
+            _LOGGER.error(
+                'Could not convert value "%s" of entity "%s" to float: %s',
+                temperature,
+                self.entity_id,
+                exc,
+            )
+            return None
+
+        return temperature
+
+    def parse(
+        self, state: str, attributes: Mapping[str, Any]
+    ) -> tuple[float | None, bool]:
+        """Return value of raw entity state and is it really measured."""
+        if self.temperature:
+            value = self.get_temperature(state, attributes)
+            if value is None:
+                return self._undef, False
+            return value, True
+
+        if _is_undefined(state):
+            return self._undef, False
+
+        try:
+            return float(state), True
+        except ValueError as exc:
+            _LOGGER.error('Could not convert value "%s" to float: %s', state, exc)
+            return None, False
+
+    def parse_many(
+        self,
+        states: Sequence[str],
+        attributes: Mapping[str, Any],
+        states_attributes: Sequence[Mapping[str, Any]] | None = None,
+    ) -> tuple[list[float | None], list[bool]]:
+        """Return values of raw entity states and are they really measured.
+
+        Given attributes are used if attributes of every state are not given.
+        Nothing but the returned lists is changed, so it may run in executor.
+        """
+        values = []
+        measured = []
+        if states_attributes is None:
+            parse = self.parse
+            for state in states:
+                value, is_measured = parse(state, attributes)
+                values.append(value)
+                measured.append(is_measured)
+            return values, measured
+
+        extractor = self
+        for state, state_attributes in zip(states, states_attributes):
+            if not extractor.matches(self.temperature, state_attributes, self.ha_unit):
+                # Units of the source have changed
+                extractor = ValueExtractor(
+                    self.entity_id,
+                    state_attributes,
+                    self.temperature,
+                    self.ha_unit,
+                    self._undef,
+                )
+            value, is_measured = extractor.parse(state, state_attributes)
+            values.append(value)
+            measured.append(is_measured)
+        return values, measured
@@ -0,0 +1,417 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from array import array
+import asyncio
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from collections.abc import (
+    Callable,
+    Container,
+    Coroutine,
+    Iterable,
+    Mapping,
+    Sequence,
+)
+import datetime
+from functools import partial
+import logging
+import math
+import time
+from typing import Any, NamedTuple
+
+from homeassistant.components.recorder import get_instance, history
+from homeassistant.const import (
+    COMPRESSED_STATE_ATTRIBUTES,
+    COMPRESSED_STATE_LAST_UPDATED,
+    COMPRESSED_STATE_STATE,
+)
+from homeassistant.core import HomeAssistant, callback
+import homeassistant.util.dt as dt_util
+
+from .const import (
+    DATA_HISTORY_CACHE,
+    DEFAULT_MAX_CONCURRENT_QUERIES,
+    HISTORY_CACHE_MAX_ROWS,
+    HISTORY_CACHE_TRIM_INTERVAL,
+    HISTORY_CACHE_TTL,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@callback
+def async_get_history_cache(hass: HomeAssistant) -> HistoryCache:
+    """Return history cache shared by all average sensors."""
+    if (cache := hass.data.get(DATA_HISTORY_CACHE)) is None:
+        cache = hass.data[DATA_HISTORY_CACHE] = HistoryCache(hass)
+    return cache
+
+
+class HistoryRows(NamedTuple):
+    """Columnar history of one entity."""
+
+    timestamps: Sequence[float]
+    states: Sequence[str]
+    attributes: Sequence[Mapping[str, Any]] | None
+
+
+class _CacheEntry:
+    """Cached history of one entity.
+
+    Entry contains the state that was in effect at `start_ts` and all state
+    changes after it up to `end_ts`. States are kept in compact columns;
+    attributes are kept only if they are needed.
+    """
+
+    def __init__(self, no_attributes: bool) -> None:
+        """Initialize the entry."""
+        self.no_attributes = no_attributes
+        self.start_ts = math.inf
+        self.end_ts = -math.inf
+        self.timestamps = array("d")
+        self.states: list[str] = []
+        self.attributes: list[Mapping[str, Any]] | None = None if no_attributes else []
+        self.pending: asyncio.Future | None = None
+        # The earliest requested times for the current and the previous
+        # generations. Older states are not needed anymore.
+        self.floor_ts = math.inf
+        self.prev_floor_ts = math.inf
+        self.generation = time.monotonic()
+
+    def __len__(self) -> int:
+        """Return count of cached states."""
+        return len(self.states)
+
+    def covers(self, start_ts: float, end_ts: float) -> bool:
+        """Return True if entry contains all states for the period."""
+        return (
+            self.start_ts <= start_ts <= self.end_ts
+            and end_ts <= self.end_ts + HISTORY_CACHE_TTL.total_seconds()
+        )
+
+    def tail_start(self, settle_time: float) -> float:
+        """Return time from which newer states should be fetched.
+
+        States are committed to the database with some delay, so the recent ones
+        are fetched again.
+        """
+        last_ts = self.timestamps[-1] if self.timestamps else self.start_ts
+        return max(last_ts, self.end_ts - settle_time)
+
+    def slice(
+        self, start_ts: float, end_ts: float, include_start_time_state: bool
+    ) -> HistoryRows:
+        """Return states for the period."""
+        if include_start_time_state:
+            first = max(bisect_right(self.timestamps, start_ts) - 1, 0)
+        else:
+            first = bisect_right(self.timestamps, start_ts)
+        last = bisect_right(self.timestamps, end_ts)
+        return HistoryRows(
+            self.timestamps[first:last],
+            self.states[first:last],
+            None if self.attributes is None else self.attributes[first:last],
+        )
+
+    def _delete(self, index: slice) -> None:
+        """Delete states."""
+        del self.timestamps[index]
+        del self.states[index]
+        if self.attributes is not None:
+            del self.attributes[index]
+
+    def prepend(self, start_ts: float, end_ts: float, rows: list[dict]) -> None:
+        """Add states in front of cached ones."""
+        if self.timestamps and self.timestamps[0] <= self.start_ts:
+            # Drop the state that was in effect at the old start
+            self._delete(slice(0, 1))
+
+        self.timestamps[0:0] = array(
+            "d", [row[COMPRESSED_STATE_LAST_UPDATED] for row in rows]
+        )
+        self.states[0:0] = [row[COMPRESSED_STATE_STATE] for row in rows]
+        if self.attributes is not None:
+            self.attributes[0:0] = [
+                row.get(COMPRESSED_STATE_ATTRIBUTES, {}) for row in rows
+            ]
+        self.start_ts = start_ts
+
+    def extend(self, start_ts: float, end_ts: float, rows: list[dict]) -> None:
+        """Add states to the end of cached ones."""
+        last_ts = self.timestamps[-1] if self.timestamps else -math.inf
+        for row in rows:
+            row_ts = row[COMPRESSED_STATE_LAST_UPDATED]
+            if row_ts > last_ts:
+                self.timestamps.append(row_ts)
+                self.states.append(row[COMPRESSED_STATE_STATE])
+                if self.attributes is not None:
+                    self.attributes.append(row.get(COMPRESSED_STATE_ATTRIBUTES, {}))
+                last_ts = row_ts
+        self.end_ts = max(self.end_ts, end_ts)
+
+    def replace(self, start_ts: float, end_ts: float, rows: list[dict]) -> None:
+        """Replace all cached states."""
+        self._delete(slice(None))
+        self.start_ts = start_ts
+        self.end_ts = -math.inf
+        self.extend(start_ts, end_ts, rows)
+
+    def trim(self) -> None:
+        """Drop states that has not been requested for a while."""
+        now = time.monotonic()
+        if now - self.generation < HISTORY_CACHE_TRIM_INTERVAL.total_seconds():
+            return
+
+        floor_ts = min(self.floor_ts, self.prev_floor_ts)
+        self.prev_floor_ts, self.floor_ts = self.floor_ts, math.inf
+        self.generation = now
+        if floor_ts <= self.start_ts or floor_ts == math.inf:
+            return
+
+        # Keep the state that is in effect at the new start
+        index = bisect_right(self.timestamps, floor_ts) - 1
+        if index > 0:
+            self._delete(slice(0, index))
+        self.start_ts = floor_ts
+
+
+class HistoryCache:
+    """History of source entities shared by all average sensors.
+
+    Overlapping requests of different sensors are served from memory, and
+    concurrent requests for the same entity are merged into one recorder read.
+    No more than `max_queries` recorder reads are run at once.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        max_rows: int = HISTORY_CACHE_MAX_ROWS,
+        max_queries: int = DEFAULT_MAX_CONCURRENT_QUERIES,
+    ):
+        """Initialize the cache."""
+        self._hass = hass
+        self._max_rows = max_rows
+        self._semaphore = asyncio.Semaphore(max_queries)
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+
+    @property
+    def rows(self) -> int:
+        """Return total count of cached states."""
+        return sum(len(entry) for entry in self._entries.values())
+
+    async def async_get_many(
+        self,
+        starts: Mapping[str, datetime.datetime],
+        end: datetime.datetime,
+        include_start_time_state: bool = True,
+        attributes: Container[str] = (),
+    ) -> dict[str, HistoryRows]:
+        """Return state changes of entities during their periods.
+
+        All periods end at the same time but can start at different times.
+        If include_start_time_state is True, the state that was in effect at the
+        start of the period is returned as the first one. State attributes are
+        returned only for entities listed in `attributes`.
+        """
+        starts_ts = {
+            entity_id: start.timestamp() for entity_id, start in starts.items()
+        }
+        end_ts = end.timestamp()
+
+        while True:
+            pending = set()
+            fetches = defaultdict(list)
+            tails = defaultdict(list)
+            for entity_id, start_ts in starts_ts.items():
+                no_attributes = entity_id not in attributes
+                entry = self._entries.get(entity_id)
+                if entry is None or (
+                    entry.no_attributes != no_attributes and entry.pending is None
+                ):
+                    entry = self._entries[entity_id] = _CacheEntry(no_attributes)
+                if entry.pending is not None:
+                    # Somebody is already fetching this entity; wait and retry
+                    pending.add(entry.pending)
+                    continue
+
+                self._entries.move_to_end(entity_id)
+                if entry.covers(start_ts, end_ts):
+                    continue
+
+                if start_ts < entry.start_ts <= entry.end_ts:
+                    # Fetch missing older states
+                    fetches[
+                        (start_ts, entry.start_ts, _CacheEntry.prepend, no_attributes)
+                    ].append(entity_id)
+                elif entry.start_ts <= start_ts <= entry.end_ts:
+                    # Fetch missing newer states
+                    tails[no_attributes].append(entity_id)
+                else:
+                    # Nothing useful cached; start from scratch
+                    fetches[
+                        (start_ts, end_ts, _CacheEntry.replace, no_attributes)
+                    ].append(entity_id)
+
+            for no_attributes, tail in tails.items():
+                # Newer states of all entities are fetched by one request
+                settle_time = get_instance(self._hass).commit_interval
+                tail_start = min(
+                    self._entries[entity_id].tail_start(settle_time)
+                    for entity_id in tail
+                )
+                fetches[(tail_start, end_ts, _CacheEntry.extend, no_attributes)] = tail
+
+            if fetches:
+                await asyncio.gather(
+                    *[
+                        self._async_fetch(entity_ids, *request)
+                        for request, entity_ids in fetches.items()
+                    ]
+                )
+            elif pending:
+                await asyncio.wait(pending)
+            else:
+                break
+
+        result = {}
+        for entity_id, start_ts in starts_ts.items():
+            entry = self._entries[entity_id]
+            entry.floor_ts = min(entry.floor_ts, start_ts)
+            result[entity_id] = entry.slice(start_ts, end_ts, include_start_time_state)
+            entry.trim()
+
+        self._async_evict(starts_ts)
+        return result
+
+    async def async_get(
+        self,
+        entity_id: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        include_start_time_state: bool = True,
+        attributes: bool = False,
+    ) -> HistoryRows:
+        """Return state changes of entity during the period."""
+        result = await self.async_get_many(
+            {entity_id: start},
+            end,
+            include_start_time_state,
+            (entity_id,) if attributes else (),
+        )
+        return result[entity_id]
+
+    async def async_get_uncached(
+        self,
+        entity_ids: Iterable[str],
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> dict[str, HistoryRows]:
+        """Return state changes of entities during the period bypassing the cache.
+
+        It is intended for short periods that are requested rarely, so keeping
+        them would only evict more useful states. Attributes are not returned.
+        """
+        entity_ids = list(entity_ids)
+        async with self._semaphore:
+            history_list = await get_instance(self._hass).async_add_executor_job(
+                partial(
+                    history.get_significant_states,
+                    self._hass,
+                    start,
+                    end,
+                    entity_ids,
+                    significant_changes_only=True,
+                    no_attributes=True,
+                    compressed_state_format=True,
+                )
+            )
+        result = {}
+        for entity_id in entity_ids:
+            rows = history_list.get(entity_id) or []
+            result[entity_id] = HistoryRows(
+                array("d", [row[COMPRESSED_STATE_LAST_UPDATED] for row in rows]),
+                [row[COMPRESSED_STATE_STATE] for row in rows],
+                None,
+            )
+        return result
+
+    async def async_run_query(self, target: Callable[..., Any], *args: Any) -> Any:
+        """Return result of a recorder read that bypasses the cache.
+
+        The read runs in the recorder executor and shares the limit of
+        concurrent queries with the cached ones.
+        """
+        async with self._semaphore:
+            return await get_instance(self._hass).async_add_executor_job(target, *args)
+
+    @callback
+    def _async_fetch(
+        self,
+        entity_ids: list[str],
+        start_ts: float,
+        end_ts: float,
+        apply: Callable[[_CacheEntry, float, float, list[dict]], None],
+        no_attributes: bool,
+    ) -> Coroutine[Any, Any, None]:
+        """Mark entities as being fetched and return coroutine to fetch them.
+
+        Entities are marked at once, so concurrent requests wait for the fetch
+        instead of starting their own ones.
+        """
+        entries = [self._entries[entity_id] for entity_id in entity_ids]
+        future = self._hass.loop.create_future()
+        for entry in entries:
+            entry.pending = future
+
+        async def async_fetch() -> None:
+            """Fetch states of entities from recorder and apply them to cache."""
+            recorder = get_instance(self._hass)
+            try:
+                async with self._semaphore:
+                    history_list = await recorder.async_add_executor_job(
+                        partial(
+                            history.get_significant_states,
+                            self._hass,
+                            dt_util.utc_from_timestamp(start_ts),
+                            dt_util.utc_from_timestamp(end_ts),
+                            entity_ids,
+                            # Newer states are just appended to already cached ones
+                            include_start_time_state=apply is not _CacheEntry.extend,
+                            significant_changes_only=no_attributes,
+                            no_attributes=no_attributes,
+                            compressed_state_format=True,
+                        )
+                    )
+            finally:
+                for entry in entries:
+                    entry.pending = None
+                future.set_result(None)
+
+            for entity_id, entry in zip(entity_ids, entries):
+                apply(entry, start_ts, end_ts, history_list.get(entity_id) or [])
+
+        return async_fetch()
+
+    @callback
+    def _async_evict(self, keep_entity_ids: Iterable[str]) -> None:
+        """Evict least recently used entries if cache exceeds its budget."""
+        rows = self.rows
+        for entity_id in list(self._entries):
+            if rows <= self._max_rows:
+                break
+            entry = self._entries[entity_id]
+            if entity_id in keep_entity_ids or entry.pending is not None:
+                continue
+            _LOGGER.debug('Evict cached history of entity "%s"', entity_id)
+            rows -= len(entry)
+            del self._entries[entity_id]
@@ -0,0 +1,107 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+import time
+from typing import Any
+
+STAGE_RENDER = "render"
+STAGE_FETCH = "fetch"
+STAGE_COMPUTE = "compute"
+
+
+class UpdateStats:
+    """Performance counters of updates of one sensor.
+
+    Counters are cheap to collect, so they are always on.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the counters."""
+        self.updates = 0
+        self.skipped = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.stage_durations: defaultdict[str, float] = defaultdict(float)
+        # Durations of stages and rows fetched per source by the last update
+        self.last_stages: dict[str, float] = {}
+        self.last_rows: dict[str, int] = {}
+        self.last_skipped = False
+        self._start = None
+
+    @property
+    def mean_duration(self) -> float:
+        """Return mean duration of not skipped updates."""
+        computed = self.updates - self.skipped
+        return self.total_duration / computed if computed else 0.0
+
+    def begin(self) -> None:
+        """Mark start of an update."""
+        self._start = time.perf_counter()
+        self.last_stages = {}
+        self.last_rows = {}
+        self.last_skipped = False
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """Measure duration of a stage of the update."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.last_stages[stage] = self.last_stages.get(stage, 0.0) + duration
+
+    def add_rows(self, entity_id: str, rows: int) -> None:
+        """Count rows fetched for a source."""
+        self.last_rows[entity_id] = self.last_rows.get(entity_id, 0) + rows
+
+    def skip(self) -> None:
+        """Mark the update as skipped as the value cannot have changed."""
+        self.last_skipped = True
+
+    def end(self) -> None:
+        """Mark end of the update."""
+        if self._start is None:
+            return
+        duration = time.perf_counter() - self._start
+        self._start = None
+
+        self.updates += 1
+        if self.last_skipped:
+            self.skipped += 1
+            return
+
+        # The rest of time is spent in computing the value
+        self.last_stages[STAGE_COMPUTE] = max(
+            duration - sum(self.last_stages.values()), 0.0
+        )
+        for stage, stage_duration in self.last_stages.items():
+            self.stage_durations[stage] += stage_duration
+        self.total_duration += duration
+        self.max_duration = max(self.max_duration, duration)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return counters as a dict."""
+        return {
+            "updates": self.updates,
+            "skipped": self.skipped,
+            "mean_duration": self.mean_duration,
+            "max_duration": self.max_duration,
+            "stage_durations": dict(self.stage_durations),
+            "last_update": {
+                "skipped": self.last_skipped,
+                "stages": self.last_stages,
+                "rows": self.last_rows,
+            },
+        }
@@ -0,0 +1,90 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from array import array
+from collections.abc import Sequence
+import math
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Minimal count of samples to use NumPy; it is slower on small arrays
+NUMPY_MIN_SIZE = 64
+
+
+def _use_numpy(size: int) -> bool:
+    """Return True if NumPy should be used to process given count of samples."""
+    return np is not None and size >= NUMPY_MIN_SIZE
+
+
+def prefix_sums(
+    timestamps: Sequence[float],
+    values: Sequence[float],
+    integral: float = 0.0,
+    elapsed: float = 0.0,
+) -> tuple[array, array]:
+    """Return running time-weighted integral and covered time at each sample.
+
+    NaN values mean undefined ones; time of them is not covered. Given integral
+    and elapsed are the sums at the first sample.
+    """
+    size = len(timestamps)
+    if not size:
+        return array("d"), array("d")
+
+    if _use_numpy(size):
+        ts = np.asarray(timestamps, dtype=np.float64)
+        prev = np.asarray(values, dtype=np.float64)[:-1]
+        durations = np.where(np.isnan(prev), 0.0, np.diff(ts))
+        integrals = np.empty(size)
+        integrals[0] = 0.0
+        np.cumsum(np.nan_to_num(prev) * durations, out=integrals[1:])
+        elapsed_sums = np.empty(size)
+        elapsed_sums[0] = 0.0
+        np.cumsum(durations, out=elapsed_sums[1:])
+        integrals += integral
+        elapsed_sums += elapsed
+        return array("d", integrals.tobytes()), array("d", elapsed_sums.tobytes())
+
+    integrals = array("d", [integral])
+    elapsed_sums = array("d", [elapsed])
+    for i in range(1, size):
+        value = values[i - 1]
+        if not math.isnan(value):
+            duration = timestamps[i] - timestamps[i - 1]
+            integral += value * duration
+            elapsed += duration
+        integrals.append(integral)
+        elapsed_sums.append(elapsed)
+    return integrals, elapsed_sums
+
+
+def extremes(
+    values: Sequence[float], measured: Sequence[int]
+) -> tuple[int, float | None, float | None]:
+    """Return count, minimum and maximum of measured values."""
+    if _use_numpy(len(values)):
+        selected = np.asarray(values, dtype=np.float64)
+        selected = selected[(np.asarray(measured) != 0) & ~np.isnan(selected)]
+        if not selected.size:
+            return 0, None, None
+        return int(selected.size), float(selected.min()), float(selected.max())
+
+    selected = [
+        value
+        for value, is_measured in zip(values, measured)
+        if is_measured and not math.isnan(value)
+    ]
+    if not selected:
+        return 0, None, None
+    return len(selected), min(selected), max(selected)
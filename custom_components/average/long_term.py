@@ -0,0 +1,134 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+from collections.abc import Collection, Mapping
+from functools import partial
+import logging
+import math
+
+from homeassistant.components.recorder import get_instance
+from homeassistant.components.recorder.statistics import statistics_during_period
+from homeassistant.core import HomeAssistant
+import homeassistant.util.dt as dt_util
+
+HOUR = 3600
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def floor_hour(ts: float) -> float:
+    """Return timestamp of the beginning of the hour."""
+    return math.floor(ts / HOUR) * HOUR
+
+
+def ceil_hour(ts: float) -> float:
+    """Return timestamp of the beginning of the next hour if not at it already."""
+    return math.ceil(ts / HOUR) * HOUR
+
+
+class HourlyStatistics:
+    """Hourly long-term statistics of sources of one sensor.
+
+    Only completed hours are fetched from the recorder, and every hour is
+    fetched once. Hours are kept while they are inside the sensor period.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the statistics."""
+        # Mean, min and max values of every hour by its start timestamp
+        self._hours: dict[str, dict[float, tuple[float, float, float]]] = {}
+        # End of known statistics of every source
+        self._end_ts: dict[str, float] = {}
+
+    def clear(self) -> None:
+        """Drop all statistics."""
+        self._hours.clear()
+        self._end_ts.clear()
+
+    def end_ts(self, entity_id: str) -> float | None:
+        """Return end of known statistics of source."""
+        return self._end_ts.get(entity_id)
+
+    async def async_update(
+        self,
+        hass: HomeAssistant,
+        entity_ids: Collection[str],
+        start_ts: float,
+        end_ts: float,
+        units: Mapping[str, str] | None = None,
+    ) -> None:
+        """Fetch statistics of completed hours of the period that are not known.
+
+        Both period bounds must be at hour boundaries.
+        """
+        fetch_start_ts = end_ts
+        for entity_id in entity_ids:
+            hours = self._hours.setdefault(entity_id, {})
+            for hour_ts in [hour_ts for hour_ts in hours if hour_ts < start_ts]:
+                del hours[hour_ts]
+            known_ts = max(self._end_ts.get(entity_id, start_ts), start_ts)
+            fetch_start_ts = min(fetch_start_ts, known_ts)
+        if fetch_start_ts >= end_ts:
+            return
+
+        _LOGGER.debug(
+            "Fetch statistics of %s from %s to %s", entity_ids, fetch_start_ts, end_ts
+        )
+        result = await get_instance(hass).async_add_executor_job(
+            partial(
+                statistics_during_period,
+                hass,
+                dt_util.utc_from_timestamp(fetch_start_ts),
+                dt_util.utc_from_timestamp(end_ts),
+                set(entity_ids),
+                "hour",
+                units,
+                {"mean", "min", "max"},
+            )
+        )
+        for entity_id, rows in result.items():
+            hours = self._hours.setdefault(entity_id, {})
+            for row in rows:
+                if row.get("mean") is None:
+                    continue
+                hour_ts = row["start"]
+                hours[hour_ts] = (row["mean"], row["min"], row["max"])
+                self._end_ts[entity_id] = max(
+                    self._end_ts.get(entity_id, start_ts), hour_ts + HOUR
+                )
+
+    def integrate(
+        self, entity_id: str, start_ts: float, end_ts: float
+    ) -> tuple[float, float]:
+        """Return time-weighted integral and covered time of hours in the period."""
+        integral = elapsed = 0.0
+        for hour_ts, (mean, _, _) in self._hours.get(entity_id, {}).items():
+            if start_ts <= hour_ts and hour_ts + HOUR <= end_ts:
+                integral += mean * HOUR
+                elapsed += HOUR
+        return integral, elapsed
+
+    def extremes(
+        self, entity_id: str, start_ts: float, end_ts: float
+    ) -> tuple[int, float | None, float | None]:
+        """Return count, minimum and maximum of hours in the period."""
+        selected = [
+            stats
+            for hour_ts, stats in self._hours.get(entity_id, {}).items()
+            if start_ts <= hour_ts and hour_ts + HOUR <= end_ts
+        ]
+        if not selected:
+            return 0, None, None
+        return (
+            len(selected),
+            min(stats[1] for stats in selected),
+            max(stats[2] for stats in selected),
+        )
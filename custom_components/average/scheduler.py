@@ -0,0 +1,98 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Coroutine
+import datetime
+import heapq
+import itertools
+import logging
+import random
+from typing import Any
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import (
+    DATA_STARTUP_SCHEDULER,
+    DEFAULT_MAX_CONCURRENT_QUERIES,
+    DEFAULT_STARTUP_JITTER,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@callback
+def async_get_startup_scheduler(hass: HomeAssistant) -> StartupScheduler:
+    """Return startup scheduler shared by all average sensors."""
+    if (scheduler := hass.data.get(DATA_STARTUP_SCHEDULER)) is None:
+        scheduler = hass.data[DATA_STARTUP_SCHEDULER] = StartupScheduler(hass)
+    return scheduler
+
+
+class StartupScheduler:
+    """Scheduler of initial updates of average sensors.
+
+    Sensors are started in order of their priorities (lower values go first),
+    no more than `max_jobs` at once, and each one after a random delay. So
+    the recorder is not flooded by all sensors at Home Assistant start.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        max_jobs: int = DEFAULT_MAX_CONCURRENT_QUERIES,
+        jitter: datetime.timedelta = DEFAULT_STARTUP_JITTER,
+    ) -> None:
+        """Initialize the scheduler."""
+        self._hass = hass
+        self._jitter = jitter.total_seconds()
+        self._semaphore = asyncio.Semaphore(max_jobs)
+        self._queue: list[
+            tuple[float, int, Callable[[], Coroutine[Any, Any, None]]]
+        ] = []
+        self._counter = itertools.count()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        """Return count of waiting jobs."""
+        return len(self._queue)
+
+    @callback
+    def async_schedule(
+        self, priority: float, job: Callable[[], Coroutine[Any, Any, None]]
+    ) -> None:
+        """Schedule a job."""
+        heapq.heappush(self._queue, (priority, next(self._counter), job))
+        if self._task is None:
+            self._task = self._hass.async_create_background_task(
+                self._async_run(), "average startup scheduler"
+            )
+
+    async def _async_run(self) -> None:
+        """Start scheduled jobs one by one."""
+        try:
+            while self._queue:
+                await self._semaphore.acquire()
+                # Delay also lets all sensors to schedule their jobs before
+                # the first one is chosen
+                await asyncio.sleep(random.uniform(0, self._jitter))
+                _, _, job = heapq.heappop(self._queue)
+                _LOGGER.debug("Start job %s; %d jobs left", job, len(self._queue))
+                self._hass.async_create_task(self._async_run_job(job))
+        finally:
+            self._task = None
+
+    async def _async_run_job(self, job: Callable[[], Coroutine[Any, Any, None]]):
+        """Run the job and let the next one to start."""
+        try:
+            await job()
+        finally:
+            self._semaphore.release()
@@ -9,7 +9,9 @@ https://github.com/Limych/ha-average/
 """
 from __future__ import annotations
 
-from collections.abc import Mapping
+import asyncio
+from collections import defaultdict
+from collections.abc import Callable, Collection, Container, Mapping
 import datetime
 import logging
 import math
@@ -21,8 +23,9 @@ import voluptuous as vol
 
 from homeassistant.components.climate import DOMAIN as CLIMATE_DOMAIN
 from homeassistant.components.group import expand_entity_ids
-from homeassistant.components.recorder import get_instance, history
+from homeassistant.components.recorder import get_instance
 from homeassistant.components.sensor import (
+    ATTR_STATE_CLASS,
     SensorDeviceClass,
     SensorEntity,
     SensorStateClass,
@@ -51,40 +54,91 @@ from homeassistant.core import (
 from homeassistant.exceptions import TemplateError
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.config_validation import PLATFORM_SCHEMA
-from homeassistant.helpers.event import async_track_state_change_event
-from homeassistant.util import Throttle
+from homeassistant.helpers.event import (
+    TrackTemplate,
+    TrackTemplateResult,
+    async_call_later,
+    async_track_point_in_utc_time,
+    async_track_state_change_event,
+    async_track_template_result,
+)
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.template import Template
+from homeassistant.util import Throttle, slugify
 import homeassistant.util.dt as dt_util
-from homeassistant.util.unit_conversion import TemperatureConverter
-from homeassistant.util.unit_system import TEMPERATURE_UNITS
 
 from .const import (
+    ATTR_APPROXIMATE,
     ATTR_AVAILABLE_SOURCES,
     ATTR_COUNT,
     ATTR_COUNT_SOURCES,
     ATTR_END,
+    ATTR_INTEGRAL,
     ATTR_MAX_VALUE,
     ATTR_MIN_VALUE,
+    ATTR_PERCENTILES,
+    ATTR_STANDARD_DEVIATION,
     ATTR_START,
+    ATTR_TIME_ABOVE,
+    ATTR_TIME_BELOW,
     ATTR_TO_PROPERTY,
     ATTR_TRENDING_TOWARDS,
+    ATTR_VARIANCE,
+    BACKEND_DATABASE,
+    BACKEND_PYTHON,
+    BACKENDS,
+    CONF_BACKEND,
+    CONF_BUCKET_SIZE,
+    CONF_DEBOUNCE,
     CONF_DURATION,
+    CONF_DURATIONS,
     CONF_END,
+    CONF_HALF_LIFE,
+    CONF_PERCENTILES,
     CONF_PERIOD_KEYS,
     CONF_PRECISION,
     CONF_PROCESS_UNDEF_AS,
+    CONF_PUSH_UPDATES,
     CONF_START,
+    CONF_STATISTICS,
+    CONF_THRESHOLD,
+    CONF_USE_STATISTICS,
+    DATA_EXECUTOR_THRESHOLD,
+    DATA_SENSORS,
+    DEFAULT_DEBOUNCE,
+    DEFAULT_EXECUTOR_THRESHOLD,
     DEFAULT_NAME,
     DEFAULT_PRECISION,
+    DOMAIN,
+    PUSH_MAX_INTERVAL,
+    STATISTICS,
+    STORAGE_MAX_SAMPLES,
+    STORAGE_SAVE_DELAY,
+    STORAGE_VERSION,
+    STREAM_MIN_PERIOD,
     UPDATE_MIN_TIME,
 )
+from .buckets import BucketWindow
+from .database import AggregateWindow, async_get_aggregates, iter_recorder_states
+from .engine import CurrentValues, DecayingAverage, SourceWindow
+from .extractor import ValueExtractor, is_temperature_entity
+from .history_cache import HistoryRows, async_get_history_cache
+from .instrumentation import STAGE_FETCH, STAGE_RENDER, UpdateStats
+from .long_term import HOUR, HourlyStatistics, ceil_hour, floor_hour
+from .scheduler import async_get_startup_scheduler
+from .sketch import QuantileSketch
 
 _LOGGER = logging.getLogger(__name__)
 
+ATTRIBUTES_TEMPERATURE_DOMAINS = (WEATHER_DOMAIN, CLIMATE_DOMAIN, WATER_HEATER_DOMAIN)
+
 
 def check_period_keys(conf):
     """Ensure maximum 2 of CONF_PERIOD_KEYS are provided."""
-    count = sum(param in conf for param in CONF_PERIOD_KEYS)
-    if (count == 1 and CONF_DURATION not in conf) or count > 2:
+    count = sum(param in conf for param in (*CONF_PERIOD_KEYS, CONF_DURATIONS))
+    if (
+        count == 1 and CONF_DURATION not in conf and CONF_DURATIONS not in conf
+    ) or count > 2:
         raise vol.Invalid(
             "You must provide none, only "
             + CONF_DURATION
@@ -94,6 +148,127 @@ def check_period_keys(conf):
     return conf
 
 
+def check_threshold(conf):
+    """Ensure threshold is provided if statistics need it."""
+    if CONF_THRESHOLD not in conf and any(
+        stat in conf.get(CONF_STATISTICS, ())
+        for stat in (ATTR_TIME_ABOVE, ATTR_TIME_BELOW)
+    ):
+        raise vol.Invalid(
+            "You must provide "
+            + CONF_THRESHOLD
+            + " to compute "
+            + ATTR_TIME_ABOVE
+            + " or "
+            + ATTR_TIME_BELOW
+        )
+    return conf
+
+
+def check_bucket_size(conf):
+    """Ensure buckets are not used with options they cannot serve."""
+    if CONF_BUCKET_SIZE in conf and (
+        conf.get(CONF_USE_STATISTICS) or conf.get(CONF_PERCENTILES)
+    ):
+        raise vol.Invalid(
+            "You cannot use "
+            + CONF_BUCKET_SIZE
+            + " together with "
+            + CONF_USE_STATISTICS
+            + " or "
+            + CONF_PERCENTILES
+        )
+    return conf
+
+
+def check_use_statistics(conf):
+    """Ensure long-term statistics are not used with options they cannot serve."""
+    if not conf.get(CONF_USE_STATISTICS):
+        return conf
+    options = [
+        option for option in (CONF_STATISTICS, CONF_PERCENTILES) if conf.get(option)
+    ]
+    if options:
+        raise vol.Invalid(
+            "You cannot use "
+            + ", ".join(options)
+            + " together with "
+            + CONF_USE_STATISTICS
+        )
+    return conf
+
+
+def check_half_life(conf):
+    """Ensure exponential averaging is not used with a period."""
+    if CONF_HALF_LIFE in conf and any(param in conf for param in CONF_PERIOD_KEYS):
+        raise vol.Invalid(
+            "You cannot use "
+            + CONF_HALF_LIFE
+            + " together with any of the following: "
+            + ", ".join(CONF_PERIOD_KEYS)
+        )
+    return conf
+
+
+def check_backend(conf):
+    """Ensure database backend is not used with options it cannot serve."""
+    if conf.get(CONF_BACKEND) != BACKEND_DATABASE:
+        return conf
+    options = [
+        option
+        for option in (
+            CONF_PUSH_UPDATES,
+            CONF_USE_STATISTICS,
+            CONF_STATISTICS,
+            CONF_PERCENTILES,
+            CONF_BUCKET_SIZE,
+        )
+        if conf.get(option)
+    ]
+    if options:
+        raise vol.Invalid(
+            "You cannot use "
+            + ", ".join(options)
+            + " together with "
+            + CONF_BACKEND
+            + ": "
+            + BACKEND_DATABASE
+        )
+    return conf
+
+
+def check_durations(conf):
+    """Ensure list of durations is not used with options it cannot serve."""
+    if CONF_DURATIONS not in conf:
+        return conf
+    options = [
+        option
+        for option in (
+            CONF_DURATION,
+            CONF_USE_STATISTICS,
+            CONF_BUCKET_SIZE,
+            CONF_HALF_LIFE,
+        )
+        if conf.get(option)
+    ]
+    if conf.get(CONF_BACKEND) == BACKEND_DATABASE:
+        options.append(CONF_BACKEND + ": " + BACKEND_DATABASE)
+    if options:
+        raise vol.Invalid(
+            "You cannot use " + ", ".join(options) + " together with " + CONF_DURATIONS
+        )
+    return conf
+
+
+def duration_suffix(duration: datetime.timedelta) -> str:
+    """Return short suffix of the duration for names of sensors, like "15m"."""
+    seconds = duration.total_seconds()
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size and seconds % size == 0:
+            return f"{seconds // size:g}{unit}"
+    return f"{seconds:g}s"
+
+
 PLATFORM_SCHEMA = vol.All(
     PLATFORM_SCHEMA.extend(
         {
@@ -103,11 +278,33 @@ PLATFORM_SCHEMA = vol.All(
             vol.Optional(CONF_START): cv.template,
             vol.Optional(CONF_END): cv.template,
             vol.Optional(CONF_DURATION): cv.positive_time_period,
+            vol.Optional(CONF_DURATIONS): vol.All(
+                cv.ensure_list, vol.Length(min=1), [cv.positive_time_period]
+            ),
             vol.Optional(CONF_PRECISION, default=DEFAULT_PRECISION): int,
             vol.Optional(CONF_PROCESS_UNDEF_AS): vol.Any(int, float),
+            vol.Optional(CONF_PUSH_UPDATES, default=False): cv.boolean,
+            vol.Optional(CONF_USE_STATISTICS, default=False): cv.boolean,
+            vol.Optional(CONF_STATISTICS, default=[]): vol.All(
+                cv.ensure_list, [vol.In(STATISTICS)]
+            ),
+            vol.Optional(CONF_THRESHOLD): vol.Coerce(float),
+            vol.Optional(CONF_PERCENTILES, default=[]): vol.All(
+                cv.ensure_list, [vol.All(vol.Coerce(float), vol.Range(min=0, max=100))]
+            ),
+            vol.Optional(CONF_BUCKET_SIZE): cv.positive_time_period,
+            vol.Optional(CONF_DEBOUNCE, default=DEFAULT_DEBOUNCE): cv.time_period,
+            vol.Optional(CONF_BACKEND, default=BACKEND_PYTHON): vol.In(BACKENDS),
+            vol.Optional(CONF_HALF_LIFE): cv.positive_time_period,
         }
     ),
     check_period_keys,
+    check_threshold,
+    check_bucket_size,
+    check_use_statistics,
+    check_backend,
+    check_half_life,
+    check_durations,
 )
 
 
@@ -123,21 +320,53 @@ async def async_setup_platform(
         if template is not None:
             template.hass = hass
 
-    async_add_entities(
-        [
-            AverageSensor(
-                hass,
-                config.get(CONF_UNIQUE_ID),
-                config.get(CONF_NAME),
-                start,
-                end,
-                config.get(CONF_DURATION),
-                config.get(CONF_ENTITIES),
-                config.get(CONF_PRECISION),
-                config.get(CONF_PROCESS_UNDEF_AS),
+    def new_sensor(unique_id, name, duration) -> AverageSensor:
+        """Return sensor of the period with given duration."""
+        return AverageSensor(
+            hass,
+            unique_id,
+            name,
+            start,
+            end,
+            duration,
+            config.get(CONF_ENTITIES),
+            config.get(CONF_PRECISION, DEFAULT_PRECISION),
+            config.get(CONF_PROCESS_UNDEF_AS),
+            config.get(CONF_PUSH_UPDATES, False),
+            config.get(CONF_USE_STATISTICS, False),
+            config.get(CONF_STATISTICS, []),
+            config.get(CONF_THRESHOLD),
+            config.get(CONF_PERCENTILES, []),
+            config.get(CONF_BUCKET_SIZE),
+            config.get(CONF_DEBOUNCE, DEFAULT_DEBOUNCE),
+            config.get(CONF_BACKEND, BACKEND_PYTHON),
+            config.get(CONF_HALF_LIFE),
+        )
+
+    unique_id = config.get(CONF_UNIQUE_ID)
+    name = config.get(CONF_NAME)
+    if CONF_DURATIONS not in config:
+        async_add_entities([new_sensor(unique_id, name, config.get(CONF_DURATION))])
+        return
+
+    # Sensor of the longest duration fetches history for all the others
+    sensors = []
+    for duration in sorted(set(config[CONF_DURATIONS]), reverse=True):
+        suffix = duration_suffix(duration)
+        sensors.append(
+            new_sensor(
+                (
+                    f"{unique_id}_{suffix}"
+                    if unique_id not in (None, "__legacy__")
+                    else unique_id
+                ),
+                f"{name} {suffix}",
+                duration,
             )
-        ]
-    )
+        )
+    for follower in sensors[1:]:
+        sensors[0].add_follower(follower)
+    async_add_entities(sensors)
 
 
 # pylint: disable=too-many-instance-attributes
@@ -154,6 +383,13 @@ class AverageSensor(SensorEntity):
             ATTR_MAX_VALUE,
             ATTR_MIN_VALUE,
             ATTR_TRENDING_TOWARDS,
+            ATTR_APPROXIMATE,
+            ATTR_VARIANCE,
+            ATTR_STANDARD_DEVIATION,
+            ATTR_INTEGRAL,
+            ATTR_TIME_ABOVE,
+            ATTR_TIME_BELOW,
+            ATTR_PERCENTILES,
         }
     )
 
@@ -169,6 +405,15 @@ class AverageSensor(SensorEntity):
         entity_ids: list,
         precision: int,
         undef,
+        push_updates: bool = False,
+        use_statistics: bool = False,
+        statistics: Collection[str] = (),
+        threshold: float | None = None,
+        percentiles: Collection[float] = (),
+        bucket_size: datetime.timedelta | None = None,
+        debounce: datetime.timedelta = DEFAULT_DEBOUNCE,
+        backend: str = BACKEND_PYTHON,
+        half_life: datetime.timedelta | None = None,
     ):
         """Initialize the sensor."""
         self._start_template = start
@@ -179,6 +424,55 @@ class AverageSensor(SensorEntity):
         self._undef = undef
         self._temperature_mode = None
         self._actual_end = None
+        self._windows: dict[str, SourceWindow | BucketWindow] = {}
+        self._window_period = None
+        self._current = CurrentValues()
+        self._push_updates = push_updates
+        # Windows are kept up to date by state change events in push mode
+        self._windows_live = False
+        self._pending_samples: list[tuple[str, State | None]] | None = None
+        self._unsub_push_timer = None
+        # Bursts of source changes are coalesced into one push update
+        self._debounce = debounce.total_seconds()
+        self._unsub_debounce = None
+        self._push_update_queued = False
+        # Updates scheduled before removal of the entity are not run
+        self._removed_from_hass = False
+        # Poll and push updates never run concurrently
+        self._update_lock = asyncio.Lock()
+        # Averages over the period are computed by the recorder database
+        self._database_backend = backend == BACKEND_DATABASE
+        # Current values are exponentially averaged over time if half-life is set
+        self._half_life = half_life.total_seconds() if half_life else None
+        self._decaying: dict[str, DecayingAverage] = {}
+        # Sensors of shorter durations are computed from windows of the leader
+        self._leader: AverageSensor | None = None
+        self._followers: list[AverageSensor] = []
+        # Parsed values of start and end templates kept up to date by the
+        # template tracker; None means the current time
+        self._template_values: dict[str, datetime.datetime | None] = {}
+        self._use_statistics = use_statistics
+        self._statistics = HourlyStatistics()
+        # Raw states of the first partial hour of the period
+        self._head_windows: dict[str, SourceWindow] = {}
+        self._head_hour_ts = None
+        self._store: Store | None = None
+        self._update_stats = UpdateStats()
+        self._extractors: dict[str, ValueExtractor] = {}
+        # Additional statistics and functions of values which integrals
+        # are needed to compute them
+        self._extra_statistics = frozenset(statistics)
+        self._channels: dict[str, Callable[[float], float]] = {}
+        if {ATTR_VARIANCE, ATTR_STANDARD_DEVIATION} & self._extra_statistics:
+            self._channels["square"] = lambda value: value * value
+        if ATTR_TIME_ABOVE in self._extra_statistics:
+            self._channels[ATTR_TIME_ABOVE] = lambda value: float(value > threshold)
+        if ATTR_TIME_BELOW in self._extra_statistics:
+            self._channels[ATTR_TIME_BELOW] = lambda value: float(value < threshold)
+        self._threshold = threshold
+        self._percentiles = sorted(set(percentiles))
+        # Samples of completed buckets are folded if bucket size is set
+        self._bucket_size = bucket_size.total_seconds() if bucket_size else None
 
         self.sources = expand_entity_ids(hass, entity_ids)
         self.count_sources = len(self.sources)
@@ -186,6 +480,10 @@ class AverageSensor(SensorEntity):
         self.count = 0
         self.trending_towards = None
         self.min_value = self.max_value = None
+        self.approximate = None
+        self.variance = self.standard_deviation = self.integral = None
+        self.time_above = self.time_below = None
+        self.percentiles = None
 
         self._attr_name = name
         self._attr_native_value = None
@@ -215,10 +513,20 @@ class AverageSensor(SensorEntity):
             or self._duration is not None
         )
 
+    def add_follower(self, follower: AverageSensor) -> None:
+        """Compute state of the sensor of a shorter duration on every update."""
+        follower._leader = self
+        self._followers.append(follower)
+
     @property
     def should_poll(self) -> bool:
         """Return the polling state."""
-        return self._has_period
+        if self._leader is not None:
+            return False
+        # Exponential averages decay to current values with time
+        return (
+            self._has_period and not self._push_updates
+        ) or self._half_life is not None
 
     @property
     def available(self) -> bool:
@@ -237,32 +545,326 @@ class AverageSensor(SensorEntity):
 
     async def async_added_to_hass(self) -> None:
         """Register callbacks."""
+        sensors = self.hass.data.setdefault(DATA_SENSORS, set())
+        sensors.add(self)
+        self.async_on_remove(lambda: sensors.discard(self))
+
+        if (
+            (self._has_period or self._half_life is not None)
+            and self._leader is None
+            and self.unique_id is not None
+        ):
+            self._store = Store(
+                self.hass, STORAGE_VERSION, f"{DOMAIN}.{slugify(self.unique_id)}"
+            )
+            if self._half_life is not None:
+                await self._async_restore_decaying()
+            else:
+                await self._async_restore_windows()
 
         # pylint: disable=unused-argument
         @callback
-        async def async_sensor_state_listener(
+        def async_sensor_state_listener(
             event: Event[EventStateChangedData],
         ) -> None:
             """Handle device state changes."""
-            last_state = self._attr_native_value
-            await self._async_update_state()
-            if last_state != self._attr_native_value:
-                self.async_schedule_update_ha_state(True)
+            # Only the changed source is processed; the sensor state is
+            # written once after a burst of changes
+            self._update_current_value(event.data["entity_id"], event.data["new_state"])
+            self._async_save_decaying()
+            self._async_debounce_push_update()
+
+        @callback
+        def async_sensor_push_listener(
+            event: Event[EventStateChangedData],
+        ) -> None:
+            """Handle device state changes in push mode."""
+            self._add_sample(event.data["entity_id"], event.data["new_state"])
+            self._async_debounce_push_update()
+
+        async def async_sensor_startup_update() -> None:
+            """Compute initial state of sensor with a period."""
+            if self._push_updates:
+                self.async_on_remove(
+                    async_track_state_change_event(
+                        self.hass, self.sources, async_sensor_push_listener
+                    )
+                )
+                await self._async_push_update()
+            else:
+                await self.async_update_ha_state(True)
 
         # pylint: disable=unused-argument
         @callback
         async def async_sensor_startup(event):
             """Update template on startup."""
+            if self._leader is not None:
+                # State is computed by the leader
+                return
             if self._has_period:
-                self.async_schedule_update_ha_state(True)
+                # Sensors with shorter periods are computed first
+                async_get_startup_scheduler(self.hass).async_schedule(
+                    (
+                        self._duration.total_seconds()
+                        if self._duration is not None
+                        else math.inf
+                    ),
+                    async_sensor_startup_update,
+                )
             else:
-                async_track_state_change_event(
-                    self.hass, self.sources, async_sensor_state_listener
+                self.async_on_remove(
+                    async_track_state_change_event(
+                        self.hass, self.sources, async_sensor_state_listener
+                    )
                 )
-                await async_sensor_state_listener(Event("startup"))
+                last_state = self._attr_native_value
+                await self._async_update_state()
+                if last_state != self._attr_native_value:
+                    self.async_write_ha_state()
 
         self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_START, async_sensor_startup)
 
+        # Templates are rendered again only if their dependencies change
+        track_templates = [
+            TrackTemplate(template, None)
+            for template in (self._start_template, self._end_template)
+            if template is not None
+        ]
+        if track_templates:
+            tracker = async_track_template_result(
+                self.hass, track_templates, self._async_template_updated
+            )
+            self.async_on_remove(tracker.async_remove)
+            tracker.async_refresh()
+
+    async def _async_restore_windows(self) -> None:
+        """Restore samples collected before restart.
+
+        Only states changed after the last restored ones are fetched then.
+        """
+        data = await self._store.async_load()
+        if not data or not data.get("windows"):
+            return
+        if data.get("config") != self._windows_config():
+            _LOGGER.debug(
+                'Stored samples of sensor "%s" are for other options', self.name
+            )
+            return
+
+        try:
+            windows = {
+                entity_id: self._window_from_dict(window)
+                for entity_id, window in data["windows"].items()
+                if entity_id in self.sources
+            }
+            start_ts, end_ts = data["period"]
+        except (KeyError, TypeError, ValueError) as ex:
+            _LOGGER.warning(
+                'Unable to restore samples of sensor "%s": %s', self.name, ex
+            )
+            return
+
+        _LOGGER.debug('Restored samples of sensor "%s"', self.name)
+        self._windows = windows
+        self._window_period = start_ts, end_ts
+
+    async def _async_restore_decaying(self) -> None:
+        """Restore exponential averages of sources collected before restart.
+
+        So they need no history to continue.
+        """
+        data = await self._store.async_load()
+        if not data or not data.get("decaying"):
+            return
+
+        try:
+            decaying = {
+                entity_id: DecayingAverage.from_dict(average, self._half_life)
+                for entity_id, average in data["decaying"].items()
+                if entity_id in self.sources
+            }
+        except (KeyError, TypeError, ValueError) as ex:
+            _LOGGER.warning(
+                'Unable to restore averages of sensor "%s": %s', self.name, ex
+            )
+            return
+
+        _LOGGER.debug('Restored averages of sensor "%s"', self.name)
+        self._decaying = decaying
+
+    @callback
+    def _async_save_decaying(self) -> None:
+        """Schedule saving of exponential averages of sources."""
+        if self._store is None or self._half_life is None:
+            return
+        self._store.async_delay_save(
+            lambda: {
+                "decaying": {
+                    entity_id: decaying.as_dict()
+                    for entity_id, decaying in self._decaying.items()
+                }
+            },
+            STORAGE_SAVE_DELAY.total_seconds(),
+        )
+
+    def _windows_config(self) -> dict[str, Any]:
+        """Return options which samples in windows depend on."""
+        return {
+            "sources": sorted(self.sources),
+            "undef": self._undef,
+            "temperature_unit": self.hass.config.units.temperature_unit,
+            "bucket_size": self._bucket_size,
+            "percentiles": self._percentiles,
+            "channels": sorted(self._channels),
+            "threshold": self._threshold,
+        }
+
+    @callback
+    def _windows_to_store(self) -> dict[str, Any]:
+        """Return collected samples to store."""
+        if sum(len(window) for window in self._windows.values()) > STORAGE_MAX_SAMPLES:
+            _LOGGER.debug('Too many samples to store for sensor "%s"', self.name)
+            return {"windows": {}}
+
+        return {
+            "config": self._windows_config(),
+            "period": self._window_period,
+            "windows": {
+                entity_id: window.as_dict()
+                for entity_id, window in self._windows.items()
+            },
+        }
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Cancel scheduled updates."""
+        self._removed_from_hass = True
+        if self._unsub_push_timer is not None:
+            self._unsub_push_timer()
+            self._unsub_push_timer = None
+        if self._unsub_debounce is not None:
+            self._unsub_debounce()
+            self._unsub_debounce = None
+
+    async def async_removed_from_registry(self) -> None:
+        """Remove stored data of the sensor deleted for good."""
+        if self._store is not None:
+            await self._store.async_remove()
+
+    def _add_sample(self, entity_id: str, state: State | None) -> None:
+        """Add new state of source to its window."""
+        if not self._windows_live:
+            if self._pending_samples is not None:
+                # Window is being filled from history; add the state after that
+                self._pending_samples.append((entity_id, state))
+            return
+
+        window = self._windows.get(entity_id)
+        if state is None or window is None:
+            return
+
+        self._init_mode(state)
+        value, measured = self._parse_state_value(state)
+        window.append(state.last_updated_timestamp, value, measured)
+
+    async def _async_push_update(self) -> None:
+        """Update the sensor state and schedule the next update.
+
+        Current values of sources of a sensor without a period are updated by
+        every change, so only the sensor state is written for it.
+        """
+        if self._removed_from_hass:
+            return
+        if not self._has_period:
+            self._push_update_queued = False
+            last_state = self._attr_native_value
+            self._apply_current_values()
+            if last_state != self._attr_native_value:
+                self.async_write_ha_state()
+            return
+
+        await self._async_update_state(push=True)
+        if self._removed_from_hass:
+            return
+        self.async_write_ha_state()
+        self._async_schedule_push_update()
+
+    @callback
+    def _async_queue_push_update(self) -> None:
+        """Start push update unless one is already waiting to start.
+
+        The waiting update will see all changes made until it starts, so
+        there is no need in another one.
+        """
+        if self._push_update_queued:
+            return
+        self._push_update_queued = True
+        self.hass.async_create_task(self._async_push_update())
+
+    @callback
+    def _async_debounce_push_update(self) -> None:
+        """Schedule push update after a burst of source changes.
+
+        All changes during the debounce delay are coalesced into one update.
+        Changes during an update in progress cause one follow-up update at
+        most.
+        """
+        if self._unsub_debounce is not None:
+            return
+
+        @callback
+        def async_debounce_timer(now: datetime.datetime) -> None:
+            """Update the sensor state after the debounce delay."""
+            self._unsub_debounce = None
+            self._async_queue_push_update()
+
+        self._unsub_debounce = async_call_later(
+            self.hass, self._debounce, async_debounce_timer
+        )
+
+    @callback
+    def _async_schedule_push_update(self) -> None:
+        """Schedule update for the moment when the value changes by itself.
+
+        It happens when the period ends or when a sample slides out of the
+        window. Followers are updated together with the sensor, so their
+        periods are taken into account too.
+        """
+        if self._unsub_push_timer is not None:
+            self._unsub_push_timer()
+
+        now_ts = dt_util.utcnow().timestamp()
+        next_ts = now_ts + PUSH_MAX_INTERVAL.total_seconds()
+        for sensor in (self, *self._followers):
+            if sensor._actual_end is not None:
+                actual_end_ts = dt_util.as_timestamp(sensor._actual_end)
+                if actual_end_ts > now_ts:
+                    next_ts = min(next_ts, actual_end_ts)
+
+        # Window start slides with the time only if it is set by the duration
+        if self._start_template is None and self._window_period is not None:
+            starts = [self._window_period[0]]
+            starts.extend(
+                math.floor(dt_util.as_timestamp(follower._period[0]))
+                for follower in self._followers
+                if follower._period is not None
+            )
+            for start_ts in starts:
+                for window in self._windows.values():
+                    if (sample_ts := window.next_ts(start_ts)) is not None:
+                        next_ts = min(next_ts, now_ts + sample_ts - start_ts)
+
+        @callback
+        def async_push_timer(now: datetime.datetime) -> None:
+            """Update the sensor state by timer."""
+            self._unsub_push_timer = None
+            self._async_queue_push_update()
+
+        self._unsub_push_timer = async_track_point_in_utc_time(
+            self.hass,
+            async_push_timer,
+            dt_util.utc_from_timestamp(max(next_ts, now_ts + 1)),
+        )
+
     @staticmethod
     def _has_state(state) -> bool:
         """Return True if state has any value."""
@@ -273,59 +875,120 @@ class AverageSensor(SensorEntity):
             "",
         ]
 
-    def _get_temperature(self, state: State) -> float | None:
-        """Get temperature value from entity."""
+    def _get_extractor(
+        self,
+        entity_id: str,
+        attributes: Mapping[str, Any],
+        temperature: bool | None = None,
+    ) -> ValueExtractor:
+        """Return value extractor of source with given attributes.
+
+        Extractor is compiled once and is rebuilt only if the sensor mode or
+        units of the source have changed.
+        """
+        if temperature is None:
+            temperature = bool(self._temperature_mode)
         ha_unit = self.hass.config.units.temperature_unit
-        domain = split_entity_id(state.entity_id)[0]
-        if domain == WEATHER_DOMAIN:
-            temperature = state.attributes.get("temperature")
-            entity_unit = ha_unit
-        elif domain in (CLIMATE_DOMAIN, WATER_HEATER_DOMAIN):
-            temperature = state.attributes.get("current_temperature")
-            entity_unit = ha_unit
-        else:
-            temperature = state.state
-            entity_unit = state.attributes.get(ATTR_UNIT_OF_MEASUREMENT)
-
-        if not self._has_state(temperature):
-            return None
-
-        try:
-            temperature = TemperatureConverter.convert(
-                float(temperature), entity_unit, ha_unit
+        extractor = self._extractors.get(entity_id)
+        if extractor is None or not extractor.matches(temperature, attributes, ha_unit):
+            extractor = self._extractors[entity_id] = ValueExtractor(
+                entity_id, attributes, temperature, ha_unit, self._undef
             )
-        except ValueError as exc:
-            _LOGGER.error('Could not convert value "%s" to float: %s', state, exc)
-            return None
+        return extractor
 
-        return temperature
+    def _get_temperature(self, state: State) -> float | None:
+        """Get temperature value from entity."""
+        return self._get_extractor(
+            state.entity_id, state.attributes, True
+        ).get_temperature(state.state, state.attributes)
+
+    def _parse_value(
+        self, entity_id: str, state: str, attributes: Mapping[str, Any]
+    ) -> tuple[float | None, bool]:
+        """Return value of given raw entity state and is it really measured."""
+        return self._get_extractor(entity_id, attributes).parse(state, attributes)
+
+    def _parse_state_value(self, state: State) -> tuple[float | None, bool]:
+        """Return value of given entity state and is it really measured."""
+        return self._parse_value(state.entity_id, state.state, state.attributes)
+
+    def _count_value(self, value: float) -> None:
+        """Count measured value in the sensor attributes."""
+        self._count_values(1, value, value)
+
+    def _count_values(self, count: int, min_value: float, max_value: float) -> None:
+        """Count measured values in the sensor attributes."""
+        if min_value is None:
+            return
+
+        self.count += count
+        min_value = round(min_value, self._precision)
+        max_value = round(max_value, self._precision)
+        if self.min_value is None:
+            self.min_value, self.max_value = min_value, max_value
+        else:
+            self.min_value = min(self.min_value, min_value)
+            self.max_value = max(self.max_value, max_value)
 
     def _get_state_value(self, state: State) -> float | None:
         """Return value of given entity state and count some sensor attributes."""
-        state = self._get_temperature(state) if self._temperature_mode else state.state
-        if not self._has_state(state):
-            return self._undef
+        value, measured = self._parse_state_value(state)
+        if measured:
+            self._count_value(value)
+        return value
+
+    def _update_current_value(self, entity_id: str, state: State | None) -> None:
+        """Update current value of one source."""
+        if state is None:
+            self._current.update(entity_id, None, False)
+            return
 
-        try:
-            state = float(state)
-        except ValueError as exc:
-            _LOGGER.error('Could not convert value "%s" to float: %s', state, exc)
-            return None
+        self._init_mode(state)
+        value, measured = self._parse_state_value(state)
+        _LOGGER.debug("Current state of %s: %s", entity_id, value)
+        if not isinstance(value, numbers.Number):
+            value = None
+        if self._half_life is not None:
+            decaying = self._decaying.get(entity_id)
+            if decaying is None:
+                decaying = self._decaying[entity_id] = DecayingAverage(self._half_life)
+            decaying.append(state.last_updated_timestamp, value, measured)
+            value = decaying.value(dt_util.utcnow().timestamp())
+        self._current.update(entity_id, value, measured)
+
+    def _update_decaying_values(self) -> None:
+        """Update current values of sources with their averages decayed till now."""
+        now_ts = dt_util.utcnow().timestamp()
+        for entity_id, decaying in self._decaying.items():
+            if entity_id in self.sources:
+                self._current.update(
+                    entity_id, decaying.value(now_ts), decaying.measured
+                )
+        self._apply_current_values()
 
-        self.count += 1
-        rstate = round(state, self._precision)
-        if self.min_value is None:
-            self.min_value = self.max_value = rstate
-        else:
-            self.min_value = min(self.min_value, rstate)
-            self.max_value = max(self.max_value, rstate)
-        return state
+    def _apply_current_values(self) -> None:
+        """Update the sensor state from current values of sources."""
+        current = self._current
+        self.available_sources = len(current)
+        self.count = 0
+        self.min_value = self.max_value = None
+        if current.count:
+            self._count_values(current.count, current.min_value, current.max_value)
+
+        value = current.average
+        if value is not None:
+            value = round(value, self._precision)
+            if self._precision < 1:
+                value = int(value)
+        self._attr_native_value = value
 
     @Throttle(UPDATE_MIN_TIME)
     async def async_update(self):
         """Update the sensor state if it needed."""
         if self._has_period:
             await self._async_update_state()
+        elif self._half_life is not None:
+            self._update_decaying_values()
 
     @staticmethod
     def handle_template_exception(exc, field):
@@ -339,52 +1002,84 @@ class AverageSensor(SensorEntity):
         else:
             _LOGGER.error('Error parsing template for field "%s": %s', field, exc)
 
-    async def _async_update_period(self):  # pylint: disable=too-many-branches
+    @staticmethod
+    def _parse_period_bound(rendered) -> datetime.datetime | None:
+        """Parse rendered template as a datetime or a timestamp."""
+        value = None
+        if isinstance(rendered, str):
+            value = dt_util.parse_datetime(rendered)
+        if value is None:
+            try:
+                value = dt_util.as_local(
+                    dt_util.utc_from_timestamp(math.floor(float(rendered)))
+                )
+            except (TypeError, ValueError):
+                return None
+        return value
+
+    def _get_period_bound(
+        self, template: Template, field: str, now: datetime.datetime
+    ) -> datetime.datetime | None:
+        """Return value of start or end template."""
+        if field in self._template_values:
+            value = self._template_values[field]
+            return now if value is None else value
+
+        _LOGGER.debug("Process %s template: %s", field, template)
+        try:
+            rendered = template.async_render()
+        except (TemplateError, TypeError) as ex:
+            self.handle_template_exception(ex, field)
+            return None
+        value = self._parse_period_bound(rendered)
+        if value is None:
+            _LOGGER.error(
+                'Parsing error: field "%s" must be a datetime or a timestamp', field
+            )
+        return value
+
+    @callback
+    def _async_template_updated(
+        self, event: Event | None, updates: list[TrackTemplateResult]
+    ) -> None:
+        """Cache new values of start and end templates."""
+        now = dt_util.now()
+        for update in updates:
+            field = CONF_START if update.template is self._start_template else CONF_END
+            value = None
+            if not isinstance(update.result, TemplateError):
+                value = self._parse_period_bound(update.result)
+            if value is None:
+                # Template is rendered on update to report the error
+                self._template_values.pop(field, None)
+            elif (
+                abs((value - now).total_seconds()) < 1
+                and update.template.async_render_to_info().has_time
+            ):
+                # Template follows the current time, which is updated by the
+                # tracker only once a minute
+                self._template_values[field] = None
+            else:
+                self._template_values[field] = value
+
+        # Push updates start with the first update scheduled on startup
+        if self._push_updates and event is not None and self._unsub_push_timer:
+            self.hass.async_create_task(self._async_push_update())
+
+    async def _async_update_period(self):
         """Parse the templates and calculate a datetime tuples."""
         start = end = None
         now = dt_util.now()
 
-        # Parse start
         if self._start_template is not None:
-            _LOGGER.debug("Process start template: %s", self._start_template)
-            try:
-                start_rendered = self._start_template.async_render()
-            except (TemplateError, TypeError) as ex:
-                self.handle_template_exception(ex, "start")
-                return
-            if isinstance(start_rendered, str):
-                start = dt_util.parse_datetime(start_rendered)
+            start = self._get_period_bound(self._start_template, CONF_START, now)
             if start is None:
-                try:
-                    start = dt_util.as_local(
-                        dt_util.utc_from_timestamp(math.floor(float(start_rendered)))
-                    )
-                except ValueError:
-                    _LOGGER.error(
-                        'Parsing error: field "start" must be a datetime or a timestamp'
-                    )
-                    return
+                return
 
-        # Parse end
         if self._end_template is not None:
-            _LOGGER.debug("Process end template: %s", self._end_template)
-            try:
-                end_rendered = self._end_template.async_render()
-            except (TemplateError, TypeError) as ex:
-                self.handle_template_exception(ex, "end")
-                return
-            if isinstance(end_rendered, str):
-                end = dt_util.parse_datetime(end_rendered)
+            end = self._get_period_bound(self._end_template, CONF_END, now)
             if end is None:
-                try:
-                    end = dt_util.as_local(
-                        dt_util.utc_from_timestamp(math.floor(float(end_rendered)))
-                    )
-                except ValueError:
-                    _LOGGER.error(
-                        'Parsing error: field "end" must be a datetime or a timestamp'
-                    )
-                    return
+                return
 
         # Calculate start or end using the duration
         if self._duration is not None:
@@ -414,41 +1109,462 @@ class AverageSensor(SensorEntity):
         self.start = start.replace(microsecond=0).isoformat()
         self.end = end.replace(microsecond=0).isoformat()
 
-    def _init_mode(self, state: State):
-        """Initialize sensor mode."""
-        if self._temperature_mode is not None:
+    @staticmethod
+    def _extend_window(
+        window: SourceWindow,
+        extractor: ValueExtractor,
+        rows: HistoryRows,
+        attributes: Mapping[str, Any],
+    ) -> SourceWindow:
+        """Add historical states of source to its window and return the window.
+
+        Given attributes are used if historical ones were not fetched.
+        """
+        window.extend(
+            rows.timestamps,
+            *extractor.parse_many(rows.states, attributes, rows.attributes),
+        )
+        return window
+
+    async def _async_extend_window(
+        self,
+        window: SourceWindow,
+        entity_id: str,
+        rows: HistoryRows,
+        attributes: Mapping[str, Any],
+    ) -> SourceWindow:
+        """Add historical states of source to its window and return the window.
+
+        Large batches of states are processed in executor not to block the
+        event loop. A copy of the window is extended there, so the event loop
+        never sees a half-extended window; the copy should replace the window.
+        Value extractor is prepared on the event loop.
+        """
+        extractor = self._get_extractor(entity_id, attributes)
+        threshold = self.hass.data.get(
+            DATA_EXECUTOR_THRESHOLD, DEFAULT_EXECUTOR_THRESHOLD
+        )
+        if len(rows.states) < threshold:
+            return self._extend_window(window, extractor, rows, attributes)
+
+        _LOGGER.debug(
+            "Process %d historical states of %s in executor",
+            len(rows.states),
+            entity_id,
+        )
+        return await self.hass.async_add_executor_job(
+            self._extend_window, window.copy(), extractor, rows, attributes
+        )
+
+    async def _async_update_statistics(
+        self, start_ts: float, end_ts: float
+    ) -> dict[str, float]:
+        """Fetch long-term statistics of completed hours of the period.
+
+        Return times from which raw states are needed for sources that have
+        statistics.
+        """
+        first_hour_ts = ceil_hour(start_ts)
+        last_hour_ts = floor_hour(end_ts)
+        if last_hour_ts <= first_hour_ts:
+            return {}
+
+        states = {}
+        for entity_id in self.sources:
+            state = self.hass.states.get(entity_id)  # type: State
+            if state is not None and state.attributes.get(ATTR_STATE_CLASS):
+                self._init_mode(state)
+                states[entity_id] = state
+        if not states:
+            return {}
+
+        units = (
+            {"temperature": self.hass.config.units.temperature_unit}
+            if self._temperature_mode
+            else None
+        )
+        await self._statistics.async_update(
+            self.hass, states, first_hour_ts, last_hour_ts, units
+        )
+
+        tail_starts = {}
+        for entity_id in states:
+            stats_end_ts = self._statistics.end_ts(entity_id)
+            if stats_end_ts is not None and stats_end_ts > first_hour_ts:
+                tail_starts[entity_id] = min(stats_end_ts, last_hour_ts)
+
+        # Raw states of the first partial hour are fetched once an hour
+        if self._head_hour_ts != first_hour_ts:
+            self._head_windows.clear()
+            self._head_hour_ts = first_hour_ts
+        heads = [
+            entity_id
+            for entity_id in tail_starts
+            if start_ts < first_hour_ts and entity_id not in self._head_windows
+        ]
+        if heads:
+            history_list = await async_get_history_cache(self.hass).async_get_uncached(
+                heads,
+                dt_util.utc_from_timestamp(first_hour_ts - HOUR),
+                dt_util.utc_from_timestamp(first_hour_ts),
+            )
+            for entity_id, rows in history_list.items():
+                self._update_stats.add_rows(entity_id, len(rows.states))
+                self._head_windows[entity_id] = await self._async_extend_window(
+                    self._new_window(),
+                    entity_id,
+                    rows,
+                    states[entity_id].attributes,
+                )
+
+        return tail_starts
+
+    def _hybrid_average(
+        self,
+        entity_id: str,
+        window: SourceWindow,
+        start_ts: float,
+        tail_start_ts: float,
+        end_ts: float,
+    ) -> float | None:
+        """Return average value of source over the period.
+
+        Completed hours are taken from long-term statistics, and raw states
+        are used for the partial hours at the edges of the period only.
+        """
+        first_hour_ts = ceil_hour(start_ts)
+        parts = [
+            window.integrate(tail_start_ts, end_ts),
+            self._statistics.integrate(entity_id, first_hour_ts, tail_start_ts),
+        ]
+        self._count_values(*window.extremes(tail_start_ts, end_ts))
+        # Hourly statistics have no count of values
+        _, min_value, max_value = self._statistics.extremes(
+            entity_id, first_hour_ts, tail_start_ts
+        )
+        self._count_values(0, min_value, max_value)
+        if (head := self._head_windows.get(entity_id)) is not None:
+            parts.append(head.integrate(start_ts, first_hour_ts))
+            self._count_values(*head.extremes(start_ts, first_hour_ts))
+
+        integral = sum(part[0] for part in parts)
+        elapsed = sum(part[1] for part in parts)
+        self.approximate = True
+        if elapsed:
+            return integral / elapsed
+        return window.average(tail_start_ts, end_ts)
+
+    async def _async_update_windows(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        window_starts: Mapping[str, float],
+        exclude: Container[str] = (),
+    ) -> None:
+        """Fetch new historical states of sources to their windows.
+
+        Empty windows are filled from the period start or from the time given
+        in `window_starts` for the source. Sources in `exclude` are skipped.
+        """
+        states = {}
+        starts = {}
+        for entity_id in self.sources:
+            state = self.hass.states.get(entity_id)  # type: State
+            if state is None or entity_id in exclude:
+                continue
+
+            self._init_mode(state)
+            states[entity_id] = state
+
+            # Fetch only states that are newer than the last one already known
+            window = self._windows.setdefault(entity_id, self._new_window())
+            if window.last_ts is not None:
+                starts[entity_id] = dt_util.utc_from_timestamp(window.last_ts)
+            elif entity_id in window_starts:
+                starts[entity_id] = dt_util.utc_from_timestamp(window_starts[entity_id])
+            else:
+                starts[entity_id] = start
+
+        if not starts:
             return
 
-        domain = split_entity_id(state.entity_id)[0]
-        self._attr_device_class = state.attributes.get(ATTR_DEVICE_CLASS)
-        self._attr_native_unit_of_measurement = state.attributes.get(
-            ATTR_UNIT_OF_MEASUREMENT
+        # Attributes are needed only to get temperature of some entities
+        attributes = (
+            {
+                entity_id
+                for entity_id in starts
+                if split_entity_id(entity_id)[0] in ATTRIBUTES_TEMPERATURE_DOMAINS
+            }
+            if self._temperature_mode
+            else ()
         )
-        self._temperature_mode = (
-            self._attr_device_class == SensorDeviceClass.TEMPERATURE
-            or domain in (WEATHER_DOMAIN, CLIMATE_DOMAIN, WATER_HEATER_DOMAIN)
-            or self._attr_native_unit_of_measurement in TEMPERATURE_UNITS
+
+        # Initial fills of windows with long histories are streamed in chunks
+        # bypassing the cache; windows that are already filled get only new
+        # states from the cache
+        history_cache = async_get_history_cache(self.hass)
+        stream_before_ts = end.timestamp() - STREAM_MIN_PERIOD.total_seconds()
+        streamed = {
+            entity_id: starts.pop(entity_id)
+            for entity_id in list(starts)
+            if self._windows[entity_id].last_ts is None
+            and starts[entity_id].timestamp() < stream_before_ts
+            and entity_id not in attributes
+        }
+
+        async def async_stream(entity_id: str, fetch_start: datetime.datetime) -> None:
+            """Fill window of source with its states read in chunks."""
+            _LOGGER.debug("Stream historical states of %s", entity_id)
+            attributes = states[entity_id].attributes
+            window, rows = await history_cache.async_run_query(
+                self._stream_window,
+                self.hass,
+                self._windows[entity_id].copy(),
+                self._get_extractor(entity_id, attributes),
+                fetch_start.timestamp(),
+                end.timestamp(),
+                attributes,
+            )
+            self._update_stats.add_rows(entity_id, rows)
+            self._windows[entity_id] = window
+
+        await asyncio.gather(
+            *(
+                async_stream(entity_id, fetch_start)
+                for entity_id, fetch_start in streamed.items()
+            )
+        )
+        if not starts:
+            return
+
+        history_list = await history_cache.async_get_many(
+            starts, end, attributes=attributes
         )
-        if self._temperature_mode:
-            _LOGGER.debug("%s is a temperature entity.", state.entity_id)
-            self._attr_device_class = SensorDeviceClass.TEMPERATURE
-            self._attr_native_unit_of_measurement = (
-                self.hass.config.units.temperature_unit
+        for entity_id, rows in history_list.items():
+            self._update_stats.add_rows(entity_id, len(rows.states))
+            _LOGGER.debug("Historical states of %s: %s", entity_id, rows.states)
+            self._windows[entity_id] = await self._async_extend_window(
+                self._windows[entity_id], entity_id, rows, states[entity_id].attributes
             )
-        else:
-            _LOGGER.debug("%s is NOT a temperature entity.", state.entity_id)
-            self._attr_icon = state.attributes.get(ATTR_ICON)
 
-    async def _async_update_state(
+    @staticmethod
+    def _stream_window(
+        hass: HomeAssistant,
+        window: SourceWindow | BucketWindow,
+        extractor: ValueExtractor,
+        start_ts: float,
+        end_ts: float,
+        attributes: Mapping[str, Any],
+    ) -> tuple[SourceWindow | BucketWindow, int]:
+        """Add historical states of source to its window reading them in chunks.
+
+        It runs in the recorder executor. Samples of completed buckets are
+        folded after every chunk, so with buckets only one chunk of raw states
+        is kept in memory. Return the window and count of read states.
+        """
+        count = 0
+        for rows in iter_recorder_states(hass, extractor.entity_id, start_ts, end_ts):
+            count += len(rows.states)
+            AverageSensor._extend_window(window, extractor, rows, attributes)
+            if isinstance(window, BucketWindow):
+                window.fold(rows.timestamps[-1])
+        return window, count
+
+    async def _async_update_buckets(self, start_ts: float, end_ts: float) -> None:
+        """Fold samples of completed buckets and fetch raw states of head ones.
+
+        States are committed to the database with some delay, so buckets that
+        may still get states are not folded yet.
+
+        The period start is generally inside a bucket, so raw states of that
+        bucket are needed to compute its part in the period exactly. They are
+        fetched once per bucket.
+        """
+        fold_ts = end_ts - get_instance(self.hass).commit_interval
+        heads = {}
+        for entity_id, window in self._windows.items():
+            window.fold(fold_ts)
+            if (head_end_ts := window.head_needed(start_ts)) is not None:
+                heads.setdefault(head_end_ts, []).append(entity_id)
+
+        for head_end_ts, entity_ids in heads.items():
+            history_list = await async_get_history_cache(self.hass).async_get_uncached(
+                entity_ids,
+                dt_util.utc_from_timestamp(head_end_ts - self._bucket_size),
+                dt_util.utc_from_timestamp(head_end_ts),
+            )
+            for entity_id in entity_ids:
+                head = SourceWindow(self._channels)
+                state = self.hass.states.get(entity_id)  # type: State
+                if (rows := history_list.get(entity_id)) is not None and state:
+                    self._update_stats.add_rows(entity_id, len(rows.states))
+                    head = await self._async_extend_window(
+                        head, entity_id, rows, state.attributes
+                    )
+                self._windows[entity_id].set_head(head_end_ts, head)
+
+    async def _async_update_aggregates(
+        self, start_ts: float, end_ts: float
+    ) -> dict[str, AggregateWindow]:
+        """Compute aggregates of sources over the period in the database.
+
+        Temperature of some domains is kept in attributes that the database
+        cannot aggregate; such sources are processed in Python as usual.
+        """
+        extractors = {}
+        for entity_id in self.sources:
+            state = self.hass.states.get(entity_id)  # type: State
+            if (
+                state is None
+                or split_entity_id(entity_id)[0] in ATTRIBUTES_TEMPERATURE_DOMAINS
+            ):
+                continue
+
+            self._init_mode(state)
+            extractors[entity_id] = self._get_extractor(entity_id, state.attributes)
+
+        if not extractors:
+            return {}
+
+        aggregates = await async_get_aggregates(
+            self.hass, extractors, start_ts, end_ts, self._undef
+        )
+        return {
+            entity_id: aggregate.converted(extractors[entity_id].convert)
+            for entity_id, aggregate in aggregates.items()
+        }
+
+    def _init_mode(self, state: State):
+        """Initialize sensor mode and value extractor of the source."""
+        if self._temperature_mode is None:
+            self._attr_device_class = state.attributes.get(ATTR_DEVICE_CLASS)
+            self._attr_native_unit_of_measurement = state.attributes.get(
+                ATTR_UNIT_OF_MEASUREMENT
+            )
+            self._temperature_mode = is_temperature_entity(
+                state.entity_id, state.attributes
+            )
+            if self._temperature_mode:
+                _LOGGER.debug("%s is a temperature entity.", state.entity_id)
+                self._attr_device_class = SensorDeviceClass.TEMPERATURE
+                self._attr_native_unit_of_measurement = (
+                    self.hass.config.units.temperature_unit
+                )
+            else:
+                _LOGGER.debug("%s is NOT a temperature entity.", state.entity_id)
+                self._attr_icon = state.attributes.get(ATTR_ICON)
+
+        self._get_extractor(state.entity_id, state.attributes)
+
+    def _new_window(self) -> SourceWindow | BucketWindow:
+        """Return empty window of source samples."""
+        if self._bucket_size:
+            return BucketWindow(self._bucket_size, self._channels)
+        return SourceWindow(self._channels, bool(self._percentiles))
+
+    def _window_from_dict(self, data: Mapping[str, Any]) -> SourceWindow | BucketWindow:
+        """Return window of source samples unpacked from dict."""
+        if self._bucket_size:
+            return BucketWindow.from_dict(data, self._bucket_size, self._channels)
+        return SourceWindow.from_dict(data, self._channels, bool(self._percentiles))
+
+    def _add_statistics(
+        self,
+        sums: defaultdict[str, float],
+        sketch: QuantileSketch,
+        window: SourceWindow,
+        start_ts: float,
+        end_ts: float,
+    ) -> None:
+        """Add additional statistics of source over the period to the sums."""
+        integral, elapsed = window.integrate(start_ts, end_ts)
+        if not elapsed:
+            return
+
+        if self._percentiles:
+            # Every source has the same weight like in the average value
+            sketch.merge(window.sketch(start_ts, end_ts), 1 / elapsed)
+
+        sums["sources"] += 1
+        sums["mean"] += integral / elapsed
+        sums[ATTR_INTEGRAL] += integral
+        if "square" in self._channels:
+            sums["square"] += (
+                window.integrate_channel("square", start_ts, end_ts) / elapsed
+            )
+        for name in (ATTR_TIME_ABOVE, ATTR_TIME_BELOW):
+            if name in self._channels:
+                sums[name] += window.integrate_channel(name, start_ts, end_ts)
+
+    def _apply_statistics(
+        self, sums: Mapping[str, float], sketch: QuantileSketch
+    ) -> None:
+        """Update additional statistics attributes from sums of sources ones.
+
+        Statistics of sources are averaged the same way as their values.
+        """
+        self.variance = self.standard_deviation = self.integral = None
+        self.time_above = self.time_below = None
+        self.percentiles = None
+        sources = sums.get("sources")
+        if not sources:
+            return
+
+        if self._percentiles:
+            self.percentiles = {
+                f"{percentile:g}": round(
+                    sketch.quantile(percentile / 100), self._precision
+                )
+                for percentile in self._percentiles
+            }
+
+        statistics = self._extra_statistics
+        if ATTR_VARIANCE in statistics or ATTR_STANDARD_DEVIATION in statistics:
+            mean = sums["mean"] / sources
+            variance = max(sums["square"] / sources - mean * mean, 0.0)
+            if ATTR_VARIANCE in statistics:
+                self.variance = round(variance, self._precision)
+            if ATTR_STANDARD_DEVIATION in statistics:
+                self.standard_deviation = round(math.sqrt(variance), self._precision)
+        if ATTR_INTEGRAL in statistics:
+            # Integral is in units of the sensor multiplied by hours
+            self.integral = round(sums[ATTR_INTEGRAL] / sources / HOUR, self._precision)
+        if ATTR_TIME_ABOVE in statistics:
+            self.time_above = round(sums[ATTR_TIME_ABOVE] / sources)
+        if ATTR_TIME_BELOW in statistics:
+            self.time_below = round(sums[ATTR_TIME_BELOW] / sources)
+
+    @property
+    def update_stats(self) -> UpdateStats:
+        """Return performance counters of the sensor updates."""
+        return self._update_stats
+
+    async def _async_update_state(self, push: bool = False):
+        """Update the sensor state.
+
+        Updates wait for each other, so an update never sees windows that are
+        being changed by another one.
+        """
+        async with self._update_lock:
+            if push:
+                self._push_update_queued = False
+            self._update_stats.begin()
+            try:
+                await self._async_compute_state()
+            finally:
+                self._update_stats.end()
+
+    async def _async_compute_state(
         self,
     ):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
-        """Update the sensor state."""
+        """Compute the sensor state."""
         _LOGGER.debug('Updating sensor "%s"', self.name)
         start = end = start_ts = end_ts = None
         p_period = self._period
 
         # Parse templates
-        await self._async_update_period()
+        with self._update_stats.measure(STAGE_RENDER):
+            await self._async_update_period()
 
         if self._period is not None:
             now = datetime.datetime.now()
@@ -477,13 +1593,116 @@ class AverageSensor(SensorEntity):
             # If period has not changed and current time after the period end..
             if start_ts == p_start_ts and end_ts == p_end_ts and end_ts <= now_ts:
                 # Don't compute anything as the value cannot have changed
+                self._update_stats.skip()
                 return
 
+            # Drop collected samples if the period is not just slid forward
+            if self._window_period is None or not (
+                self._window_period[0] <= start_ts <= self._window_period[1] <= end_ts
+            ):
+                self._windows.clear()
+                self._windows_live = False
+                self._statistics.clear()
+                self._head_windows.clear()
+            self._window_period = start_ts, end_ts
+
+            tail_starts = {}
+            aggregates = {}
+            if self._database_backend:
+                with self._update_stats.measure(STAGE_FETCH):
+                    aggregates = await self._async_update_aggregates(start_ts, end_ts)
+
+            if self._use_statistics:
+                with self._update_stats.measure(STAGE_FETCH):
+                    tail_starts = await self._async_update_statistics(start_ts, end_ts)
+
+            if not self._windows_live or any(
+                entity_id not in self._windows
+                and entity_id not in aggregates
+                and self.hass.states.get(entity_id) is not None
+                for entity_id in self.sources
+            ):
+                if self._push_updates:
+                    self._windows_live = False
+                    if self._pending_samples is None:
+                        self._pending_samples = []
+                with self._update_stats.measure(STAGE_FETCH):
+                    await self._async_update_windows(
+                        start, end, tail_starts, aggregates
+                    )
+                if self._push_updates:
+                    pending_samples, self._pending_samples = self._pending_samples, None
+                    self._windows_live = True
+                    for sample in pending_samples or ():
+                        self._add_sample(*sample)
+
+            if self._bucket_size:
+                with self._update_stats.measure(STAGE_FETCH):
+                    await self._async_update_buckets(start_ts, min(end_ts, now_ts))
+
+        else:
+            # Compute current values of all sources from scratch
+            self._current.clear()
+            for entity_id in self.sources:
+                state = self.hass.states.get(entity_id)  # type: State
+                if state is None:
+                    _LOGGER.error('Unable to find an entity "%s"', entity_id)
+                self._update_current_value(entity_id, state)
+
+            self._apply_current_values()
+            self._async_save_decaying()
+            _LOGGER.debug(
+                "Total average state: %s %s",
+                self._attr_native_value,
+                self._attr_native_unit_of_measurement,
+            )
+            return
+
+        # Windows of followers are within the sensor one, so samples are
+        # dropped only before its start
+        for entity_id, window in self._windows.items():
+            window.evict(tail_starts.get(entity_id, start_ts))
+
+        self._compute_values(
+            aggregates, tail_starts, start_ts, end_ts, now_ts, actual_end_ts
+        )
+
+        if self._store is not None:
+            self._store.async_delay_save(
+                self._windows_to_store, STORAGE_SAVE_DELAY.total_seconds()
+            )
+
+        _LOGGER.debug(
+            "Total average state: %s %s",
+            self._attr_native_value,
+            self._attr_native_unit_of_measurement,
+        )
+
+        for follower in self._followers:
+            await follower._async_compute_follower(self._windows, now_ts)
+
+    # pylint: disable-next=too-many-arguments,too-many-locals
+    def _compute_values(
+        self,
+        aggregates: Mapping[str, AggregateWindow],
+        tail_starts: Mapping[str, float],
+        start_ts: float,
+        end_ts: float,
+        now_ts: float,
+        actual_end_ts: float,
+        windows: Mapping[str, SourceWindow | BucketWindow] | None = None,
+    ) -> None:
+        """Compute the sensor values over the period from windows of sources."""
+        if windows is None:
+            windows = self._windows
         self.available_sources = 0
         values = []
         self.count = 0
         self.min_value = self.max_value = None
+        self.approximate = None
         trending_last_state = 0
+        sums: defaultdict[str, float] = defaultdict(float)
+        sketch = QuantileSketch()
 
         # pylint: disable=too-many-nested-blocks
         for entity_id in self.sources:
@@ -497,76 +1716,40 @@ class AverageSensor(SensorEntity):
 
             self._init_mode(state)
 
-            value = 0
-            elapsed = 0
+            window = aggregates.get(entity_id)
+            if window is None:
+                window = windows[entity_id]
+            tail_start_ts = tail_starts.get(entity_id, start_ts)
 
-            if self._period is None:
-                # Get current state
+            if not window:
                 value = self._get_state_value(state)
-                _LOGGER.debug("Current state: %s", value)
-
-            else:
-                # Get history between start and now
-                history_list = await get_instance(self.hass).async_add_executor_job(
-                    history.state_changes_during_period,
-                    self.hass,
-                    start,
-                    end,
-                    str(entity_id),
+                _LOGGER.warning(
+                    'Historical data not found for entity "%s". '
+                    "Current state used: %s",
+                    entity_id,
+                    value,
                 )
-
-                if (
-                    entity_id not in history_list
-                    or history_list[entity_id] is None
-                    or len(history_list[entity_id]) == 0
-                ):
-                    value = self._get_state_value(state)
-                    _LOGGER.warning(
-                        'Historical data not found for entity "%s". '
-                        "Current state used: %s",
-                        entity_id,
-                        value,
+            else:
+                if entity_id in tail_starts:
+                    value = self._hybrid_average(
+                        entity_id, window, start_ts, tail_start_ts, end_ts
                     )
                 else:
-                    # Get the first state
-                    item = history_list[entity_id][0]
-                    _LOGGER.debug("Initial historical state: %s", item)
-                    last_state = None
-                    last_time = start_ts
-                    if item is not None and self._has_state(item.state):
-                        last_state = self._get_state_value(item)
-
-                    # Get the other states
-                    for item in history_list.get(entity_id):
-                        _LOGGER.debug("Historical state: %s", item)
-                        current_state = self._get_state_value(item)
-                        current_time = item.last_changed.timestamp()
-
-                        if last_state is not None:
-                            last_elapsed = current_time - last_time
-                            value += last_state * last_elapsed
-                            elapsed += last_elapsed
-
-                        last_state = current_state
-                        last_time = current_time
-
-                    # Count time elapsed between last history state and now
-                    if last_state is None:
-                        value = None
-                    else:
-                        last_elapsed = end_ts - last_time
-                        value += last_state * last_elapsed
-                        elapsed += last_elapsed
-                        trending_last_state = last_state
-                        if elapsed:
-                            value /= elapsed
-
-                    _LOGGER.debug("Historical average state: %s", value)
+                    value = window.average(start_ts, end_ts)
+                    self._count_values(*window.extremes(start_ts, end_ts))
+                    if self._extra_statistics or self._percentiles:
+                        self._add_statistics(sums, sketch, window, start_ts, end_ts)
+                if value is not None:
+                    trending_last_state = window.last_value
+
+                _LOGGER.debug("Historical average state: %s", value)
 
             if isinstance(value, numbers.Number):
                 values.append(value)
                 self.available_sources += 1
 
+        self._apply_statistics(sums, sketch)
+
         if values:
             self._attr_native_value = round(sum(values) / len(values), self._precision)
             if self._precision < 1:
@@ -587,8 +1770,18 @@ class AverageSensor(SensorEntity):
 
         _LOGGER.debug("Current trend: %s", self.trending_towards)
 
-        _LOGGER.debug(
-            "Total average state: %s %s",
-            self._attr_native_value,
-            self._attr_native_unit_of_measurement,
+    async def _async_compute_follower(
+        self, windows: Mapping[str, SourceWindow], now_ts: float
+    ) -> None:
+        """Compute the sensor state from windows of the leader sensor."""
+        await self._async_update_period()
+        if self._period is None:
+            return
+
+        start_ts, end_ts, actual_end_ts = (
+            math.floor(dt_util.as_timestamp(value))
+            for value in (*self._period, self._actual_end)
         )
+        self._compute_values({}, {}, start_ts, end_ts, now_ts, actual_end_ts, windows)
+        if self.hass is not None and self.entity_id is not None:
+            self.async_write_ha_state()
@@ -0,0 +1,142 @@
+#  Copyright (c) 2019-2022, Andrey "Limych" Khrolenok <andrey@khrolenok.ru>
+#  Creative Commons BY-NC-SA 4.0 International Public License
+#  (see LICENSE.md or https://creativecommons.org/licenses/by-nc-sa/4.0/)
+
+"""The Average Sensor.
+
+For more details about this sensor, please refer to the documentation at
+https://github.com/Limych/ha-average/
+"""
+from __future__ import annotations
+
+import math
+
+# Default relative accuracy of quantiles
+RELATIVE_ACCURACY = 0.01
+# Default maximal count of bins of values of one sign
+MAX_BINS = 2048
+
+# Values closer to zero are counted as zero
+MIN_VALUE = 1e-9
+# Bins with less weight are dropped as rounding errors of removals
+MIN_WEIGHT = 1e-6
+
+
+class QuantileSketch:
+    """Weighted quantile sketch with relative accuracy guarantee.
+
+    Values are counted in bins with logarithmically growing bounds (like in
+    DDSketch), so every quantile is estimated within the relative accuracy of
+    its true value. Bins have weights (e.g. durations of values), so the sketch
+    gives time-weighted quantiles. Weights are additive: sketches are mergeable,
+    and values can be removed by adding them with negative weights, which is
+    needed to slide windows.
+
+    Memory is bounded by `max_bins` per sign of values. If there are more bins,
+    the ones closest to zero are collapsed, and the accuracy guarantee does not
+    hold for the lowest quantiles by absolute value anymore.
+    """
+
+    def __init__(
+        self, relative_accuracy: float = RELATIVE_ACCURACY, max_bins: int = MAX_BINS
+    ) -> None:
+        """Initialize the sketch."""
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Weights of bins of positive and negative values by their keys
+        self._positive: dict[int, float] = {}
+        self._negative: dict[int, float] = {}
+        # Keys of bins below which bins are collapsed
+        self._positive_min_key: int | None = None
+        self._negative_min_key: int | None = None
+        self._zero = 0.0
+        self.weight = 0.0
+
+    def copy(self) -> QuantileSketch:
+        """Return a copy of the sketch."""
+        sketch = QuantileSketch(self.relative_accuracy, self.max_bins)
+        sketch._positive = self._positive.copy()
+        sketch._negative = self._negative.copy()
+        sketch._positive_min_key = self._positive_min_key
+        sketch._negative_min_key = self._negative_min_key
+        sketch._zero = self._zero
+        sketch.weight = self.weight
+        return sketch
+
+    def add(self, value: float, weight: float = 1.0) -> None:
+        """Add value with given weight; negative weight removes the value."""
+        if not weight:
+            return
+
+        self.weight += weight
+        if -MIN_VALUE < value < MIN_VALUE:
+            self._zero += weight
+            return
+
+        positive = value > 0
+        key = math.ceil(math.log(abs(value)) / self._log_gamma)
+        self._add_bin(positive, key, weight)
+
+    def merge(self, other: QuantileSketch, scale: float = 1.0) -> None:
+        """Add all values of other sketch with weights multiplied by scale."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches have different accuracy")
+
+        self.weight += other.weight * scale
+        self._zero += other._zero * scale
+        for positive, bins in ((True, other._positive), (False, other._negative)):
+            for key, weight in bins.items():
+                self._add_bin(positive, key, weight * scale)
+
+    def quantile(self, q: float) -> float | None:
+        """Return estimation of q-quantile (0 <= q <= 1) of values."""
+        if self.weight < MIN_WEIGHT:
+            return None
+
+        rank = q * self.weight
+        cumulative = 0.0
+        value = None
+        for key in sorted(self._negative, reverse=True):
+            cumulative += self._negative[key]
+            value = -self._value(key)
+            if cumulative > rank:
+                return value
+        if self._zero >= MIN_WEIGHT:
+            cumulative += self._zero
+            value = 0.0
+            if cumulative > rank:
+                return value
+        for key in sorted(self._positive):
+            cumulative += self._positive[key]
+            value = self._value(key)
+            if cumulative > rank:
+                return value
+        return value
+
+    def _value(self, key: int) -> float:
+        """Return estimation of absolute values in bin."""
+        return 2 * self._gamma**key / (self._gamma + 1)
+
+    def _add_bin(self, positive: bool, key: int, weight: float) -> None:
+        """Add weight to bin collapsing bins if there are too many."""
+        bins = self._positive if positive else self._negative
+        min_key = self._positive_min_key if positive else self._negative_min_key
+        if min_key is not None and key < min_key:
+            key = min_key
+
+        weight += bins.get(key, 0.0)
+        if abs(weight) < MIN_WEIGHT:
+            bins.pop(key, None)
+            return
+        bins[key] = weight
+
+        if len(bins) > self.max_bins:
+            keys = sorted(bins)
+            min_key = keys[len(bins) - self.max_bins]
+            bins[min_key] += sum(bins.pop(key) for key in keys[: -self.max_bins])
+            if positive:
+                self._positive_min_key = min_key
+            else:
+                self._negative_min_key = min_key
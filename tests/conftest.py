@@ -42,3 +42,25 @@ def skip_notifications_fixture():
         "homeassistant.components.persistent_notification.async_dismiss"
     ):
         yield
+
+
+def pytest_addoption(parser):
+    """Add options to run benchmarks."""
+    group = parser.getgroup("average")
+    group.addoption("--perf", action="store_true", help="run benchmarks")
+    group.addoption("--perf-save", metavar="PATH", help="save benchmark results")
+    group.addoption(
+        "--perf-compare",
+        metavar="PATH",
+        help="fail benchmarks that regressed comparing to saved results",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip benchmarks unless they are requested."""
+    if config.getoption("--perf"):
+        return
+    skip_perf = pytest.mark.skip(reason="benchmarks run with --perf option only")
+    for item in items:
+        if "perf" in item.keywords:
+            item.add_marker(skip_perf)
@@ -0,0 +1,161 @@
+"""Synthetic recorder history for benchmarks."""
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+import random
+
+from homeassistant.components.sensor import SensorDeviceClass
+from homeassistant.const import (
+    ATTR_DEVICE_CLASS,
+    ATTR_UNIT_OF_MEASUREMENT,
+    COMPRESSED_STATE_ATTRIBUTES,
+    COMPRESSED_STATE_LAST_UPDATED,
+    COMPRESSED_STATE_STATE,
+    STATE_UNAVAILABLE,
+    UnitOfTemperature,
+)
+
+from custom_components.average.const import STREAM_CHUNK_SIZE
+from custom_components.average.history_cache import HistoryRows
+
+
+@dataclass(frozen=True)
+class HistoryProfile:
+    """Shape of synthetic history of source entities."""
+
+    sources: int
+    states: int  # Count of states of every source
+    interval: float  # Seconds between states
+    unavailable: float = 0.0  # Fraction of unavailable states
+    temperature: bool = False  # Mix Celsius and Fahrenheit sources
+    seed: int = 1
+
+    @property
+    def duration(self) -> float:
+        """Return time covered by the history."""
+        return self.states * self.interval
+
+
+class SyntheticRecorder:
+    """Stand-in for recorder history of generated source entities.
+
+    States of every source go back from `end_ts` with a fixed interval and
+    with random values. Rows returned by the recorder are counted.
+    """
+
+    def __init__(self, profile: HistoryProfile, end_ts: float) -> None:
+        """Generate history."""
+        self.profile = profile
+        self.rows_scanned = 0
+        self.queries = 0
+        self.entity_ids = [f"sensor.synthetic_{i}" for i in range(profile.sources)]
+        self.attributes = {}
+        self.history = {}
+
+        rnd = random.Random(profile.seed)
+        start_ts = end_ts - profile.duration
+        for i, entity_id in enumerate(self.entity_ids):
+            attributes = {}
+            if profile.temperature:
+                attributes = {
+                    ATTR_DEVICE_CLASS: SensorDeviceClass.TEMPERATURE,
+                    ATTR_UNIT_OF_MEASUREMENT: (
+                        UnitOfTemperature.FAHRENHEIT
+                        if i % 2
+                        else UnitOfTemperature.CELSIUS
+                    ),
+                }
+            self.attributes[entity_id] = attributes
+
+            rows = []
+            for j in range(profile.states):
+                if rnd.random() < profile.unavailable:
+                    state = STATE_UNAVAILABLE
+                else:
+                    state = str(round(rnd.uniform(-20, 40), 2))
+                rows.append((start_ts + j * profile.interval, state))
+            self.history[entity_id] = rows
+
+    def current_states(self) -> dict[str, tuple[str, dict]]:
+        """Return the last state and attributes of every source."""
+        return {
+            entity_id: (rows[-1][1], self.attributes[entity_id])
+            for entity_id, rows in self.history.items()
+        }
+
+    def get_significant_states(
+        self,
+        hass,
+        start_time,
+        end_time=None,
+        entity_ids=None,
+        filters=None,
+        include_start_time_state=True,
+        significant_changes_only=True,
+        minimal_response=False,
+        no_attributes=False,
+        compressed_state_format=False,
+    ):
+        """Return history the way the recorder does."""
+        assert compressed_state_format
+        self.queries += 1
+        start_ts = start_time.timestamp()
+        end_ts = end_time.timestamp()
+        result = {}
+        for entity_id in entity_ids:
+            attributes = self.attributes.get(entity_id, {})
+            rows = []
+            for ts, state in self.history.get(entity_id, ()):
+                if ts <= start_ts:
+                    if include_start_time_state:
+                        rows = [(start_ts, state)]
+                elif ts <= end_ts:
+                    rows.append((ts, state))
+                else:
+                    break
+
+            result[entity_id] = [
+                {COMPRESSED_STATE_STATE: state, COMPRESSED_STATE_LAST_UPDATED: ts}
+                | ({} if no_attributes else {COMPRESSED_STATE_ATTRIBUTES: attributes})
+                for ts, state in rows
+            ]
+            self.rows_scanned += len(rows)
+        return result
+
+    def iter_states(
+        self,
+        hass,
+        entity_id: str,
+        start_ts: float,
+        end_ts: float,
+        chunk_size: int = STREAM_CHUNK_SIZE,
+    ) -> Iterator[HistoryRows]:
+        """Yield history in chunks the way the recorder reader does."""
+        rows = []
+        for ts, state in self.history.get(entity_id, ()):
+            if ts < start_ts:
+                # Only the state in effect at the start is kept
+                rows = [(ts, state)]
+            elif start_ts < ts <= end_ts:
+                rows.append((ts, state))
+            elif ts > end_ts:
+                break
+
+        for index in range(0, len(rows), chunk_size):
+            chunk = rows[index : index + chunk_size]
+            self.queries += 1
+            self.rows_scanned += len(chunk)
+            yield HistoryRows(
+                array("d", [ts for ts, _ in chunk]), [state for _, state in chunk], None
+            )
+
+    def add_states(self, count: int, end_ts: float) -> None:
+        """Add new states of every source up to the given time."""
+        rnd = random.Random(self.profile.seed + count)
+        for rows in self.history.values():
+            last_ts = rows[-1][0]
+            step = (end_ts - last_ts) / count
+            for j in range(1, count + 1):
+                rows.append((last_ts + j * step, str(round(rnd.uniform(-20, 40), 2))))
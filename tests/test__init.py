@@ -4,7 +4,16 @@ from __future__ import annotations
 
 from unittest.mock import patch
 
-from custom_components.average.const import DOMAIN
+import pytest
+from voluptuous import Invalid
+
+from custom_components.average import CONFIG_SCHEMA
+from custom_components.average.const import (
+    CONF_LIMIT,
+    CONF_MAX_CONCURRENT_QUERIES,
+    DOMAIN,
+    SERVICE_GET_PERFORMANCE,
+)
 from homeassistant import config as hass_config
 from homeassistant.components.sensor import DOMAIN as SENSOR_DOMAIN
 from homeassistant.const import SERVICE_RELOAD
@@ -14,6 +23,14 @@ from . import get_fixture_path
 from .const import MOCK_CONFIG, TEST_NAME
 
 
+async def test_config_schema():
+    """Verify concurrent queries are limited by at least one."""
+    conf = CONFIG_SCHEMA({DOMAIN: {CONF_MAX_CONCURRENT_QUERIES: "2"}})
+    assert conf[DOMAIN][CONF_MAX_CONCURRENT_QUERIES] == 2
+    with pytest.raises(Invalid):
+        CONFIG_SCHEMA({DOMAIN: {CONF_MAX_CONCURRENT_QUERIES: 0}})
+
+
 async def test_reload(hass):
     """Verify we can reload."""
     assert await async_setup_component(hass, SENSOR_DOMAIN, MOCK_CONFIG)
@@ -52,3 +69,31 @@ async def test_reload_and_remove_all(hass):
         await hass.async_block_till_done()
 
     assert hass.states.get(f"{SENSOR_DOMAIN}.{TEST_NAME}") is None
+
+
+async def test_get_performance(hass):
+    """Verify we can get performance counters of sensors."""
+    assert await async_setup_component(hass, SENSOR_DOMAIN, MOCK_CONFIG)
+    await hass.async_block_till_done()
+    await hass.async_start()
+    await hass.async_block_till_done()
+
+    response = await hass.services.async_call(
+        DOMAIN, SERVICE_GET_PERFORMANCE, {}, blocking=True, return_response=True
+    )
+
+    assert len(response["sensors"]) == 1
+    sensor = response["sensors"][0]
+    assert sensor["entity_id"] == f"{SENSOR_DOMAIN}.{TEST_NAME}"
+    assert "mean_duration" in sensor
+    assert "last_update" in sensor
+
+    # At least one sensor is returned
+    with pytest.raises(Invalid):
+        await hass.services.async_call(
+            DOMAIN,
+            SERVICE_GET_PERFORMANCE,
+            {CONF_LIMIT: 0},
+            blocking=True,
+            return_response=True,
+        )
@@ -0,0 +1,177 @@
+"""The test for the average sensor offline backfill."""
+# pylint: disable=redefined-outer-name
+from __future__ import annotations
+
+from array import array
+import csv
+import json
+import random
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from custom_components.average.backfill import backfill_source, combine, main
+from custom_components.average.engine import SourceWindow
+from custom_components.average.extractor import ValueExtractor
+from custom_components.average.history_cache import HistoryRows
+
+HOUR = 3600
+
+
+@pytest.fixture()
+def database(tmp_path):
+    """Create SQLite file with tables of states like the recorder ones."""
+    path = tmp_path / "home-assistant_v2.db"
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "CREATE TABLE states_meta ("
+                "metadata_id INTEGER PRIMARY KEY, entity_id VARCHAR(255))"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE state_attributes ("
+                "attributes_id INTEGER PRIMARY KEY, shared_attrs TEXT)"
+            )
+        )
+        connection.execute(
+            text(
+                "CREATE TABLE states ("
+                "state_id INTEGER PRIMARY KEY, metadata_id INTEGER,"
+                " attributes_id INTEGER, state VARCHAR(255),"
+                " last_updated_ts FLOAT, last_changed_ts FLOAT)"
+            )
+        )
+        for entity_id, unit, states in (
+            ("sensor.celsius", "°C", [(0, "10"), (2 * HOUR, "20")]),
+            ("sensor.fahrenheit", "°F", [(0, "50"), (HOUR, "unknown")]),
+        ):
+            metadata_id = connection.execute(
+                text("INSERT INTO states_meta (entity_id) VALUES (:entity_id)"),
+                {"entity_id": entity_id},
+            ).lastrowid
+            attributes_id = connection.execute(
+                text("INSERT INTO state_attributes (shared_attrs) VALUES (:attrs)"),
+                {"attrs": json.dumps({"unit_of_measurement": unit})},
+            ).lastrowid
+            for ts, state in states:
+                connection.execute(
+                    text(
+                        "INSERT INTO states"
+                        " (metadata_id, attributes_id, state, last_updated_ts)"
+                        " VALUES (:metadata_id, :attributes_id, :state, :ts)"
+                    ),
+                    {
+                        "metadata_id": metadata_id,
+                        "attributes_id": attributes_id,
+                        "state": state,
+                        "ts": ts,
+                    },
+                )
+    engine.dispose()
+    return path
+
+
+async def test_backfill_source():
+    """Test states streamed in chunks give the same averages as one window."""
+    rnd = random.Random(42)
+    timestamps = sorted(rnd.choices(range(0, 10000), k=500))
+    states = [
+        rnd.choice([f"{rnd.uniform(-50, 50):.3f}", "unknown"]) for _ in timestamps
+    ]
+    extractor = ValueExtractor("sensor.test", {}, False, "")
+    # Chunks split states with equal timestamps
+    chunks = [
+        HistoryRows(array("d", timestamps[i : i + 7]), states[i : i + 7], None)
+        for i in range(0, len(timestamps), 7)
+    ]
+    points = list(range(0, 12000, 250))
+    results = backfill_source(chunks, extractor, points, 1000)
+
+    window = SourceWindow()
+    window.extend(timestamps, *zip(*(extractor.parse(state, {}) for state in states)))
+    assert len(results) == len(points)
+    for end_ts, (average, *extremes) in zip(points, results):
+        assert average == pytest.approx(window.average(end_ts - 1000, end_ts))
+        assert tuple(extremes) == window.extremes(end_ts - 1000, end_ts)
+
+    assert backfill_source([], extractor, points, 1000)[0] == (None, 0, None, None)
+
+
+async def test_combine():
+    """Test states of the sensor are combined from its sources."""
+    points = combine(
+        [0, 10],
+        [[(10.123, 2, 5.001, 15.004), (None, 0, None, None)], [(20, 1, 20, 20)] * 2],
+        1,
+    )
+    assert points[0][1:] == (15.1, 2, 3, 5.0, 20.0)
+    assert points[1][1:] == (20.0, 1, 1, 20.0, 20.0)
+    assert combine([0], [[(10.6, 1, 10.6, 10.6)]], 0)[0].state == 11
+
+
+async def test_main(database, tmp_path):
+    """Test states are computed from the recorder database."""
+    output = tmp_path / "average.csv"
+    main(
+        [
+            str(database),
+            "sensor.celsius",
+            "sensor.fahrenheit",
+            "--duration=1:00:00",
+            "--step=0:30:00",
+            "--start=1970-01-01T01:00:00",
+            "--end=1970-01-01T03:00:00",
+            f"--output={output}",
+            "--workers=2",
+        ]
+    )
+    with open(output, encoding="utf-8") as file:
+        rows = list(csv.DictReader(file))
+    assert [row["timestamp"] for row in rows] == [
+        "1970-01-01T01:00:00+00:00",
+        "1970-01-01T01:30:00+00:00",
+        "1970-01-01T02:00:00+00:00",
+        "1970-01-01T02:30:00+00:00",
+        "1970-01-01T03:00:00+00:00",
+    ]
+    # Fahrenheit is converted to the temperature unit of Home Assistant
+    assert [row["state"] for row in rows] == ["10.0", "10.0", "10.0", "15.0", "20.0"]
+    assert [row["available_sources"] for row in rows] == ["2", "2", "1", "1", "1"]
+
+    output = tmp_path / "statistics.json"
+    main(
+        [
+            str(database),
+            "sensor.celsius",
+            "--duration=2:00:00",
+            "--start=1970-01-01T03:00:00",
+            "--end=1970-01-01T04:00:00",
+            "--format=statistics",
+            "--statistic-id=sensor.average",
+            f"--output={output}",
+        ]
+    )
+    with open(output, encoding="utf-8") as file:
+        statistics = json.load(file)
+    assert statistics["metadata"]["statistic_id"] == "sensor.average"
+    assert statistics["metadata"]["unit_of_measurement"] == "°C"
+    assert [(row["start"], row["mean"]) for row in statistics["stats"]] == [
+        ("1970-01-01T02:00:00+00:00", 15.0),
+        ("1970-01-01T03:00:00+00:00", 20.0),
+    ]
+
+    # Temperature in attributes of states is not read
+    with pytest.raises(SystemExit):
+        main(
+            [
+                str(database),
+                "weather.test",
+                "--duration=1:00:00",
+                "--start=1970-01-01T01:00:00",
+                "--end=1970-01-01T02:00:00",
+                f"--output={output}",
+            ]
+        )
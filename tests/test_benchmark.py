@@ -0,0 +1,180 @@
+"""Benchmarks of the average sensor on synthetic recorder history.
+
+Benchmarks are skipped unless pytest is run with the `--perf` option. Results
+can be saved with `--perf-save=PATH` and compared to previously saved ones
+with `--perf-compare=PATH` to catch performance regressions.
+"""
+# pylint: disable=redefined-outer-name
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Callable, Coroutine
+from datetime import timedelta
+import json
+from pathlib import Path
+import time
+import tracemalloc
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from custom_components.average.const import DATA_HISTORY_CACHE, HISTORY_CACHE_TTL
+from custom_components.average.sensor import AverageSensor
+from homeassistant.core import HomeAssistant
+import homeassistant.util.dt as dt_util
+
+from .synthetic import HistoryProfile, SyntheticRecorder
+
+# Allowed slowdown comparing to saved results
+PERF_TOLERANCE = 1.5
+
+PROFILES = {
+    "few_sources": HistoryProfile(sources=3, states=1000, interval=60),
+    "many_sources": HistoryProfile(sources=50, states=1000, interval=60),
+    "chatty_sources": HistoryProfile(
+        sources=5, states=50000, interval=1, unavailable=0.01
+    ),
+    "temperature_mix": HistoryProfile(
+        sources=10, states=5000, interval=10, unavailable=0.05, temperature=True
+    ),
+    # Longer than STREAM_MIN_PERIOD, so the initial fill is streamed in chunks
+    "long_history": HistoryProfile(
+        sources=10, states=25000, interval=10, unavailable=0.01
+    ),
+}
+
+
+@pytest.fixture()
+def synthetic_recorder(hass: HomeAssistant, request):
+    """Mock recorder with synthetic history of the profile."""
+    recorder = SyntheticRecorder(PROFILES[request.param], time.time())
+    for entity_id, (state, attributes) in recorder.current_states().items():
+        hass.states.async_set(entity_id, state, attributes)
+
+    instance = MagicMock()
+    instance.commit_interval = 1
+    instance.async_add_executor_job = hass.async_add_executor_job
+    with patch(
+        "custom_components.average.history_cache.get_instance",
+        return_value=instance,
+    ), patch(
+        "custom_components.average.history_cache.history.get_significant_states",
+        recorder.get_significant_states,
+    ), patch(
+        "custom_components.average.sensor.iter_recorder_states",
+        recorder.iter_states,
+    ):
+        yield recorder
+
+
+def _make_sensor(hass: HomeAssistant, recorder: SyntheticRecorder) -> AverageSensor:
+    """Create sensor that averages all synthetic sources."""
+    hass.data.pop(DATA_HISTORY_CACHE, None)
+    entity = AverageSensor(
+        hass,
+        None,
+        "benchmark",
+        None,
+        None,
+        timedelta(seconds=recorder.profile.duration),
+        recorder.entity_ids,
+        2,
+        None,
+    )
+    entity.hass = hass
+    return entity
+
+
+async def _async_measure(
+    job: Callable[[], Coroutine[Any, Any, None]],
+) -> tuple[float, float]:
+    """Return duration of the job and the longest time it blocked event loop."""
+    done = False
+    max_blocking = 0.0
+
+    async def async_heartbeat() -> None:
+        nonlocal max_blocking
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            max_blocking = max(max_blocking, now - last)
+            last = now
+
+    heartbeat = asyncio.create_task(async_heartbeat())
+    start = time.perf_counter()
+    try:
+        await job()
+    finally:
+        duration = time.perf_counter() - start
+        done = True
+        await heartbeat
+    return duration, max_blocking
+
+
+@pytest.fixture(scope="session")
+def perf_results(request):
+    """Collect benchmark results and save them at the end of session."""
+    results = {}
+    yield results
+    if results and (path := request.config.getoption("--perf-save")):
+        Path(path).write_text(json.dumps(results, indent=2, sort_keys=True))
+
+
+def _check_regressions(request, name: str, metrics: dict[str, float]) -> None:
+    """Compare results with saved ones."""
+    if not (path := request.config.getoption("--perf-compare")):
+        return
+    baseline = json.loads(Path(path).read_text()).get(name)
+    if baseline is None:
+        return
+
+    assert metrics["rows_scanned"] <= baseline["rows_scanned"]
+    for metric in ("latency", "warm_latency", "loop_blocking", "peak_memory"):
+        assert (
+            metrics[metric] <= baseline[metric] * PERF_TOLERANCE
+        ), f"{metric} regressed: {metrics[metric]} > {baseline[metric]}"
+
+
+@pytest.mark.perf
+@pytest.mark.parametrize("synthetic_recorder", list(PROFILES), indirect=True)
+async def test_update_state(
+    hass: HomeAssistant, synthetic_recorder: SyntheticRecorder, perf_results, request
+):
+    """Measure update of sensor with a period."""
+    name = request.node.callspec.id
+    recorder = synthetic_recorder
+
+    # Initial update reads the whole period
+    entity = _make_sensor(hass, recorder)
+    latency, loop_blocking = await _async_measure(entity._async_update_state)
+    rows_scanned = recorder.rows_scanned
+    assert entity.native_value is not None
+
+    # Next update reads new states only
+    await asyncio.sleep(HISTORY_CACHE_TTL.total_seconds() + 1)
+    recorder.add_states(10, dt_util.utcnow().timestamp())
+    warm_latency, warm_loop_blocking = await _async_measure(
+        entity._async_update_state
+    )
+
+    # Memory is measured separately as tracing slows everything down
+    entity = _make_sensor(hass, recorder)
+    tracemalloc.start()
+    try:
+        await entity._async_update_state()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    metrics = {
+        "latency": latency,
+        "warm_latency": warm_latency,
+        "loop_blocking": max(loop_blocking, warm_loop_blocking),
+        "peak_memory": peak_memory,
+        "rows_scanned": rows_scanned,
+        "queries": recorder.queries,
+    }
+    perf_results[name] = metrics
+    _check_regressions(request, name, metrics)
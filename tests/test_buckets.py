@@ -0,0 +1,102 @@
+"""The test for the average sensor bucket windows."""
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from custom_components.average.buckets import BucketWindow
+from custom_components.average.engine import SourceWindow
+
+CHANNELS = {"square": lambda value: value * value}
+
+
+def _make_windows() -> tuple[SourceWindow, BucketWindow]:
+    """Create raw and bucket windows with the same random samples."""
+    rnd = random.Random(1)
+    source = SourceWindow(CHANNELS)
+    buckets = BucketWindow(60, CHANNELS)
+    ts = 1000.0
+    for _ in range(3000):
+        ts += rnd.uniform(0.1, 30)
+        value = None if rnd.random() < 0.05 else round(rnd.uniform(-20, 40), 2)
+        measured = value is not None
+        source.append(ts, value, measured)
+        buckets.append(ts, value, measured)
+    return source, buckets
+
+
+def _set_head(source: SourceWindow, buckets: BucketWindow, start_ts: float) -> None:
+    """Set raw samples of the head bucket from the raw window."""
+    if (head_end_ts := buckets.head_needed(start_ts)) is not None:
+        buckets.set_head(head_end_ts, source.slice(head_end_ts - 60, head_end_ts))
+
+
+async def test_fold():
+    """Test buckets give the same results as raw samples."""
+    source, buckets = _make_windows()
+    end_ts = source.last_ts + 10
+    buckets.fold(end_ts)
+
+    assert buckets.end_ts == buckets.floor(end_ts)
+    assert len(buckets) < len(source) / 2
+
+    for start_ts in (1000, 1234.5, 5000, 20000.25, end_ts - 100, end_ts - 5):
+        _set_head(source, buckets, start_ts)
+        integral, elapsed = buckets.integrate(start_ts, end_ts)
+        expected = source.integrate(start_ts, end_ts)
+        assert integral == pytest.approx(expected[0])
+        assert elapsed == pytest.approx(expected[1])
+        assert buckets.average(start_ts, end_ts) == pytest.approx(
+            source.average(start_ts, end_ts)
+        )
+        assert buckets.integrate_channel("square", start_ts, end_ts) == pytest.approx(
+            source.integrate_channel("square", start_ts, end_ts)
+        )
+        assert buckets.extremes(start_ts, end_ts) == source.extremes(start_ts, end_ts)
+
+    # Head bucket is needed for periods starting inside folded buckets only
+    assert buckets.head_needed(end_ts - 5) is None
+    assert buckets.head_needed(buckets.floor(5000)) is None
+    with pytest.raises(ValueError):
+        buckets.integrate(5010, end_ts)
+
+
+async def test_evict():
+    """Test sliding of bucket windows."""
+    source, buckets = _make_windows()
+    end_ts = source.last_ts + 10
+    buckets.fold(end_ts - 3000)
+
+    start_ts = 20000.25
+    buckets.evict(start_ts)
+    source.evict(start_ts)
+    _set_head(source, buckets, start_ts)
+    assert buckets.integrate(start_ts, end_ts) == pytest.approx(
+        source.integrate(start_ts, end_ts)
+    )
+    assert buckets.next_ts(start_ts) == source.next_ts(start_ts)
+    assert buckets.next_ts(end_ts - 10) is None
+
+    # More samples are folded later
+    buckets.fold(end_ts)
+    assert buckets.integrate(start_ts, end_ts) == pytest.approx(
+        source.integrate(start_ts, end_ts)
+    )
+
+
+async def test_serialization():
+    """Test packing of bucket windows."""
+    source, buckets = _make_windows()
+    end_ts = source.last_ts + 10
+    buckets.fold(end_ts)
+
+    restored = BucketWindow.from_dict(buckets.as_dict(), 60, CHANNELS)
+    assert len(restored) == len(buckets)
+    assert restored.integrate(4980, end_ts) == pytest.approx(
+        buckets.integrate(4980, end_ts)
+    )
+    assert restored.copy().extremes(4980, end_ts) == buckets.extremes(4980, end_ts)
+
+    with pytest.raises(ValueError):
+        BucketWindow.from_dict(buckets.as_dict(), 300, CHANNELS)
@@ -0,0 +1,145 @@
+"""The test for the average sensor aggregation in the database."""
+from __future__ import annotations
+
+import random
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from custom_components.average.database import (
+    AggregateWindow,
+    get_aggregates,
+    iter_states,
+)
+from custom_components.average.engine import SourceWindow
+from custom_components.average.extractor import ValueExtractor
+
+START_TS = 1000.0
+END_TS = 2000.0
+
+
+@pytest.fixture()
+def session():
+    """Create database with tables of states like the recorder ones."""
+    engine = create_engine("sqlite://")
+    with Session(engine) as session:
+        session.execute(
+            text(
+                "CREATE TABLE states_meta ("
+                "metadata_id INTEGER PRIMARY KEY, entity_id VARCHAR(255))"
+            )
+        )
+        session.execute(
+            text(
+                "CREATE TABLE states ("
+                "state_id INTEGER PRIMARY KEY, metadata_id INTEGER,"
+                " state VARCHAR(255), last_updated_ts FLOAT, last_changed_ts FLOAT)"
+            )
+        )
+        yield session
+
+
+def _add_states(session: Session, entity_id: str, states: list[tuple[float, str]]):
+    """Add states of the entity to the database."""
+    metadata_id = session.execute(
+        text("INSERT INTO states_meta (entity_id) VALUES (:entity_id)"),
+        {"entity_id": entity_id},
+    ).lastrowid
+    for ts, state in states:
+        session.execute(
+            text(
+                "INSERT INTO states (metadata_id, state, last_updated_ts)"
+                " VALUES (:metadata_id, :state, :ts)"
+            ),
+            {"metadata_id": metadata_id, "state": state, "ts": ts},
+        )
+
+
+def _python_window(entity_id: str, states, undef=None) -> SourceWindow:
+    """Return window of states parsed the usual way."""
+    extractor = ValueExtractor(entity_id, {}, False, "", undef)
+    window = SourceWindow()
+    for ts, state in states:
+        window.append(ts, *extractor.parse(state, {}))
+    return window
+
+
+@pytest.mark.parametrize("undef", [None, 0])
+async def test_aggregates(session, undef):
+    """Test aggregates computed by the database match the Python ones."""
+    rnd = random.Random(42)
+    entities = {}
+    for i in range(5):
+        timestamps = sorted(rnd.sample(range(0, 3000), 200))
+        entities[f"sensor.test_{i}"] = [
+            (
+                float(ts),
+                rnd.choice(
+                    [f"{rnd.uniform(-50, 50):.3f}", str(rnd.randint(0, 9))] * 4
+                    + ["unknown", "unavailable", "qwe", "1-2", "1.2.3", "1e", "+-"]
+                ),
+            )
+            for ts in timestamps
+        ]
+    for entity_id, states in entities.items():
+        _add_states(session, entity_id, states)
+
+    aggregates = get_aggregates(
+        session, [*entities, "sensor.absent"], START_TS, END_TS, undef
+    )
+    assert not aggregates["sensor.absent"]
+
+    for entity_id, states in entities.items():
+        window = _python_window(
+            entity_id, [row for row in states if row[0] <= END_TS], undef
+        )
+        window.evict(START_TS)
+        aggregate = aggregates[entity_id]
+
+        assert len(aggregate) == len(window)
+        assert aggregate.integrate(START_TS, END_TS) == pytest.approx(
+            window.integrate(START_TS, END_TS)
+        )
+        assert aggregate.average(START_TS, END_TS) == pytest.approx(
+            window.average(START_TS, END_TS)
+        )
+        assert aggregate.extremes(START_TS, END_TS) == window.extremes(START_TS, END_TS)
+        assert aggregate.last_value == window.last_value
+
+
+async def test_iter_states(session):
+    """Test states are read in chunks of fixed size."""
+    # Some states share timestamps at chunk boundaries
+    states = [(float(ts // 2), str(ts)) for ts in range(0, 100)]
+    _add_states(session, "sensor.test", states)
+
+    chunks = list(iter_states(session, "sensor.test", 10.5, 40, 7))
+    assert {len(chunk.states) for chunk in chunks[:-1]} == {7}
+    timestamps = [ts for chunk in chunks for ts in chunk.timestamps]
+    values = [state for chunk in chunks for state in chunk.states]
+    expected = [row for row in states if 10 <= row[0] <= 40][1:]
+    assert list(zip(timestamps, values)) == expected
+
+    # Chunks of the whole history
+    chunks = list(iter_states(session, "sensor.test", 0, 100, 10))
+    assert [state for chunk in chunks for state in chunk.states] == [
+        state for _, state in states
+    ]
+    assert not list(iter_states(session, "sensor.absent", 0, 100))
+
+
+async def test_aggregate_window():
+    """Test aggregates provide window interface for their period only."""
+    aggregate = AggregateWindow(0, 100, 500, 50, 2, 5, 15, 15, 3)
+    assert aggregate.average(0, 100) == 10
+    with pytest.raises(ValueError):
+        aggregate.average(0, 200)
+
+    # Values are converted as temperature ones
+    converted = aggregate.converted(lambda value: value * 1.8 + 32)
+    assert converted.integrate(0, 100) == pytest.approx((50 * 50, 50))
+    assert converted.extremes(0, 100) == (2, 41, 59)
+    assert converted.last_value == 59
+
+    assert AggregateWindow(0, 100, last_value=5).average(0, 100) == 5
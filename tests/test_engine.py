@@ -0,0 +1,331 @@
+"""The test for the average sensor window engine."""
+from __future__ import annotations
+
+from array import array
+import base64
+import random
+import sys
+
+import pytest
+
+from custom_components.average.engine import (
+    CurrentValues,
+    DecayingAverage,
+    SourceWindow,
+)
+
+
+def _make_window() -> SourceWindow:
+    """Create window with some samples."""
+    window = SourceWindow()
+    window.append(0, 10, True)
+    window.append(10, 20, True)
+    window.append(20, None, False)
+    window.append(30, 30, True)
+    return window
+
+
+async def test_integrate():
+    """Test time-weighted integration."""
+    window = _make_window()
+
+    assert window.integrate(0, 40) == (600, 30)
+    assert window.average(0, 40) == 20
+    assert window.integrate(5, 35) == (400, 20)
+    assert window.extremes(5, 35) == (3, 10, 30)
+
+    assert SourceWindow().integrate(0, 10) == (0, 0)
+    assert SourceWindow().average(0, 10) is None
+
+
+async def test_append():
+    """Test adding of samples."""
+    window = _make_window()
+    assert len(window) == 4
+    assert window.last_ts == 30
+    assert window.last_value == 30
+    assert window.next_ts(15) == 20
+    assert window.next_ts(30) is None
+
+    # Stale samples are ignored
+    window.append(25, 100, True)
+    assert len(window) == 4
+
+    # Sample with the same timestamp replaces the last one
+    window.append(30, 40, True)
+    assert len(window) == 4
+    assert window.integrate(0, 40) == (700, 30)
+
+    window.append(35, None, False)
+    assert window.last_value is None
+
+    window.clear()
+    assert len(window) == 0
+    assert window.last_ts is None
+
+
+async def test_extend():
+    """Test adding of samples batch."""
+    window = SourceWindow()
+    window.extend([0, 10], [10, 20], [True, True])
+    window.extend([10, 20, 30], [25, None, 30], [True, False, True])
+
+    assert len(window) == 4
+    assert window.integrate(0, 40) == (650, 30)
+    assert window.extremes(0, 40) == (3, 10, 30)
+
+    # Stale samples are ignored
+    window.extend([5, 25], [100, 100], [True, True])
+    assert len(window) == 4
+
+    # Big batches give the same result as samples added one by one
+    expected = SourceWindow()
+    expected.append(0, 10, True)
+    expected.append(10, 25, True)
+    expected.append(20, None, False)
+    expected.append(30, 30, True)
+    timestamps = list(range(40, 1000, 3))
+    values = [i % 7 if i % 5 else None for i in timestamps]
+    for timestamp, value in zip(timestamps, values):
+        expected.append(timestamp, value, value is not None)
+    window.extend(timestamps, values, [value is not None for value in values])
+
+    assert window.integrate(0, 1000) == pytest.approx(expected.integrate(0, 1000))
+    assert window.extremes(0, 1000) == expected.extremes(0, 1000)
+
+
+async def test_evict():
+    """Test sliding of the window."""
+    window = _make_window()
+
+    window.evict(15)
+    assert len(window) == 3
+    assert window.integrate(15, 40) == (400, 15)
+    assert window.extremes(15, 40) == (2, 20, 30)
+
+    # Sample in effect at the window start is kept
+    window.evict(100)
+    assert len(window) == 1
+    assert window.average(100, 110) == 30
+
+
+async def test_compact():
+    """Test compaction of evicted samples."""
+    window = SourceWindow()
+    for i in range(2000):
+        window.append(i, i % 10, True)
+        window.evict(i - 100)
+
+    assert len(window) == 101
+    assert window.integrate(1899, 1999) == (450, 100)
+
+
+async def test_sliding_extremes():
+    """Test extremes of the whole window are kept up to date."""
+    rnd = random.Random(42)
+    window = SourceWindow()
+    samples = []
+    for i in range(3000):
+        value = None if rnd.random() < 0.1 else rnd.uniform(-100, 100)
+        samples.append((i, value, value is not None))
+        if rnd.random() < 0.5:
+            window.append(*samples[-1])
+        else:
+            window.extend(*zip(*samples[-1:]))
+        if i % 7 == 0:
+            # Replace value of the last sample
+            value = rnd.uniform(-100, 100)
+            samples[-1] = (i, value, True)
+            window.append(*samples[-1])
+        window.evict(i - 500)
+
+        expected = [value for _, value, measured in samples[-501:] if measured]
+        assert window.extremes(i - 500, i + 1) == (
+            len(expected),
+            min(expected),
+            max(expected),
+        )
+
+    # Extremes survive compaction and copying
+    assert window.copy().extremes(2499, 3000) == window.extremes(2499, 3000)
+    # Partial periods are scanned
+    expected = [value for _, value, measured in samples[-10:] if measured]
+    assert window.extremes(2990, 3000) == (
+        len(expected),
+        min(expected),
+        max(expected),
+    )
+
+
+async def test_copy():
+    """Test copying of windows."""
+    window = _make_window()
+    window.evict(15)
+
+    copy = window.copy()
+    assert len(copy) == len(window)
+    assert copy.integrate(15, 40) == window.integrate(15, 40)
+
+    # Copy is independent of the original window
+    copy.append(50, 100, True)
+    assert window.last_ts == 30
+    assert copy.integrate(15, 60) == (
+        window.integrate(15, 50)[0] + 1000,
+        window.integrate(15, 50)[1] + 10,
+    )
+
+
+async def test_slice():
+    """Test slicing of windows."""
+    window = _make_window()
+    assert window.first_ts == 0
+    assert window.count(0, 40) == 2
+    assert window.count(-1, 40) == 3
+
+    part = window.slice(15, 25)
+    assert part.first_ts == 10
+    assert part.last_ts == 20
+    assert part.integrate(15, 25) == window.integrate(15, 25)
+    assert not window.slice(-20, -10)
+
+
+async def test_channels():
+    """Test integrals of functions of values."""
+    channels = {"square": lambda value: value * value}
+    window = SourceWindow(channels)
+    window.append(0, 10, True)
+    window.append(10, 20, True)
+    window.extend([20, 30], [None, 30], [False, True])
+
+    assert window.integrate_channel("square", 0, 40) == 100 * 10 + 400 * 10 + 900 * 10
+    assert window.integrate_channel("square", 5, 25) == 100 * 5 + 400 * 10
+    assert window.copy().integrate_channel("square", 5, 25) == 100 * 5 + 400 * 10
+    assert SourceWindow.from_dict(window.as_dict(), channels).integrate_channel(
+        "square", 0, 40
+    ) == window.integrate_channel("square", 0, 40)
+
+    # Channels survive clearing and compaction
+    window.clear()
+    for i in range(2000):
+        window.append(i, i % 10, True)
+        window.evict(i - 100)
+    assert window.integrate_channel("square", 1899, 1999) == sum(
+        (i % 10) ** 2 for i in range(1899, 1999)
+    )
+
+
+async def test_sketch():
+    """Test quantile sketch of durations of values."""
+    window = SourceWindow(quantiles=True)
+    window.append(0, 10, True)
+    window.append(10, 20, True)
+    window.extend([20, 30], [None, 30], [False, True])
+
+    sketch = window.sketch(5, 40)
+    assert sketch.weight == 5 + 10 + 10
+    assert sketch.quantile(0.5) == pytest.approx(20, rel=0.01)
+    assert window.sketch(31, 40).weight == 9
+    assert window.sketch(0, 15).quantile(1) == pytest.approx(20, rel=0.01)
+    assert SourceWindow().sketch(0, 40) is None
+
+    # Evicted samples are removed from the sketch
+    window.evict(25)
+    assert window.sketch(25, 40).weight == 10
+    assert window.copy().sketch(25, 40).weight == 10
+    assert SourceWindow.from_dict(window.as_dict(), quantiles=True).sketch(
+        25, 40
+    ).quantile(0.5) == pytest.approx(30, rel=0.01)
+
+
+async def test_serialization():
+    """Test packing of window samples."""
+    window = _make_window()
+    window.evict(15)
+
+    data = window.as_dict()
+    restored = SourceWindow.from_dict(data)
+    assert len(restored) == 3
+    assert restored.integrate(15, 40) == window.integrate(15, 40)
+    assert restored.extremes(15, 40) == window.extremes(15, 40)
+
+    # Samples are restored on machines with other byte order
+    swapped = {"byteorder": "big" if sys.byteorder == "little" else "little"}
+    for typecode, key in (("d", "ts"), ("d", "values"), ("b", "measured")):
+        column = array(typecode, base64.b64decode(data[key]))
+        column.byteswap()
+        swapped[key] = base64.b64encode(column.tobytes()).decode()
+    swapped = SourceWindow.from_dict(swapped)
+    assert swapped.integrate(15, 40) == window.integrate(15, 40)
+
+    with pytest.raises(ValueError):
+        SourceWindow.from_dict(data | {"measured": ""})
+
+
+async def test_current_values():
+    """Test aggregation of current values."""
+    current = CurrentValues()
+    assert current.average is None
+    assert current.min_value is None
+
+    current.update("sensor.a", 10, True)
+    current.update("sensor.b", 20, True)
+    current.update("sensor.c", 0, False)
+    assert len(current) == 3
+    assert current.count == 2
+    assert current.average == 10
+    assert (current.min_value, current.max_value) == (10, 20)
+
+    # Changed value replaces the old one
+    current.update("sensor.a", 40, True)
+    assert current.average == 20
+    assert (current.min_value, current.max_value) == (20, 40)
+
+    current.update("sensor.b", None, False)
+    assert len(current) == 2
+    assert current.count == 1
+    assert (current.min_value, current.max_value) == (40, 40)
+
+    # Outdated heap items do not pile up
+    for i in range(10000):
+        current.update("sensor.a", i % 100, True)
+    assert (current.min_value, current.max_value) == (99, 99)
+    assert len(current._min_heap) < 1000
+
+    current.clear()
+    assert len(current) == 0
+
+
+async def test_decaying_average():
+    """Test exponential averaging with real elapsed time."""
+    decaying = DecayingAverage(10)
+    assert decaying.value(0) is None
+
+    decaying.append(0, 10, True)
+    assert decaying.value(100) == 10
+
+    # Weight of the old average halves every half-life
+    decaying.append(100, 20, True)
+    assert decaying.value(100) == 10
+    assert decaying.value(110) == 15
+    assert decaying.value(120) == 17.5
+
+    # Intervals between samples do not matter
+    other = DecayingAverage(10)
+    other.append(0, 10, True)
+    for ts in range(100, 120, 3):
+        other.append(ts, 20, True)
+    assert other.value(120) == pytest.approx(17.5)
+
+    # Undefined values do not change the average
+    decaying.append(110, None, False)
+    assert decaying.value(1000) == 15
+    assert not decaying.measured
+
+    # Stale samples are ignored
+    decaying.append(50, 100, True)
+    assert decaying.value(1000) == 15
+
+    restored = DecayingAverage.from_dict(decaying.as_dict(), 10)
+    assert restored.value(1000) == 15
+    restored.append(200, 25, True)
+    assert restored.value(210) == 20
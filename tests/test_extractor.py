@@ -0,0 +1,96 @@
+"""The test for the average sensor value extractors."""
+
+from __future__ import annotations
+
+from custom_components.average.extractor import ValueExtractor, is_temperature_entity
+from homeassistant.const import (
+    ATTR_DEVICE_CLASS,
+    ATTR_UNIT_OF_MEASUREMENT,
+    STATE_UNAVAILABLE,
+    STATE_UNKNOWN,
+    UnitOfTemperature,
+)
+
+CELSIUS = {ATTR_UNIT_OF_MEASUREMENT: UnitOfTemperature.CELSIUS}
+FAHRENHEIT = {ATTR_UNIT_OF_MEASUREMENT: UnitOfTemperature.FAHRENHEIT}
+
+
+async def test_parse():
+    """Test parsing of values of generic sources."""
+    extractor = ValueExtractor("sensor.test", {}, False, UnitOfTemperature.CELSIUS)
+
+    assert extractor.parse("21.5", {}) == (21.5, True)
+    assert extractor.parse("qwe", {}) == (None, False)
+    for state in (STATE_UNKNOWN, STATE_UNAVAILABLE, "None", ""):
+        assert extractor.parse(state, {}) == (None, False)
+
+    extractor = ValueExtractor("sensor.test", {}, False, "", "Undef")
+    assert extractor.parse(STATE_UNKNOWN, {}) == ("Undef", False)
+
+
+async def test_temperature():
+    """Test parsing of temperature values."""
+    extractor = ValueExtractor(
+        "sensor.test", FAHRENHEIT, True, UnitOfTemperature.CELSIUS
+    )
+    assert round(extractor.parse("125", FAHRENHEIT)[0], 3) == 51.667
+    assert round(extractor.convert(125), 3) == 51.667
+    assert extractor.parse("qwe", FAHRENHEIT) == (None, False)
+    assert extractor.parse("", FAHRENHEIT) == (None, False)
+
+    # Values in units of Home Assistant are not converted
+    extractor = ValueExtractor("sensor.test", CELSIUS, True, UnitOfTemperature.CELSIUS)
+    assert extractor.parse("25", CELSIUS) == (25, True)
+    assert extractor.convert(25) == 25
+
+    # Temperature of some domains is read from attributes
+    extractor = ValueExtractor("weather.test", {}, True, UnitOfTemperature.CELSIUS)
+    assert extractor.parse("sunny", {"temperature": 25}) == (25, True)
+    assert extractor.parse("sunny", {}) == (None, False)
+
+    extractor = ValueExtractor("climate.test", {}, True, UnitOfTemperature.CELSIUS)
+    assert extractor.get_temperature("heat", {"current_temperature": 16}) == 16
+
+
+async def test_matches():
+    """Test extractors are rebuilt on changes only."""
+    extractor = ValueExtractor(
+        "sensor.test", FAHRENHEIT, True, UnitOfTemperature.CELSIUS
+    )
+    assert extractor.matches(True, FAHRENHEIT, UnitOfTemperature.CELSIUS)
+    assert not extractor.matches(True, CELSIUS, UnitOfTemperature.CELSIUS)
+    assert not extractor.matches(True, FAHRENHEIT, UnitOfTemperature.FAHRENHEIT)
+    assert not extractor.matches(False, FAHRENHEIT, UnitOfTemperature.CELSIUS)
+
+    # Units matter for temperature mode only
+    extractor = ValueExtractor("sensor.test", {}, False, UnitOfTemperature.CELSIUS)
+    assert extractor.matches(False, FAHRENHEIT, UnitOfTemperature.FAHRENHEIT)
+
+    extractor = ValueExtractor("weather.test", {}, True, UnitOfTemperature.CELSIUS)
+    assert extractor.matches(True, FAHRENHEIT, UnitOfTemperature.CELSIUS)
+
+
+async def test_parse_many():
+    """Test parsing of historical states with and without their attributes."""
+    extractor = ValueExtractor(
+        "sensor.test", FAHRENHEIT, True, UnitOfTemperature.CELSIUS
+    )
+    values, measured = extractor.parse_many(["212", STATE_UNKNOWN], FAHRENHEIT)
+    assert values == [100, None]
+    assert measured == [True, False]
+
+    # Units of states may change
+    values, measured = extractor.parse_many(
+        ["212", "20", "32"], {}, [FAHRENHEIT, CELSIUS, FAHRENHEIT]
+    )
+    assert [round(value, 3) for value in values] == [100, 20, 0]
+    assert measured == [True, True, True]
+    assert extractor.unit == UnitOfTemperature.FAHRENHEIT
+
+
+async def test_is_temperature_entity():
+    """Test detection of temperature sources."""
+    assert is_temperature_entity("sensor.test", CELSIUS)
+    assert is_temperature_entity("sensor.test", {ATTR_DEVICE_CLASS: "temperature"})
+    assert is_temperature_entity("weather.test", {})
+    assert not is_temperature_entity("sensor.test", {ATTR_UNIT_OF_MEASUREMENT: "%"})
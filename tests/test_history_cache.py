@@ -0,0 +1,208 @@
+"""The test for the average sensor history cache."""
+from __future__ import annotations
+
+import asyncio
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from custom_components.average.history_cache import (
+    HistoryCache,
+    async_get_history_cache,
+)
+from homeassistant.const import (
+    COMPRESSED_STATE_ATTRIBUTES,
+    COMPRESSED_STATE_LAST_UPDATED,
+    COMPRESSED_STATE_STATE,
+)
+from homeassistant.core import HomeAssistant
+import homeassistant.util.dt as dt_util
+
+TEST_ENTITY = "sensor.test_monitored"
+TEST_HISTORY = [(ts, str(ts)) for ts in range(1000, 2000, 10)]
+
+
+def _get_significant_states(
+    hass,
+    start,
+    end,
+    entity_ids,
+    include_start_time_state=True,
+    significant_changes_only=True,
+    no_attributes=False,
+    compressed_state_format=False,
+):
+    """Emulate recorder history."""
+    start_ts = start.timestamp()
+    end_ts = end.timestamp()
+    states = []
+    for ts, value in TEST_HISTORY:
+        if ts <= start_ts:
+            if include_start_time_state:
+                states = [(start_ts, value)]
+        elif ts <= end_ts:
+            states.append((ts, value))
+    assert compressed_state_format
+    return {
+        entity_id: [
+            {COMPRESSED_STATE_STATE: value, COMPRESSED_STATE_LAST_UPDATED: ts}
+            | ({} if no_attributes else {COMPRESSED_STATE_ATTRIBUTES: {"ts": ts}})
+            for ts, value in states
+        ]
+        for entity_id in entity_ids
+    }
+
+
+@pytest.fixture()
+def mock_history(hass: HomeAssistant):
+    """Mock recorder history requests."""
+    fetch = MagicMock(side_effect=_get_significant_states)
+    recorder = MagicMock()
+    recorder.commit_interval = 5
+    recorder.async_add_executor_job = hass.async_add_executor_job
+    with patch(
+        "custom_components.average.history_cache.get_instance",
+        return_value=recorder,
+    ), patch(
+        "custom_components.average.history_cache.history.get_significant_states",
+        fetch,
+    ):
+        yield fetch
+
+
+def _ts(timestamp: float):
+    """Return datetime from timestamp."""
+    return dt_util.utc_from_timestamp(timestamp)
+
+
+async def test_shared_cache(hass: HomeAssistant):
+    """Test cache is shared."""
+    cache = async_get_history_cache(hass)
+    assert isinstance(cache, HistoryCache)
+    assert async_get_history_cache(hass) is cache
+
+
+async def test_overlapping_requests(hass: HomeAssistant, mock_history):
+    """Test overlapping periods are served from memory."""
+    cache = HistoryCache(hass)
+
+    rows = await cache.async_get(TEST_ENTITY, _ts(1500), _ts(1600))
+    assert mock_history.call_count == 1
+    assert rows.states[:2] == ["1500", "1510"]
+    assert rows.states[-1] == "1600"
+    assert list(rows.timestamps[:2]) == [1500, 1510]
+    assert rows.attributes is None
+
+    # Inner period
+    rows = await cache.async_get(TEST_ENTITY, _ts(1525), _ts(1550))
+    assert mock_history.call_count == 1
+    assert rows.states == ["1520", "1530", "1540", "1550"]
+
+    rows = await cache.async_get(TEST_ENTITY, _ts(1525), _ts(1550), False)
+    assert rows.states == ["1530", "1540", "1550"]
+
+    # Older states are fetched only
+    rows = await cache.async_get(TEST_ENTITY, _ts(1400), _ts(1600))
+    assert mock_history.call_count == 2
+    assert rows.states == [str(ts) for ts in range(1400, 1610, 10)]
+
+    # Newer states are fetched only
+    rows = await cache.async_get(TEST_ENTITY, _ts(1595), _ts(1700), False)
+    assert mock_history.call_count == 3
+    assert rows.states[0] == "1600"
+    assert rows.states[-1] == "1700"
+
+
+async def test_concurrent_requests(hass: HomeAssistant, mock_history):
+    """Test concurrent requests are merged."""
+    cache = HistoryCache(hass)
+
+    results = await asyncio.gather(
+        *[cache.async_get(TEST_ENTITY, _ts(1500), _ts(1600)) for _ in range(5)]
+    )
+
+    assert mock_history.call_count == 1
+    for rows in results:
+        assert len(rows.states) == 11
+
+
+async def test_evict(hass: HomeAssistant, mock_history):
+    """Test least recently used entries are evicted."""
+    cache = HistoryCache(hass, max_rows=20)
+
+    await cache.async_get("sensor.test1", _ts(1500), _ts(1600))
+    await cache.async_get("sensor.test2", _ts(1500), _ts(1600))
+    assert cache.rows == 11
+
+    await cache.async_get("sensor.test2", _ts(1500), _ts(1600))
+    assert mock_history.call_count == 2
+
+    await cache.async_get("sensor.test1", _ts(1500), _ts(1600))
+    assert mock_history.call_count == 3
+
+
+async def test_batched_requests(hass: HomeAssistant, mock_history):
+    """Test history of several entities is fetched by one request."""
+    cache = HistoryCache(hass)
+    entity_ids = [f"sensor.test{i}" for i in range(10)]
+
+    result = await cache.async_get_many(
+        {entity_id: _ts(1500) for entity_id in entity_ids}, _ts(1600)
+    )
+    assert mock_history.call_count == 1
+    assert list(result) == entity_ids
+    for rows in result.values():
+        assert len(rows.states) == 11
+
+    # Newer states are fetched for all entities at once
+    result = await cache.async_get_many(
+        {entity_id: _ts(1500 + i) for i, entity_id in enumerate(entity_ids)},
+        _ts(1700),
+    )
+    assert mock_history.call_count == 2
+    for rows in result.values():
+        assert rows.states[-1] == "1700"
+
+
+async def test_attributes(hass: HomeAssistant, mock_history):
+    """Test attributes are fetched only if they are needed."""
+    cache = HistoryCache(hass)
+
+    rows = await cache.async_get(TEST_ENTITY, _ts(1500), _ts(1600))
+    assert rows.attributes is None
+    assert mock_history.call_args.kwargs["no_attributes"] is True
+
+    rows = await cache.async_get(TEST_ENTITY, _ts(1500), _ts(1600), attributes=True)
+    assert mock_history.call_count == 2
+    assert mock_history.call_args.kwargs["no_attributes"] is False
+    assert rows.attributes[1] == {"ts": 1510}
+
+
+async def test_uncached_requests(hass: HomeAssistant, mock_history):
+    """Test uncached requests do not change cache."""
+    cache = HistoryCache(hass)
+
+    result = await cache.async_get_uncached([TEST_ENTITY], _ts(1500), _ts(1600))
+    rows = result[TEST_ENTITY]
+    assert rows.states[0] == "1500"
+    assert rows.states[-1] == "1600"
+    assert list(rows.timestamps[:2]) == [1500, 1510]
+    assert rows.attributes is None
+    assert cache.rows == 0
+
+
+async def test_run_query(hass: HomeAssistant, mock_history):
+    """Test uncached reads share the limit of concurrent queries."""
+    cache = HistoryCache(hass, max_queries=1)
+    active = []
+
+    def read(value: int) -> int:
+        active.append(value)
+        time.sleep(0.01)
+        assert active == [value]
+        active.remove(value)
+        return value
+
+    results = await asyncio.gather(*(cache.async_run_query(read, i) for i in range(3)))
+    assert results == [0, 1, 2]
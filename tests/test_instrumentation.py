@@ -0,0 +1,51 @@
+"""The test for the average sensor instrumentation."""
+from __future__ import annotations
+
+from unittest.mock import patch
+
+from custom_components.average.instrumentation import (
+    STAGE_COMPUTE,
+    STAGE_FETCH,
+    STAGE_RENDER,
+    UpdateStats,
+)
+
+
+async def test_update_stats():
+    """Test collecting of update counters."""
+    stats = UpdateStats()
+    assert stats.mean_duration == 0
+
+    with patch(
+        "custom_components.average.instrumentation.time.perf_counter",
+        side_effect=[0, 1, 2, 3, 5, 10],
+    ):
+        stats.begin()
+        with stats.measure(STAGE_RENDER):
+            pass
+        with stats.measure(STAGE_FETCH):
+            stats.add_rows("sensor.test", 5)
+            stats.add_rows("sensor.test", 3)
+        stats.end()
+
+    assert stats.updates == 1
+    assert stats.last_stages == {STAGE_RENDER: 1, STAGE_FETCH: 2, STAGE_COMPUTE: 7}
+    assert stats.last_rows == {"sensor.test": 8}
+    assert stats.mean_duration == stats.max_duration == 10
+
+    # Skipped updates are counted but not timed
+    stats.begin()
+    stats.skip()
+    stats.end()
+    assert stats.updates == 2
+    assert stats.skipped == 1
+    assert stats.mean_duration == 10
+
+    data = stats.as_dict()
+    assert data["updates"] == 2
+    assert data["stage_durations"] == {
+        STAGE_RENDER: 1,
+        STAGE_FETCH: 2,
+        STAGE_COMPUTE: 7,
+    }
+    assert data["last_update"]["skipped"] is True
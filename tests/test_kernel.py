@@ -0,0 +1,53 @@
+"""The test for the average sensor averaging kernel."""
+from __future__ import annotations
+
+import math
+from unittest.mock import patch
+
+import pytest
+
+from custom_components.average import kernel
+from custom_components.average.kernel import extremes, prefix_sums
+
+TEST_TIMESTAMPS = [float(ts) for ts in range(0, 1000, 10)]
+TEST_VALUES = [math.nan if i % 7 == 3 else (i * 37) % 23 - 11.5 for i in range(100)]
+TEST_MEASURED = [not math.isnan(value) for value in TEST_VALUES]
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def kernel_mode(request):
+    """Run test with and without NumPy."""
+    if request.param:
+        pytest.importorskip("numpy")
+        yield
+    else:
+        with patch.object(kernel, "np", None):
+            yield
+
+
+async def test_prefix_sums(kernel_mode):
+    """Test running integrals."""
+    integrals, elapsed = prefix_sums(TEST_TIMESTAMPS, TEST_VALUES, 5, 1)
+
+    assert len(integrals) == len(elapsed) == 100
+    assert integrals[0] == 5
+    assert elapsed[0] == 1
+    assert integrals[1] == pytest.approx(5 + TEST_VALUES[0] * 10)
+    # Time of undefined value is not covered
+    assert elapsed[3] - elapsed[2] == 10
+    assert elapsed[4] - elapsed[3] == 0
+    assert elapsed[-1] == pytest.approx(1 + 990 - 14 * 10)
+
+    assert [len(sums) for sums in prefix_sums([], [])] == [0, 0]
+
+
+async def test_extremes(kernel_mode):
+    """Test count and extremes of measured values."""
+    defined = [value for value in TEST_VALUES if not math.isnan(value)]
+
+    assert extremes(TEST_VALUES, TEST_MEASURED) == (
+        len(defined),
+        min(defined),
+        max(defined),
+    )
+    assert extremes(TEST_VALUES, [False] * 100) == (0, None, None)
@@ -0,0 +1,103 @@
+"""The test for the average sensor long-term statistics."""
+from __future__ import annotations
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from custom_components.average.long_term import (
+    HOUR,
+    HourlyStatistics,
+    ceil_hour,
+    floor_hour,
+)
+from homeassistant.core import HomeAssistant
+import homeassistant.util.dt as dt_util
+
+TEST_ENTITY = "sensor.test_monitored"
+
+
+def _statistics_during_period(
+    hass, start_time, end_time, statistic_ids, period, units, types
+):
+    """Emulate recorder statistics of hours with mean equal to hour number."""
+    assert period == "hour"
+    assert types == {"mean", "min", "max"}
+    start_ts = start_time.timestamp()
+    end_ts = end_time.timestamp()
+    return {
+        statistic_id: [
+            {
+                "start": hour * HOUR,
+                "mean": hour,
+                "min": hour - 1,
+                "max": hour + 1,
+            }
+            for hour in range(int(start_ts // HOUR), int(end_ts // HOUR))
+            if hour % 10  # Every tenth hour is missing
+        ]
+        for statistic_id in statistic_ids
+    }
+
+
+@pytest.fixture()
+def mock_statistics(hass: HomeAssistant):
+    """Mock recorder statistics requests."""
+    fetch = MagicMock(side_effect=_statistics_during_period)
+    recorder = MagicMock()
+    recorder.async_add_executor_job = hass.async_add_executor_job
+    with patch(
+        "custom_components.average.long_term.get_instance",
+        return_value=recorder,
+    ), patch(
+        "custom_components.average.long_term.statistics_during_period",
+        fetch,
+    ):
+        yield fetch
+
+
+async def test_hours():
+    """Test rounding of timestamps to hours."""
+    assert floor_hour(3 * HOUR + 10) == 3 * HOUR
+    assert ceil_hour(3 * HOUR + 10) == 4 * HOUR
+    assert floor_hour(3 * HOUR) == ceil_hour(3 * HOUR) == 3 * HOUR
+
+
+async def test_hourly_statistics(hass: HomeAssistant, mock_statistics):
+    """Test fetching and integration of hourly statistics."""
+    statistics = HourlyStatistics()
+
+    await statistics.async_update(hass, [TEST_ENTITY], 11 * HOUR, 15 * HOUR)
+    assert mock_statistics.call_count == 1
+    assert statistics.end_ts(TEST_ENTITY) == 15 * HOUR
+    assert statistics.integrate(TEST_ENTITY, 11 * HOUR, 15 * HOUR) == (
+        (11 + 12 + 13 + 14) * HOUR,
+        4 * HOUR,
+    )
+    assert statistics.integrate(TEST_ENTITY, 12 * HOUR, 14 * HOUR) == (
+        (12 + 13) * HOUR,
+        2 * HOUR,
+    )
+    assert statistics.extremes(TEST_ENTITY, 11 * HOUR, 15 * HOUR) == (4, 10, 15)
+
+    # Known hours are not fetched again
+    await statistics.async_update(hass, [TEST_ENTITY], 12 * HOUR, 15 * HOUR)
+    assert mock_statistics.call_count == 1
+
+    await statistics.async_update(hass, [TEST_ENTITY], 13 * HOUR, 22 * HOUR)
+    assert mock_statistics.call_count == 2
+    assert mock_statistics.call_args.args[1] == dt_util.utc_from_timestamp(
+        15 * HOUR
+    )
+    assert statistics.end_ts(TEST_ENTITY) == 22 * HOUR
+
+    # Missing hours are not covered, and hours before the period are dropped
+    assert statistics.integrate(TEST_ENTITY, 0, 22 * HOUR) == (
+        (13 + 14 + 15 + 16 + 17 + 18 + 19 + 21) * HOUR,
+        8 * HOUR,
+    )
+
+    statistics.clear()
+    assert statistics.end_ts(TEST_ENTITY) is None
+    assert statistics.integrate(TEST_ENTITY, 0, 22 * HOUR) == (0, 0)
+    assert statistics.extremes(TEST_ENTITY, 0, 22 * HOUR) == (0, None, None)
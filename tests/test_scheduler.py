@@ -0,0 +1,70 @@
+"""The test for the average sensor startup scheduler."""
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+
+from custom_components.average.scheduler import (
+    StartupScheduler,
+    async_get_startup_scheduler,
+)
+from homeassistant.core import HomeAssistant
+
+
+async def test_shared_scheduler(hass: HomeAssistant):
+    """Test scheduler is shared."""
+    scheduler = async_get_startup_scheduler(hass)
+    assert isinstance(scheduler, StartupScheduler)
+    assert async_get_startup_scheduler(hass) is scheduler
+
+
+async def test_priorities(hass: HomeAssistant):
+    """Test jobs are started in order of priorities."""
+    scheduler = StartupScheduler(hass, 1, timedelta(0))
+    started = []
+
+    def make_job(name: str):
+        async def job() -> None:
+            started.append(name)
+            await asyncio.sleep(0)
+
+        return job
+
+    for priority, name in ((3600, "hour"), (60, "minute"), (86400, "day")):
+        scheduler.async_schedule(priority, make_job(name))
+    assert len(scheduler) == 3
+
+    for _ in range(20):
+        await asyncio.sleep(0)
+    assert started == ["minute", "hour", "day"]
+    assert len(scheduler) == 0
+
+
+async def test_concurrency_limit(hass: HomeAssistant):
+    """Test count of simultaneously running jobs is limited."""
+    scheduler = StartupScheduler(hass, 2, timedelta(0))
+    running = 0
+    max_running = 0
+    release = asyncio.Event()
+
+    async def job() -> None:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await release.wait()
+        running -= 1
+
+    for _ in range(5):
+        scheduler.async_schedule(0, job)
+
+    for _ in range(20):
+        await asyncio.sleep(0)
+    assert running == 2
+    assert len(scheduler) == 3
+
+    release.set()
+    for _ in range(20):
+        await asyncio.sleep(0)
+    assert running == 0
+    assert max_running == 2
+    assert len(scheduler) == 0
@@ -2,21 +2,57 @@
 # pylint: disable=redefined-outer-name
 from __future__ import annotations
 
-from asyncio import sleep
+from asyncio import Event, sleep
+from collections import defaultdict
 from datetime import timedelta
 import logging
-from unittest.mock import MagicMock, patch
+import math
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from pytest import raises
-from pytest_homeassistant_custom_component.common import assert_setup_component
+from pytest_homeassistant_custom_component.common import (
+    assert_setup_component,
+    async_fire_time_changed,
+)
 from voluptuous import Invalid
 
-from custom_components.average.const import CONF_DURATION, CONF_END, CONF_START, DOMAIN
+from custom_components.average.const import (
+    ATTR_INTEGRAL,
+    ATTR_STANDARD_DEVIATION,
+    ATTR_TIME_ABOVE,
+    ATTR_TIME_BELOW,
+    ATTR_VARIANCE,
+    BACKEND_DATABASE,
+    CONF_BACKEND,
+    CONF_BUCKET_SIZE,
+    CONF_DURATION,
+    CONF_DURATIONS,
+    CONF_END,
+    CONF_HALF_LIFE,
+    CONF_PERCENTILES,
+    CONF_PUSH_UPDATES,
+    CONF_START,
+    CONF_STATISTICS,
+    CONF_THRESHOLD,
+    CONF_USE_STATISTICS,
+    DATA_EXECUTOR_THRESHOLD,
+    DOMAIN,
+)
+from custom_components.average.buckets import BucketWindow
+from custom_components.average.engine import SourceWindow
+from custom_components.average.history_cache import HistoryRows
+from custom_components.average.sketch import QuantileSketch
 from custom_components.average.sensor import (
     AverageSensor,
     async_setup_platform,
+    check_backend,
+    check_bucket_size,
+    check_durations,
+    check_half_life,
     check_period_keys,
+    check_threshold,
+    check_use_statistics,
 )
 from homeassistant.components.climate import DOMAIN as CLIMATE_DOMAIN
 from homeassistant.components.sensor import DOMAIN as SENSOR, SensorDeviceClass
@@ -29,6 +65,7 @@ from homeassistant.const import (
     CONF_ENTITIES,
     CONF_NAME,
     CONF_PLATFORM,
+    CONF_UNIQUE_ID,
     STATE_UNAVAILABLE,
     STATE_UNKNOWN,
     UnitOfTemperature,
@@ -111,6 +148,67 @@ async def test_invalid_check_period_keys(hass: HomeAssistant):
         )
 
 
+async def test_check_threshold():
+    """Test threshold check."""
+    assert check_threshold({CONF_STATISTICS: [ATTR_VARIANCE]})
+    assert check_threshold({CONF_STATISTICS: [ATTR_TIME_ABOVE], CONF_THRESHOLD: 1})
+    with raises(Invalid):
+        check_threshold({CONF_STATISTICS: [ATTR_TIME_BELOW]})
+
+
+async def test_check_bucket_size():
+    """Test bucket size check."""
+    size = timedelta(minutes=1)
+    assert check_bucket_size({CONF_BUCKET_SIZE: size, CONF_USE_STATISTICS: False})
+    assert check_bucket_size({CONF_USE_STATISTICS: True, CONF_PERCENTILES: [50]})
+    with raises(Invalid):
+        check_bucket_size({CONF_BUCKET_SIZE: size, CONF_USE_STATISTICS: True})
+    with raises(Invalid):
+        check_bucket_size({CONF_BUCKET_SIZE: size, CONF_PERCENTILES: [50]})
+
+
+async def test_check_use_statistics():
+    """Test long-term statistics check."""
+    assert check_use_statistics({CONF_USE_STATISTICS: False, CONF_PERCENTILES: [50]})
+    assert check_use_statistics({CONF_USE_STATISTICS: True, CONF_STATISTICS: []})
+    with raises(Invalid):
+        check_use_statistics({CONF_USE_STATISTICS: True, CONF_STATISTICS: ["integral"]})
+    with raises(Invalid):
+        check_use_statistics({CONF_USE_STATISTICS: True, CONF_PERCENTILES: [50]})
+
+
+async def test_check_backend():
+    """Test database backend check."""
+    assert check_backend({CONF_BACKEND: BACKEND_DATABASE, CONF_PUSH_UPDATES: False})
+    assert check_backend({CONF_PUSH_UPDATES: True})
+    with raises(Invalid):
+        check_backend({CONF_BACKEND: BACKEND_DATABASE, CONF_PUSH_UPDATES: True})
+    with raises(Invalid):
+        check_backend({CONF_BACKEND: BACKEND_DATABASE, CONF_STATISTICS: ["integral"]})
+
+
+async def test_check_half_life():
+    """Test half-life check."""
+    half_life = timedelta(minutes=5)
+    assert check_half_life({CONF_HALF_LIFE: half_life})
+    with raises(Invalid):
+        check_half_life({CONF_HALF_LIFE: half_life, CONF_DURATION: half_life})
+
+
+async def test_check_durations():
+    """Test durations check."""
+    durations = [timedelta(minutes=5), timedelta(hours=1)]
+    assert check_period_keys({CONF_DURATIONS: durations})
+    assert check_period_keys({CONF_DURATIONS: durations, CONF_END: 10})
+    assert check_durations({CONF_DURATIONS: durations, CONF_USE_STATISTICS: False})
+    with raises(Invalid):
+        check_period_keys({CONF_DURATIONS: durations, CONF_START: 11, CONF_END: 12})
+    with raises(Invalid):
+        check_durations({CONF_DURATIONS: durations, CONF_DURATION: durations[0]})
+    with raises(Invalid):
+        check_durations({CONF_DURATIONS: durations, CONF_BACKEND: BACKEND_DATABASE})
+
+
 async def test_setup_platform(hass: HomeAssistant):
     """Test platform setup."""
     async_add_entities = MagicMock()
@@ -127,6 +225,73 @@ async def test_setup_platform(hass: HomeAssistant):
     assert async_add_entities.called
 
 
+async def test_durations(hass: HomeAssistant):
+    """Test sensors of shorter durations are computed from the longest window."""
+    async_add_entities = MagicMock()
+    config = {
+        CONF_PLATFORM: DOMAIN,
+        CONF_NAME: "test",
+        CONF_UNIQUE_ID: "test",
+        CONF_ENTITIES: TEST_ENTITY_IDS[:1],
+        CONF_END: Template("{{ now() }}"),
+        CONF_DURATIONS: [
+            timedelta(minutes=15),
+            timedelta(hours=1),
+            timedelta(minutes=15),
+        ],
+    }
+
+    await async_setup_platform(hass, config, async_add_entities, None)
+    leader, follower = async_add_entities.call_args[0][0]
+    assert (leader.name, follower.name) == ("test 1h", "test 15m")
+    assert (leader.unique_id, follower.unique_id) == ("test_1h", "test_15m")
+    assert leader._followers == [follower]
+    assert leader.should_poll is True
+    assert follower.should_poll is False
+
+    # Follower samples the window of the leader without fetching history
+    follower.hass = hass
+    entity_id = TEST_ENTITY_IDS[0]
+    hass.states.async_set(entity_id, "20")
+    now_ts = math.floor(dt_util.utcnow().timestamp())
+    window = leader._new_window()
+    window.append(now_ts - 3600, 10, True)
+    window.append(now_ts - 600, 20, True)
+    await follower._async_compute_follower({entity_id: window}, now_ts)
+    assert follower.native_value == pytest.approx(16.67, abs=0.05)
+    assert len(window) == 2
+
+
+async def test_durations_push_updates(hass: HomeAssistant):
+    """Test push updates are scheduled when samples slide out of followers."""
+    async_add_entities = MagicMock()
+    config = {
+        CONF_PLATFORM: DOMAIN,
+        CONF_NAME: "test",
+        CONF_ENTITIES: TEST_ENTITY_IDS[:1],
+        CONF_END: Template("{{ now() }}"),
+        CONF_DURATIONS: [timedelta(minutes=15), timedelta(hours=1)],
+        CONF_PUSH_UPDATES: True,
+    }
+    await async_setup_platform(hass, config, async_add_entities, None)
+    leader, follower = async_add_entities.call_args[0][0]
+
+    now = dt_util.utcnow().replace(microsecond=0)
+    now_ts = now.timestamp()
+    window = leader._windows[TEST_ENTITY_IDS[0]] = leader._new_window()
+    window.append(now_ts - 3000, 10, True)
+    window.append(now_ts - 600, 20, True)
+    leader._window_period = now_ts - 3600, now_ts
+    follower._period = now - timedelta(minutes=15), now
+
+    with patch.object(dt_util, "utcnow", return_value=now), patch(
+        "custom_components.average.sensor.async_track_point_in_utc_time"
+    ) as track_point:
+        leader._async_schedule_push_update()
+    # The second sample slides out of the follower window first
+    assert track_point.call_args[0][2] == now + timedelta(minutes=5)
+
+
 async def test_entity_initialization(hass: HomeAssistant, default_sensor):
     """Test sensor initialization."""
     expected_attributes = {
@@ -426,6 +591,361 @@ async def test_update(default_sensor):
         assert ups.call_count == 1
 
 
+# pylint: disable=protected-access
+async def test_push_updates(hass: HomeAssistant):
+    """Test push-updated sensor adds new states to its windows."""
+    entity = AverageSensor(
+        hass,
+        TEST_UNIQUE_ID,
+        TEST_NAME,
+        None,
+        Template("{{ now() }}"),
+        timedelta(minutes=3),
+        TEST_ENTITY_IDS,
+        2,
+        None,
+        True,
+    )
+    entity.hass = hass
+    entity_id = TEST_ENTITY_IDS[0]
+
+    assert entity.should_poll is False
+
+    # States are ignored if windows are not filled from history
+    entity._add_sample(entity_id, State(entity_id, "10"))
+    assert not entity._windows
+
+    # States are postponed while windows are being filled
+    entity._pending_samples = []
+    entity._add_sample(entity_id, State(entity_id, "20"))
+    assert len(entity._pending_samples) == 1
+
+    entity._windows[entity_id] = SourceWindow()
+    entity._windows_live = True
+    entity._add_sample(entity_id, State(entity_id, "30"))
+    assert entity._windows[entity_id].last_value == 30
+
+
+async def test_push_update_coalescing(hass: HomeAssistant, default_sensor):
+    """Test bursts of source changes cause one update at a time."""
+    computed = Event()
+    default_sensor._async_compute_state = AsyncMock(side_effect=computed.wait)
+    default_sensor.async_write_ha_state = MagicMock()
+    default_sensor._async_schedule_push_update = MagicMock()
+
+    # Burst of changes is coalesced into one update
+    for _ in range(30):
+        default_sensor._async_debounce_push_update()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=1))
+    await sleep(0)
+    assert default_sensor._async_compute_state.call_count == 1
+
+    # Changes during the update cause one follow-up update
+    for _ in range(3):
+        default_sensor._async_queue_push_update()
+    await sleep(0)
+    assert default_sensor._async_compute_state.call_count == 1
+
+    computed.set()
+    await hass.async_block_till_done()
+    assert default_sensor._async_compute_state.call_count == 2
+
+    # Poll updates wait for push ones too
+    computed.clear()
+    default_sensor._async_queue_push_update()
+    await sleep(0)
+    hass.async_create_task(default_sensor._async_update_state())
+    await sleep(0)
+    assert default_sensor._async_compute_state.call_count == 3
+    computed.set()
+    await hass.async_block_till_done()
+    assert default_sensor._async_compute_state.call_count == 4
+
+
+async def test_current_values_coalescing(hass: HomeAssistant):
+    """Test bursts of source changes of sensor without a period write it once."""
+    entity_ids = [f"sensor.test_{index}" for index in range(30)]
+    entity = AverageSensor(
+        hass, TEST_UNIQUE_ID, TEST_NAME, None, None, None, entity_ids, 2, None
+    )
+    entity.hass = hass
+    entity.async_write_ha_state = MagicMock()
+
+    for index, entity_id in enumerate(entity_ids):
+        entity._update_current_value(entity_id, State(entity_id, str(index)))
+        entity._async_debounce_push_update()
+    async_fire_time_changed(hass, dt_util.utcnow() + timedelta(seconds=1))
+    await hass.async_block_till_done()
+    assert entity.async_write_ha_state.call_count == 1
+    assert entity.native_value == 14.5
+    assert entity.available_sources == 30
+
+
+async def test_push_update_after_removal(hass: HomeAssistant, default_sensor):
+    """Test push updates stop when the sensor is removed."""
+    default_sensor._async_compute_state = AsyncMock()
+    default_sensor.async_write_ha_state = MagicMock()
+    default_sensor._async_schedule_push_update = MagicMock()
+
+    await default_sensor._async_push_update()
+    assert default_sensor._async_schedule_push_update.call_count == 1
+
+    await default_sensor.async_will_remove_from_hass()
+    await default_sensor._async_push_update()
+    assert default_sensor._async_compute_state.call_count == 1
+    assert default_sensor._async_schedule_push_update.call_count == 1
+
+
+async def test_decaying_values(hass: HomeAssistant):
+    """Test exponential averages of current values are kept and restored."""
+    entity = AverageSensor(
+        hass,
+        TEST_UNIQUE_ID,
+        TEST_NAME,
+        None,
+        None,
+        None,
+        TEST_ENTITY_IDS[:1],
+        2,
+        None,
+        half_life=timedelta(seconds=10),
+    )
+    entity.hass = hass
+    entity_id = TEST_ENTITY_IDS[0]
+    assert entity.should_poll is True
+
+    now = dt_util.utcnow()
+    with patch.object(dt_util, "utcnow", return_value=now):
+        entity._update_current_value(
+            entity_id, State(entity_id, "10", last_updated=now)
+        )
+        entity._apply_current_values()
+        assert entity.native_value == 10
+
+        state = State(entity_id, "20", last_updated=now + timedelta(seconds=10))
+        entity._update_current_value(entity_id, state)
+    with patch.object(dt_util, "utcnow", return_value=now + timedelta(seconds=20)):
+        entity._update_decaying_values()
+        # 10 was in effect until the new value, then 20 for one half-life
+        assert entity.native_value == 15
+
+    # Averages are stored and restored without history
+    data = {
+        "decaying": {
+            entity_id: decaying.as_dict()
+            for entity_id, decaying in entity._decaying.items()
+        }
+    }
+    restored = AverageSensor(
+        hass,
+        TEST_UNIQUE_ID,
+        TEST_NAME,
+        None,
+        None,
+        None,
+        TEST_ENTITY_IDS[:1],
+        2,
+        None,
+        half_life=timedelta(seconds=10),
+    )
+    restored.hass = hass
+    restored._store = MagicMock()
+    restored._store.async_load = AsyncMock(return_value=data)
+    await restored._async_restore_decaying()
+    with patch.object(dt_util, "utcnow", return_value=now + timedelta(seconds=20)):
+        restored._update_decaying_values()
+        assert restored.native_value == 15
+
+
+async def test_late_states_in_buckets(default_sensor):
+    """Test buckets that may still get states are not folded."""
+    entity_id = TEST_ENTITY_IDS[0]
+    default_sensor._bucket_size = 60
+    window = default_sensor._windows[entity_id] = BucketWindow(60)
+    source = SourceWindow()
+    for ts, value in ((960, 10), (1100, 20)):
+        window.append(ts, value, True)
+        source.append(ts, value, True)
+
+    with patch(
+        "custom_components.average.sensor.get_instance",
+        return_value=MagicMock(commit_interval=30),
+    ):
+        await default_sensor._async_update_buckets(960, 1205)
+    assert window.end_ts == 1140
+
+    # State is committed to the database after the update
+    window.append(1150, 40, True)
+    source.append(1150, 40, True)
+    assert window.average(960, 1205) == pytest.approx(source.average(960, 1205))
+
+
+async def test_restore_windows(hass: HomeAssistant, default_sensor):
+    """Test collected samples are stored and restored."""
+    entity_id = TEST_ENTITY_IDS[0]
+    window = default_sensor._windows[entity_id] = SourceWindow()
+    window.append(100, 10, True)
+    window.append(200, 20, True)
+    default_sensor._window_period = 100, 300
+
+    data = default_sensor._windows_to_store()
+
+    entity = AverageSensor(
+        hass,
+        TEST_UNIQUE_ID,
+        TEST_NAME,
+        None,
+        Template("{{ now() }}"),
+        timedelta(minutes=3),
+        TEST_ENTITY_IDS,
+        2,
+        None,
+    )
+    entity.hass = hass
+    entity._store = MagicMock()
+    entity._store.async_load = AsyncMock(return_value=data)
+    await entity._async_restore_windows()
+
+    assert entity._window_period == (100, 300)
+    assert entity._windows[entity_id].integrate(100, 300) == (3000, 200)
+
+    # Samples collected with other options are dropped
+    entity._windows = {}
+    entity._undef = 0
+    await entity._async_restore_windows()
+    assert not entity._windows
+
+    # Broken data is ignored
+    entity._windows = {}
+    entity._store.async_load = AsyncMock(return_value={"windows": {entity_id: {}}})
+    await entity._async_restore_windows()
+    assert not entity._windows
+
+    # Stored data is removed with the sensor
+    entity._store.async_remove = AsyncMock()
+    await entity.async_removed_from_registry()
+    assert entity._store.async_remove.call_count == 1
+
+
+async def test_extend_window_in_executor(hass: HomeAssistant, default_sensor):
+    """Test large batches of historical states are processed in executor."""
+    entity_id = TEST_ENTITY_IDS[0]
+    rows = HistoryRows([100.0, 200.0, 300.0], ["10", "20", STATE_UNAVAILABLE], None)
+    default_sensor._temperature_mode = False
+    hass.data[DATA_EXECUTOR_THRESHOLD] = 3
+
+    with patch.object(
+        hass, "async_add_executor_job", wraps=hass.async_add_executor_job
+    ) as executor:
+        window = SourceWindow()
+        result = await default_sensor._async_extend_window(window, entity_id, rows, {})
+        assert executor.call_count == 1
+        # Only the extractor prepared on the event loop is used in executor
+        assert executor.call_args[0][2] is default_sensor._extractors[entity_id]
+
+        # Extended copy of the window is returned
+        assert result is not window
+        assert not window
+        assert result.integrate(100, 400) == (3000, 200)
+
+        rows = HistoryRows([400.0, 500.0], ["30", "40"], None)
+        assert (
+            await default_sensor._async_extend_window(result, entity_id, rows, {})
+            is result
+        )
+        assert executor.call_count == 1
+
+
+async def test_statistics(hass: HomeAssistant):
+    """Test additional statistics are computed from windows of sources."""
+    entity = AverageSensor(
+        hass,
+        TEST_UNIQUE_ID,
+        TEST_NAME,
+        None,
+        Template("{{ now() }}"),
+        timedelta(minutes=3),
+        TEST_ENTITY_IDS,
+        2,
+        None,
+        statistics=[
+            ATTR_VARIANCE,
+            ATTR_STANDARD_DEVIATION,
+            ATTR_INTEGRAL,
+            ATTR_TIME_ABOVE,
+            ATTR_TIME_BELOW,
+        ],
+        threshold=15,
+        percentiles=[50, 95],
+    )
+
+    window = entity._new_window()
+    window.append(0, 10, True)
+    window.append(1800, 20, True)
+    sums = defaultdict(float)
+    sketch = QuantileSketch()
+    entity._add_statistics(sums, sketch, window, 0, 3600)
+    entity._apply_statistics(sums, sketch)
+
+    assert entity.variance == 25
+    assert entity.standard_deviation == 5
+    assert entity.integral == 15
+    assert entity.time_above == 1800
+    assert entity.time_below == 1800
+    assert entity.percentiles == {
+        "50": pytest.approx(20, rel=0.01),
+        "95": pytest.approx(20, rel=0.01),
+    }
+
+    attributes = entity.extra_state_attributes
+    assert attributes[ATTR_VARIANCE] == 25
+    assert attributes[ATTR_TIME_ABOVE] == 1800
+
+    # Statistics are dropped if no source has values
+    entity._apply_statistics(defaultdict(float), QuantileSketch())
+    assert entity.variance is None
+    assert entity.percentiles is None
+    assert ATTR_VARIANCE not in entity.extra_state_attributes
+
+
+async def test__parse_period_bound():
+    """Test parsing of rendered period templates."""
+    assert AverageSensor._parse_period_bound(
+        "2024-05-01T12:00:00+00:00"
+    ) == dt_util.parse_datetime("2024-05-01T12:00:00+00:00")
+    assert AverageSensor._parse_period_bound(86400.5) == dt_util.as_local(
+        dt_util.utc_from_timestamp(86400)
+    )
+    assert AverageSensor._parse_period_bound("86400") == dt_util.as_local(
+        dt_util.utc_from_timestamp(86400)
+    )
+    assert AverageSensor._parse_period_bound("abc") is None
+    assert AverageSensor._parse_period_bound(None) is None
+
+
+# pylint: disable=protected-access
+async def test__get_period_bound(hass: HomeAssistant, default_sensor):
+    """Test period templates values are cached."""
+    now = dt_util.now()
+    template = Template("{{ 86400 }}", hass)
+
+    assert default_sensor._get_period_bound(
+        template, CONF_START, now
+    ) == dt_util.as_local(dt_util.utc_from_timestamp(86400))
+
+    # Cached values are used without rendering
+    value = now - timedelta(hours=1)
+    default_sensor._template_values[CONF_START] = value
+    assert default_sensor._get_period_bound(template, CONF_START, now) == value
+
+    default_sensor._template_values[CONF_START] = None
+    assert default_sensor._get_period_bound(template, CONF_START, now) == now
+
+    # Invalid values are reported
+    template = Template("{{ 'abc' }}", hass)
+    assert default_sensor._get_period_bound(template, CONF_END, now) is None
+
+
 # pylint: disable=protected-access
 async def test__update_period(default_sensor):
     """Test period updater."""
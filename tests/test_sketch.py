@@ -0,0 +1,89 @@
+"""The test for the average sensor quantile sketch."""
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from custom_components.average.sketch import QuantileSketch
+
+
+def _exact_quantile(samples: list[tuple[float, float]], q: float) -> float:
+    """Return exact weighted quantile of samples."""
+    samples = sorted(samples)
+    rank = q * sum(weight for _, weight in samples)
+    cumulative = 0.0
+    for value, weight in samples:
+        cumulative += weight
+        if cumulative > rank:
+            return value
+    return samples[-1][0]
+
+
+async def test_quantile():
+    """Test quantiles are within the relative accuracy."""
+    rnd = random.Random(1)
+    samples = [(rnd.uniform(-20, 40), rnd.uniform(1, 60)) for _ in range(10000)]
+    sketch = QuantileSketch()
+    for value, weight in samples:
+        sketch.add(value, weight)
+
+    for q in (0, 0.05, 0.5, 0.95, 1):
+        exact = _exact_quantile(samples, q)
+        assert sketch.quantile(q) == pytest.approx(exact, rel=0.01, abs=0.1)
+
+    assert QuantileSketch().quantile(0.5) is None
+
+
+async def test_weights():
+    """Test time-weighted quantiles."""
+    sketch = QuantileSketch()
+    sketch.add(10, 100)
+    sketch.add(0, 50)
+    sketch.add(-5, 10)
+
+    assert sketch.quantile(0) == pytest.approx(-5, rel=0.01)
+    assert sketch.quantile(0.2) == 0
+    assert sketch.quantile(0.5) == pytest.approx(10, rel=0.01)
+
+    # Values are removed by negative weights
+    sketch.add(10, -100)
+    assert sketch.weight == 60
+    assert sketch.quantile(1) == 0
+
+
+async def test_merge():
+    """Test merging of sketches."""
+    first = QuantileSketch()
+    first.add(10, 100)
+    second = QuantileSketch()
+    second.add(20, 10)
+
+    merged = first.copy()
+    merged.merge(second, 10)
+    assert merged.weight == 200
+    assert merged.quantile(0.25) == pytest.approx(10, rel=0.01)
+    assert merged.quantile(0.75) == pytest.approx(20, rel=0.01)
+
+    # Sketches are independent
+    assert first.weight == 100
+
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(0.05))
+
+
+async def test_collapse():
+    """Test memory of sketch is bounded."""
+    sketch = QuantileSketch(max_bins=10)
+    for i in range(1, 1000):
+        sketch.add(i)
+
+    assert len(sketch._positive) <= 10
+    assert sketch.weight == 999
+    assert sketch.quantile(1) == pytest.approx(999, rel=0.01)
+
+    # Values of collapsed bins are removed from the lowest bin
+    for i in range(1, 500):
+        sketch.add(i, -1)
+    assert sketch.weight == 500
+    assert sketch.quantile(0.9) == pytest.approx(950, rel=0.01)